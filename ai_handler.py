@@ -1,67 +1,338 @@
-import requests
+import json
 import os
-import ollama
-from ollama import ChatResponse 
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator
+
+import http_client
+import llm_cache
+import metrics
+import router
+import scheduler
+
+if TYPE_CHECKING:
+    from ollama import ChatResponse
+
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+
+response_cache: llm_cache.ResponseCache | None = None
+
+
+def configure_cache(cache: llm_cache.ResponseCache | None) -> None:
+    global response_cache
+    response_cache = cache
+
+
+# paces and retries every provider request, replaced with the configured limits by configure_scheduler
+request_scheduler = scheduler.RequestScheduler()
+
+
+def configure_scheduler(new_scheduler: scheduler.RequestScheduler) -> None:
+    global request_scheduler
+    request_scheduler = new_scheduler
+
+
+# spreads requests over ollama hosts and hedges slow ones, see configure_router
+request_router = router.Router()
+
+
+def configure_router(new_router: router.Router) -> None:
+    global request_router
+    request_router = new_router
+
+
+# how long ollama keeps the model loaded after a request, and options sent with every ollama request
+# (e.g. num_ctx), see configure_ollama
+ollama_keep_alive: str | float | None = None
+ollama_options: Dict[str, Any] = {}
+
+
+def configure_ollama(settings: Dict[str, Any] | None) -> None:
+    """
+    Set the session options of ollama requests from the `ollama` section of config.yaml.
+
+    keep_alive keeps the model, and with it the evaluated prompt prefix, loaded between chunks instead
+    of letting ollama unload it after its default five idle minutes. Every other key (e.g. num_ctx) is
+    sent as a model option with every request, under the request's own llm_options. They must not change
+    between requests, a different num_ctx makes ollama reload the model.
+
+    Args:
+        settings (dict or None): The `ollama` config section, e.g. {"keep_alive": "30m", "num_ctx": 8192}.
+    """
+
+    global ollama_keep_alive, ollama_options
+    settings = dict(settings or {})
+    ollama_keep_alive = settings.pop("keep_alive", None)
+    ollama_options = {name: value for name, value in settings.items() if value is not None}
+
+
+def _ollama_messages(prompt: str, system_prompt: str) -> list[Dict[str, str]]:
+    # the system prompt is the same for every chunk of a run and comes first, so the model's cached
+    # evaluation of it is reused and only the chunk at the end is read anew
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}]
+
+
+_ollama_clients: Dict[str, Any] = {}
+
+
+def get_ollama_client(host: str | None = None) -> Any:
+    # imported on first use, the ollama package (and pydantic with it) takes longer to import than the rest of the app
+    import ollama
+
+    # the ollama module's own functions talk to the default host (OLLAMA_HOST)
+    if host is None:
+        return ollama
+    client = _ollama_clients.get(host)
+    if client is None:
+        client = _ollama_clients.setdefault(host, ollama.Client(host=host))
+    return client
+
+
+def send_request(
+    ai: str,
+    prompt: str,
+    model: str,
+    system_prompt: str,
+    options: Dict[str, Any] | None,
+    host: str | None = None,
+) -> str:
+    api_key = os.getenv("OPENAI_API_KEY")  # or load from secure storage
+    if ai == "openai":
+        return call_openai(model, api_key, prompt, system_prompt, options)
+    elif ai == "ollama":
+        return call_ollama(prompt, model, system_prompt, options, host)
+    raise ValueError(f"Unknown AI provider: {ai}")
+
+
+def _request_options(ai: str, options: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    # the options a request is actually sent with, so ollama's session options (e.g. num_ctx) are part of
+    # the cache key and a reply made with a smaller context is not reused for a larger one
+    if ai == "ollama":
+        return {**ollama_options, **(options or {})}
+    return options
+
 
 def prompt_ai(ai, 
     prompt: str,
     model: str = "llama2",
     system_prompt: str = "you are a senior level professional related to the questioned asked of you.",
+    options: Dict[str, Any] | None = None,
+    use_cache: bool = True,
+    refresh: bool = False,
 ) -> str:
-    # Example usage
+    # replies are cached on everything that shapes them, see llm_cache.ResponseCache
+    # refresh skips a cached reply (e.g. one that could not be parsed) but still stores the new one
+    cache = response_cache if use_cache else None
+    key = ""
+    if cache is not None:
+        key = cache.make_key(ai, model, system_prompt, prompt, _request_options(ai, options))
+        if not refresh:
+            cached = cache.get(key)
+            metrics.inc("llm_cache_lookups_total", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                return cached
+
+    metrics.inc("llm_prompt_bytes_total", len(prompt.encode("utf-8")), provider=ai, model=model)
+    tokens = request_scheduler.estimate_tokens(system_prompt + prompt, options)
+
+    def leg(provider: str, leg_model: str, host: str | None, leg_options: Dict[str, Any] | None) -> str:
+        reply = request_scheduler.call(
+            provider,
+            leg_model,
+            lambda: send_request(provider, prompt, leg_model, system_prompt, leg_options, host),
+            tokens,
+        )
+        request_scheduler.settle(provider, leg_model, tokens, (len(system_prompt) + len(prompt) + len(reply)) // 4)
+        if cache is not None:
+            # a hedge leg may go to another model, its reply is stored under the key of what produced it
+            leg_key = cache.make_key(provider, leg_model, system_prompt, prompt, _request_options(provider, leg_options))
+            cache.put(leg_key, reply)
+        return reply
+
+    with metrics.timer("llm_request", provider=ai, model=model):
+        response = request_router.send(ai, model, options, leg)
+    metrics.inc("llm_response_bytes_total", len(response.encode("utf-8")), provider=ai, model=model)
+    return response
+
+
+def prompt_ai_stream(ai,
+    prompt: str,
+    model: str = "llama2",
+    system_prompt: str = "you are a senior level professional related to the questioned asked of you.",
+    options: Dict[str, Any] | None = None,
+    use_cache: bool = True,
+    refresh: bool = False,
+) -> Iterator[str]:
+    # same as prompt_ai, but yields the reply in pieces as the model produces them
+    cache = response_cache if use_cache else None
+    key = ""
+    if cache is not None:
+        key = cache.make_key(ai, model, system_prompt, prompt, _request_options(ai, options))
+        if not refresh:
+            cached = cache.get(key)
+            metrics.inc("llm_cache_lookups_total", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                yield cached
+                return
+
+    # a stream is paced like any request, retrying a broken stream is up to the caller;
+    # streams are not hedged since both replies would hand out cards
+    tokens = request_scheduler.estimate_tokens(system_prompt + prompt, options)
+    request_scheduler.acquire(ai, model, tokens)
     api_key = os.getenv("OPENAI_API_KEY")  # or load from secure storage
     if ai == "openai":
-        return call_openai(model, api_key, prompt)
+        pieces = stream_openai(model, api_key, prompt, system_prompt, options)
     elif ai == "ollama":
-        return call_ollama(model, prompt)
+        pieces = stream_ollama(prompt, model, system_prompt, options, request_router.next_host(ai))
+    else:
+        raise ValueError(f"Unknown AI provider: {ai}")
+
+    # the full reply is only kept around when it has to be cached
+    collected: list[str] = []
+    response_bytes = 0
+    response_chars = 0
+    metrics.inc("llm_prompt_bytes_total", len(prompt.encode("utf-8")), provider=ai, model=model)
+    try:
+        with metrics.timer("llm_stream", provider=ai, model=model):
+            start = time.perf_counter()
+            for piece in pieces:
+                if not response_bytes:
+                    metrics.observe("llm_first_token", time.perf_counter() - start, provider=ai, model=model)
+                response_bytes += len(piece.encode("utf-8"))
+                response_chars += len(piece)
+                if cache is not None:
+                    collected.append(piece)
+                yield piece
+    finally:
+        # the reservation was an estimate, a broken stream still used what it received
+        request_scheduler.settle(ai, model, tokens, (len(system_prompt) + len(prompt) + response_chars) // 4)
+    metrics.inc("llm_response_bytes_total", response_bytes, provider=ai, model=model)
+
+    if cache is not None:
+        cache.put(key, "".join(collected))
 
 
 def call_ollama( 
     prompt: str,
     model: str = "llama2",
     system_prompt: str = "you are a senior level professional related to the questioned asked of you.",
+    options: Dict[str, Any] | None = None,
+    host: str | None = None,
 ) -> str:
-    # Example usage
+    client = get_ollama_client(host)
     try:
-        response: ChatResponse = ollama.chat(
+        response: "ChatResponse" = client.chat(
             model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt},
-            ],
-            stream=False
+            messages=_ollama_messages(prompt, system_prompt),
+            stream=False,
+            options=_request_options("ollama", options),
+            keep_alive=ollama_keep_alive,
         )  # type: ignore
     except Exception as err:
         if "try pulling" in str(err).lower():
             print(f"[!] Model '{model}' not found. Pulling it now...")
-            ollama.pull(model)
-            response = ollama.chat(
+            client.pull(model)
+            response = client.chat(
                 model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                stream=False
+                messages=_ollama_messages(prompt, system_prompt),
+                stream=False,
+                options=_request_options("ollama", options),
+                keep_alive=ollama_keep_alive,
             )  # type: ignore
         else:
             raise  
 
+    record_token_usage("ollama", model, response.get("prompt_eval_count"), response.get("eval_count"))
     return response["message"]["content"]
 
-def call_openai(model, api_key, prompt):
-    url = "https://api.openai.com/v1/chat/completions"
+
+def record_token_usage(
+    provider: str,
+    model: str,
+    prompt_tokens: int | None,
+    completion_tokens: int | None,
+    cached_tokens: int | None = None,
+) -> None:
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens or 0, provider=provider, model=model)
+    metrics.inc("llm_completion_tokens_total", completion_tokens or 0, provider=provider, model=model)
+    # prompt tokens served from the provider's prefix cache, only reported by openai
+    if cached_tokens is not None:
+        metrics.inc("llm_cached_prompt_tokens_total", cached_tokens, provider=provider, model=model)
+
+def call_openai(model, api_key, prompt, system_prompt=None, options=None):
+    url = OPENAI_API_URL
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
+    messages = [{"role": "user", "content": prompt}]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
     payload = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}]
+        "messages": messages,
+        **(options or {}),
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = http_client.post("openai", url, headers=headers, json=payload)
     response.raise_for_status()
-    return response.json()["choices"][0]["message"]["content"]
+    body = response.json()
+    usage = body.get("usage") or {}
+    record_token_usage(
+        "openai",
+        model,
+        usage.get("prompt_tokens"),
+        usage.get("completion_tokens"),
+        (usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+    )
+    return body["choices"][0]["message"]["content"]
+
+
+def stream_ollama(
+    prompt: str,
+    model: str = "llama2",
+    system_prompt: str = "you are a senior level professional related to the questioned asked of you.",
+    options: Dict[str, Any] | None = None,
+    host: str | None = None,
+) -> Iterator[str]:
+    stream = get_ollama_client(host).chat(
+        model=model,
+        messages=_ollama_messages(prompt, system_prompt),
+        stream=True,
+        options=_request_options("ollama", options),
+        keep_alive=ollama_keep_alive,
+    )
+    for part in stream:
+        if part.get("done"):
+            record_token_usage("ollama", model, part.get("prompt_eval_count"), part.get("eval_count"))
+        content = part["message"]["content"]
+        if content:
+            yield content
 
-# Example usage
-api_key = os.getenv("OPENAI_API_KEY")  # or load from secure storage
-print(call_openai(model, api_key, "Explain spaced repetition in 2 sentences."))
\ No newline at end of file
+
+def stream_openai(model, api_key, prompt, system_prompt=None, options=None) -> Iterator[str]:
+    url = OPENAI_API_URL
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    messages = [{"role": "user", "content": prompt}]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        **(options or {}),
+    }
+    with http_client.post("openai", url, headers=headers, json=payload, stream=True) as response:
+        response.raise_for_status()
+        # server-sent events, one "data: {...}" line per delta
+        for line in response.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[len(b"data: "):]
+            if data == b"[DONE]":
+                break
+            choices = json.loads(data)["choices"]
+            content = choices[0]["delta"].get("content") if choices else None
+            if content:
+                yield content
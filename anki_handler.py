@@ -1,13 +1,20 @@
 
-import requests
+import glob
 import platform
 import re
 import os
-from typing import Dict, Any
+import subprocess
+import time
+from typing import Dict, Any, List
+
+import http_client
+import metrics
 
 ANKI_CONNECT_URL = "http://localhost:8765"
 
 def get_latest_anki_url() -> str:
+    import requests
+
     url = "https://api.github.com/repos/ankitects/anki/releases/latest"
     resp = requests.get(url)
     resp.raise_for_status()
@@ -32,6 +39,8 @@ def get_latest_anki_url() -> str:
 
 def download_anki_installation_file(dest_folder: str) -> str:
     url = get_latest_anki_url()
+    import requests
+
     filename = os.path.basename(url)
     path = os.path.join(dest_folder, filename)
     print(f"Downloading {filename} from {url}...")
@@ -44,14 +53,167 @@ def download_anki_installation_file(dest_folder: str) -> str:
 
 def invoke(action: str, params: Dict[str, Any] = {}) -> Dict[str, Any]:
     try:
-        return requests.post(
-            ANKI_CONNECT_URL, json={"action": action, "version": 6, "params": params}
-        ).json()
+        with metrics.timer("anki_request", action=action):
+            return http_client.post(
+                "anki", ANKI_CONNECT_URL, json={"action": action, "version": 6, "params": params}
+            ).json()
     except Exception:
         print("anki api invoke failed.")
         raise Exception("Failed to connect to Anki Connect API. Is Anki running?")
 
 
+# result of the last readiness probe, (monotonic time, ready)
+_last_probe: tuple[float, bool] | None = None
+
+
+def probe(timeout: float = 0.5, max_age: float = 30.0) -> bool:
+    """
+    Check whether AnkiConnect answers, with its cheap `version` action.
+
+    A successful probe is remembered for max_age seconds, so callers can check readiness freely.
+
+    Args:
+        timeout (float): Connect and read timeout of the probe in seconds.
+        max_age (float): Seconds a successful probe stays valid.
+
+    Returns:
+        bool: True if AnkiConnect is up.
+    """
+
+    global _last_probe
+    if _last_probe is not None and _last_probe[1] and time.monotonic() - _last_probe[0] < max_age:
+        return True
+    try:
+        response = http_client.post(
+            "anki", ANKI_CONNECT_URL, json={"action": "version", "version": 6}, timeout=(timeout, timeout)
+        )
+        ready = response.ok and response.json().get("result") is not None
+    except Exception:
+        ready = False
+    metrics.inc("anki_probes_total", status="ready" if ready else "down")
+    _last_probe = (time.monotonic(), ready)
+    return ready
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on windows
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32  # type: ignore[attr-defined]
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def launched_anki_alive(pid_file: str) -> bool:
+    """Whether the Anki process recorded in pid_file by `launch_anki` is still running."""
+    try:
+        with open(pid_file, "r", encoding="utf-8") as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return False
+    return _pid_alive(pid)
+
+
+def launch_anki(exe_path: str, pid_file: str) -> bool:
+    """
+    Start Anki and record its PID.
+
+    Args:
+        exe_path (str): Path of the Anki executable, may contain glob patterns; the last match is used.
+        pid_file (str): File to write the PID to.
+
+    Returns:
+        bool: False if no executable matches exe_path.
+    """
+
+    matches = sorted(glob.glob(exe_path))
+    if not matches:
+        print(f"Anki executable not found: {exe_path}")
+        return False
+    process = subprocess.Popen([matches[-1]])
+    os.makedirs(os.path.dirname(os.path.abspath(pid_file)), exist_ok=True)
+    with open(pid_file, "w", encoding="utf-8") as f:
+        f.write(str(process.pid))
+    print(f"Anki launched! (pid {process.pid})")
+    return True
+
+
+def wait_until_ready(timeout: float = 60.0, base_delay: float = 0.25, max_delay: float = 2.0) -> bool:
+    """
+    Probe AnkiConnect with exponential backoff until it answers or timeout seconds have passed.
+
+    Args:
+        timeout (float): Maximum seconds to wait.
+        base_delay (float): Delay after the first failed probe, doubled after every further one.
+        max_delay (float): Upper bound of the delay between probes.
+
+    Returns:
+        bool: True if AnkiConnect answered in time.
+    """
+
+    deadline = time.monotonic() + timeout
+    delay = base_delay
+    with metrics.timer("anki_wait"):
+        while True:
+            if probe():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+
+
+def ensure_anki_running(exe_path: str, pid_file: str = "./.cache/anki.pid", timeout: float = 60.0) -> bool:
+    """
+    Make sure AnkiConnect is reachable, launching Anki if needed.
+
+    A quick `probe` comes first. If it fails but the Anki started by an earlier call is still alive (see
+    `launched_anki_alive`), it is only waited for, otherwise Anki is launched and then waited for. No
+    process table is scanned and no AnkiConnect request is sent before it answers.
+
+    Args:
+        exe_path (str): Path of the Anki executable, see `launch_anki`.
+        pid_file (str): File holding the PID of the Anki started by this app.
+        timeout (float): Maximum seconds to wait for AnkiConnect, see `wait_until_ready`.
+
+    Returns:
+        bool: True if AnkiConnect is ready.
+    """
+
+    if probe():
+        print("Anki is running.")
+        return True
+    if not launched_anki_alive(pid_file) and not launch_anki(exe_path, pid_file):
+        return False
+    print("Waiting for AnkiConnect...")
+    ready = wait_until_ready(timeout)
+    if not ready:
+        print(f"AnkiConnect did not answer within {timeout:.0f}s.")
+    return ready
+
+
+def invoke_multi(actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Run several AnkiConnect actions in one request, returns one {"result", "error"} dict per action."""
+    response = invoke("multi", {"actions": actions})
+    if response.get("error"):
+        raise Exception(f"AnkiConnect multi failed: {response['error']}")
+    return response["result"]
+
+
 def ensure_deck_exists(deck_name: str):
     existing_decks = invoke("deckNames")["result"]
     if deck_name not in existing_decks:
@@ -61,16 +223,51 @@ def ensure_deck_exists(deck_name: str):
         print(f"Deck already exists: {deck_name}")
 
 
+def fetch_deck_notes(deck_name: str) -> list[dict[str, Any]]:
+    # every note of a deck in two requests, findNotes then notesInfo
+    note_ids = invoke("findNotes", {"query": f'deck:"{deck_name}"'}).get("result") or []
+    if not note_ids:
+        return []
+    return [note for note in invoke("notesInfo", {"notes": note_ids}).get("result") or [] if note]
+
+
+def fetch_deck_cards(deck_name: str) -> list[dict[str, Any]]:
+    cards: list[dict[str, Any]] = []
+    for note in fetch_deck_notes(deck_name):
+        fields = note.get("fields", {})
+        if "Front" in fields and "Back" in fields:
+            cards.append({"front": fields["Front"]["value"], "back": fields["Back"]["value"], "tags": note.get("tags", [])})
+    return cards
+
+
+def build_note(deck_name: str, card: dict[str, Any]) -> dict[str, Any]:
+    tags = card.get("tags", [])
+    if isinstance(tags, str):
+        # anki tags cannot contain spaces
+        tags = [tags.replace(" ", "_")] if tags else []
+    return {
+        "deckName": deck_name,
+        "modelName": "Basic",
+        "fields": {"Front": card["front"], "Back": card["back"]},
+        "tags": tags,
+    }
+
+
+def add_card(deck_name: str, card: dict[str, str]) -> int | None:
+    # single note, the deck must already exist
+    response = invoke("addNote", {"note": build_note(deck_name, card)})
+    if response.get("error"):
+        print(f"Failed to add card: {card['front']} → {response['error']}")
+        return None
+    print(f"Added card: {card['front']}")
+    return response["result"]
+
+
 def add_cards(deck_name: str, cards: list[dict[str, str]]):
     ensure_deck_exists(deck_name)
     for card in cards:
         try:
-            note: dict[str, Any] = {
-                "deckName": deck_name,
-                "modelName": "Basic",
-                "fields": {"Front": card["front"], "Back": card["back"]},
-                "tags": card.get("tags", []),
-            }
+            note = build_note(deck_name, card)
             response = invoke("addNote", {"note": note})
             if response.get("error"):
                 print(f"Failed to add card: {card['front']} → {response['error']}")
@@ -78,3 +275,62 @@ def add_cards(deck_name: str, cards: list[dict[str, str]]):
                 print(f"Added card: {card['front']}")
         except Exception as err:
             print(f"failed to add card - {err}")
+
+
+def add_cards_bulk(deck_name: str, cards: list[dict[str, str]], batch_size: int = 500) -> list[int | None]:
+    """
+    Add cards to a deck with a handful of AnkiConnect requests instead of one per card.
+
+    All batches are checked with `canAddNotes` in a single `multi` request, then each batch
+    of addable notes is sent with one `addNotes` request.
+
+    Args:
+        deck_name (str): Name of the target deck, created if missing.
+        cards (list of dict): Cards with 'front', 'back' and optional 'tags' keys.
+        batch_size (int): Maximum number of notes per `addNotes` request.
+
+    Returns:
+        list: The new note id for each card, in card order, or None where the card was not added.
+    """
+
+    ensure_deck_exists(deck_name)
+    notes = [build_note(deck_name, card) for card in cards]
+    batches = [range(i, min(i + batch_size, len(notes))) for i in range(0, len(notes), batch_size)]
+    note_ids: list[int | None] = [None] * len(notes)
+    if not batches:
+        return note_ids
+
+    checks = invoke_multi(
+        [{"action": "canAddNotes", "params": {"notes": notes[b.start : b.stop]}} for b in batches]
+    )
+    added = 0
+    for batch, check in zip(batches, checks):
+        if check.get("error"):
+            for i in batch:
+                print(f"Failed to add card: {cards[i]['front']} → {check['error']}")
+            continue
+
+        addable = [i for i, ok in zip(batch, check["result"]) if ok]
+        for i, ok in zip(batch, check["result"]):
+            if not ok:
+                print(f"Failed to add card: {cards[i]['front']} → duplicate or invalid note")
+        if not addable:
+            continue
+
+        response = invoke("addNotes", {"notes": [notes[i] for i in addable]})
+        result = response.get("result")
+        if result is None:
+            for i in addable:
+                print(f"Failed to add card: {cards[i]['front']} → {response.get('error')}")
+            continue
+        for i, note_id in zip(addable, result):
+            if note_id is None:
+                print(f"Failed to add card: {cards[i]['front']} → rejected by Anki")
+            else:
+                note_ids[i] = note_id
+                added += 1
+
+    metrics.inc("anki_notes_total", added, status="added")
+    metrics.inc("anki_notes_total", len(cards) - added, status="failed")
+    print(f"Added {added}/{len(cards)} cards to deck: {deck_name}")
+    return note_ids
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List
+
+import anki_handler
+import deck_store
+import metrics
+
+# sync states live next to the decks in decks_path
+STATE_SUFFIX = ".anki_sync.json"
+
+
+def card_key(card: Dict[str, Any]) -> str:
+    # anki itself tells notes apart by their first field, so a card keeps its note while its back or tags change
+    return hashlib.sha1(str(card.get("front", "")).strip().encode("utf-8")).hexdigest()
+
+
+def content_hash(note: Dict[str, Any]) -> str:
+    return hashlib.sha1(
+        json.dumps([note["fields"], sorted(note["tags"])], sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+class SyncState:
+    """
+    Local map of the cards of one Anki deck: card key (see `card_key`) -> note ID and content hash at the last sync.
+
+    Args:
+        path (str): Path of the state `.json` file, created on the first save.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.notes: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.notes = json.load(f).get("notes", {})
+
+    @classmethod
+    def for_deck(cls, deck_name: str, decks_path: str = "./decks/") -> "SyncState":
+        return cls(os.path.join(decks_path, f"{deck_name}{STATE_SUFFIX}"))
+
+    def save(self) -> None:
+        deck_store.write_atomic(self.path, json.dumps({"notes": self.notes}, indent=2, ensure_ascii=False))
+
+
+def _chunks(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def _adopt(deck_name: str, note_ids: List[int], wanted: Dict[str, Any], batch_size: int) -> Dict[str, Dict[str, Any]]:
+    # notes in the deck the state does not know about yet, e.g. added before the first sync; only those
+    # matching a wanted card are taken over, so that hand-made notes are never deleted
+    adopted: Dict[str, Dict[str, Any]] = {}
+    results = anki_handler.invoke_multi(
+        [{"action": "notesInfo", "params": {"notes": batch}} for batch in _chunks(note_ids, batch_size)]
+    )
+    for result in results:
+        for note in result.get("result") or []:
+            fields = (note or {}).get("fields", {})
+            if "Front" not in fields or "Back" not in fields:
+                continue
+            card = {"front": fields["Front"]["value"], "back": fields["Back"]["value"], "tags": note.get("tags", [])}
+            if card_key(card) not in wanted:
+                continue
+            adopted[card_key(card)] = {
+                "note_id": note["noteId"],
+                "hash": content_hash(anki_handler.build_note(deck_name, card)),
+            }
+    return adopted
+
+
+def sync_deck(
+    deck_name: str,
+    cards: List[Dict[str, Any]],
+    state: SyncState,
+    batch_size: int = 500,
+    delete: bool = True,
+) -> Dict[str, int]:
+    """
+    Make an Anki deck match a list of cards by sending only what changed since the last sync.
+
+    The deck's note IDs are fetched with one `findNotes` request. Notes the state does not know are read
+    with `notesInfo` and taken over when their front matches a card, notes the state knows but Anki no
+    longer has are forgotten. Then cards missing from Anki are added with `add_cards_bulk`, cards whose
+    back or tags changed are updated with `updateNoteFields`/`updateNoteTags` in `multi` batches, and
+    notes of cards that were removed from the list are deleted with `deleteNotes`. Only notes the state
+    maps to a card are ever deleted, notes added to the deck by hand are left alone.
+
+    An unchanged deck costs the single `findNotes` request.
+
+    Args:
+        deck_name (str): Name of the Anki deck, created if missing.
+        cards (list of dict): The cards the deck should hold. Of cards with the same front the first wins.
+        state (SyncState): Map from the last sync, updated and saved.
+        batch_size (int): Maximum number of notes per AnkiConnect request.
+        delete (bool): Whether to delete the notes of removed cards.
+
+    Returns:
+        dict: Number of notes 'added', 'updated', 'deleted', 'unchanged' and 'failed'.
+    """
+
+    wanted: Dict[str, Dict[str, Any]] = {}
+    for card in cards:
+        wanted.setdefault(card_key(card), card)
+
+    remote_ids = set(anki_handler.invoke("findNotes", {"query": f'deck:"{deck_name}"'}).get("result") or [])
+    known = {entry["note_id"]: key for key, entry in state.notes.items()}
+    state.notes = {key: entry for key, entry in state.notes.items() if entry["note_id"] in remote_ids}
+    unknown = sorted(note_id for note_id in remote_ids if note_id not in known)
+    if unknown:
+        for key, entry in _adopt(deck_name, unknown, wanted, batch_size).items():
+            state.notes.setdefault(key, entry)
+
+    to_add: List[Dict[str, Any]] = []
+    to_update: List[tuple[str, Dict[str, Any]]] = []
+    counts = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0, "failed": 0}
+    for key, card in wanted.items():
+        note = anki_handler.build_note(deck_name, card)
+        entry = state.notes.get(key)
+        if entry is None:
+            to_add.append(card)
+        elif entry["hash"] != content_hash(note):
+            to_update.append((key, note))
+        else:
+            counts["unchanged"] += 1
+    to_delete = [key for key in state.notes if key not in wanted] if delete else []
+
+    if to_add:
+        note_ids = anki_handler.add_cards_bulk(deck_name, to_add, batch_size)
+        for card, note_id in zip(to_add, note_ids):
+            if note_id is None:
+                counts["failed"] += 1
+                continue
+            state.notes[card_key(card)] = {
+                "note_id": note_id,
+                "hash": content_hash(anki_handler.build_note(deck_name, card)),
+            }
+            counts["added"] += 1
+
+    for batch in _chunks(to_update, max(1, batch_size // 2)):
+        actions: List[Dict[str, Any]] = []
+        for key, note in batch:
+            note_id = state.notes[key]["note_id"]
+            actions.append({"action": "updateNoteFields", "params": {"note": {"id": note_id, "fields": note["fields"]}}})
+            actions.append({"action": "updateNoteTags", "params": {"note": note_id, "tags": note["tags"]}})
+        results = anki_handler.invoke_multi(actions)
+        for (key, note), fields_result, tags_result in zip(batch, results[::2], results[1::2]):
+            error = fields_result.get("error") or tags_result.get("error")
+            if error:
+                print(f"Failed to update card: {note['fields']['Front']} → {error}")
+                counts["failed"] += 1
+                continue
+            state.notes[key]["hash"] = content_hash(note)
+            counts["updated"] += 1
+
+    for batch in _chunks(to_delete, batch_size):
+        response = anki_handler.invoke("deleteNotes", {"notes": [state.notes[key]["note_id"] for key in batch]})
+        if response.get("error"):
+            print(f"Failed to delete {len(batch)} notes → {response['error']}")
+            counts["failed"] += len(batch)
+            continue
+        for key in batch:
+            del state.notes[key]
+        counts["deleted"] += len(batch)
+
+    state.save()
+    for status, count in counts.items():
+        metrics.inc("anki_sync_notes_total", count, status=status)
+    print(f"Synced deck {deck_name}: {counts}")
+    return counts
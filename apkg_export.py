@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+from typing import Any, Dict, Iterable, List
+
+import anki_handler
+import deck_store
+import file_handler
+import metrics
+
+# schema 11 collection, the format .apkg files of Anki 2.1 are written in and that every Anki version imports
+_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+    conf text not null, models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+    csum integer not null, flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+# fixed, so that every export shares one note type in the importing collection
+MODEL_ID = 1607392319
+_GUID_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#$%&()*+,-./:;<=>?@[]^_`{|}~"
+_HTML_TAG = re.compile(r"<[^>]*>")
+
+
+def note_guid(deck_name: str, card: Dict[str, Any]) -> str:
+    """
+    Stable note GUID of a card, base91 like Anki's own.
+
+    Derived from the deck name and the card's front, so re-importing an export after a card's back or tags
+    changed updates the existing note instead of adding a second one.
+    """
+
+    number = int.from_bytes(hashlib.sha256(f"{deck_name}\x1f{card['front']}".encode("utf-8")).digest()[:8], "big")
+    chars = []
+    while number:
+        number, rest = divmod(number, len(_GUID_CHARS))
+        chars.append(_GUID_CHARS[rest])
+    return "".join(reversed(chars)) or _GUID_CHARS[0]
+
+
+def _field_checksum(text: str) -> int:
+    # what Anki uses for its duplicate check: first 8 hex digits of the sha1 of the tag-stripped first field
+    return int(hashlib.sha1(_HTML_TAG.sub("", text).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _deck_id(deck_name: str) -> int:
+    return int(hashlib.sha1(deck_name.encode("utf-8")).hexdigest()[:12], 16) | (1 << 50)
+
+
+def _collection_row(deck_name: str, deck_id: int, now: int) -> tuple[Any, ...]:
+    deck_defaults = {
+        "mod": now, "usn": -1, "lrnToday": [0, 0], "revToday": [0, 0], "newToday": [0, 0],
+        "timeToday": [0, 0], "collapsed": False, "browserCollapsed": False, "desc": "", "dyn": 0,
+        "conf": 1, "extendNew": 0, "extendRev": 0,
+    }
+    decks = {
+        "1": {**deck_defaults, "id": 1, "name": "Default"},
+        str(deck_id): {**deck_defaults, "id": deck_id, "name": deck_name},
+    }
+    field = {"sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+    model = {
+        "id": MODEL_ID,
+        "name": "Basic",
+        "type": 0,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": deck_id,
+        "tmpls": [
+            {
+                "name": "Card 1", "ord": 0, "qfmt": "{{Front}}",
+                "afmt": "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}",
+                "bqfmt": "", "bafmt": "", "did": None, "bfont": "", "bsize": 0,
+            }
+        ],
+        "flds": [{**field, "name": "Front", "ord": 0}, {**field, "name": "Back", "ord": 1}],
+        "css": ".card {\n font-family: arial;\n font-size: 20px;\n text-align: center;\n color: black;\n"
+        " background-color: white;\n}\n",
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage[utf8]{inputenc}\n"
+        "\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "latexsvg": False,
+        "req": [[0, "any", [0]]],
+        "tags": [],
+        "vers": [],
+    }
+    dconf = {
+        "1": {
+            "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "autoplay": True, "timer": 0,
+            "replayq": True, "dyn": False,
+            "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500, "order": 1, "perDay": 20,
+                    "bury": False, "separate": True},
+            "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8, "leechAction": 0},
+            "rev": {"perDay": 200, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1, "maxIvl": 36500, "bury": False,
+                    "minSpace": 1},
+        }
+    }
+    conf = {
+        "activeDecks": [1], "curDeck": deck_id, "newSpread": 0, "collapseTime": 1200, "timeLim": 0,
+        "estTimes": True, "dueCounts": True, "curModel": MODEL_ID, "nextPos": 1, "sortType": "noteFld",
+        "sortBackwards": False, "addToCur": True,
+    }
+    return (
+        1, now - now % 86400, now * 1000, now * 1000, 11, 0, 0, 0,
+        json.dumps(conf), json.dumps({str(MODEL_ID): model}), json.dumps(decks), json.dumps(dconf), "{}",
+    )
+
+
+def export_apkg(cards: Iterable[Dict[str, Any]], deck_name: str, output_path: str) -> int:
+    """
+    Write cards to an Anki package (.apkg) without going through Anki or AnkiConnect.
+
+    The collection is built in a temporary SQLite file: the schema, one `col` row with the Basic note type
+    and the deck, then all notes and cards with one `executemany` each, inside a single transaction with
+    journaling and syncing off. It is zipped with an empty media manifest and moved into place atomically.
+    Cards with the same front are written once, the first one wins, as Anki would reject the rest.
+
+    Args:
+        cards (iterable of dict): Cards with 'front', 'back' and optional 'tags' keys.
+        deck_name (str): Name of the deck in the package.
+        output_path (str): Path of the .apkg file to write.
+
+    Returns:
+        int: Number of notes written.
+    """
+
+    now = int(time.time())
+    deck_id = _deck_id(deck_name)
+    first_id = int(time.time() * 1000)
+    seen: set[str] = set()
+    notes: List[tuple[Any, ...]] = []
+    for card in cards:
+        guid = note_guid(deck_name, card)
+        if guid in seen:
+            continue
+        seen.add(guid)
+        note = anki_handler.build_note(deck_name, card)
+        front, back = str(note["fields"]["Front"]), str(note["fields"]["Back"])
+        tags = f" {' '.join(note['tags'])} " if note["tags"] else ""
+        note_id = first_id + len(notes)
+        notes.append(
+            (note_id, guid, MODEL_ID, now, -1, tags, f"{front}\x1f{back}", front, _field_checksum(front), 0, "")
+        )
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    with metrics.timer("apkg_export"), tempfile.TemporaryDirectory(dir=directory) as tmp:
+        collection_path = os.path.join(tmp, "collection.anki2")
+        db = sqlite3.connect(collection_path, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode = OFF")
+            db.execute("PRAGMA synchronous = OFF")
+            db.executescript(_SCHEMA)
+            db.execute("BEGIN")
+            db.execute(
+                "INSERT INTO col VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _collection_row(deck_name, deck_id, now)
+            )
+            db.executemany("INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes)
+            # card i belongs to note i, new cards are shown in deck order (due = position)
+            db.executemany(
+                "INSERT INTO cards VALUES (?, ?, ?, 0, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')",
+                ((note[0], note[0], deck_id, now, position) for position, note in enumerate(notes, 1)),
+            )
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+        package_path = os.path.join(tmp, "deck.apkg")
+        with zipfile.ZipFile(package_path, "w", zipfile.ZIP_DEFLATED) as package:
+            package.write(collection_path, "collection.anki2")
+            package.writestr("media", "{}")
+        os.replace(package_path, output_path)
+    metrics.inc("apkg_notes_total", len(notes))
+    print(f"Exported {len(notes)} cards of deck '{deck_name}' to {output_path}")
+    return len(notes)
+
+
+def read_deck_file(filepath: str) -> List[Dict[str, Any]]:
+    """
+    Read the cards of a deck file under decks/, a JSON Lines store (see `deck_store.DeckStore`) or a JSON array.
+
+    Args:
+        filepath (str): Path of the `.jsonl` or `.json` deck file.
+
+    Returns:
+        list of dict: The cards.
+    """
+
+    if not os.path.exists(filepath):
+        print(f"Deck file not found: {filepath}")
+        return []
+    if filepath.endswith(".jsonl"):
+        with deck_store.DeckStore(filepath) as store:
+            return store.read()
+    cards = file_handler.read_json_file(filepath)
+    return cards if isinstance(cards, list) else []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a deck file from decks/ as an Anki package, no Anki needed.")
+    parser.add_argument("deck_file", help="a .jsonl or .json deck file")
+    parser.add_argument("-o", "--output", help="the .apkg file to write, defaults to the deck file with .apkg")
+    parser.add_argument("--deck-name", help="deck name inside the package, defaults to the deck file name")
+    args = parser.parse_args()
+
+    name = args.deck_name or os.path.splitext(os.path.basename(args.deck_file))[0]
+    export_apkg(read_deck_file(args.deck_file), name, args.output or os.path.splitext(args.deck_file)[0] + ".apkg")
@@ -0,0 +1,430 @@
+import glob
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Dict, Generator, Iterable, List
+
+import apkg_export
+import chunk_filter
+import deck_store
+import extraction_cache
+import file_handler
+import helpers
+import job_manifest
+import metrics
+
+
+def find_documents(source: str, recursive: bool = True) -> List[str]:
+    """
+    List the documents of a batch.
+
+    Args:
+        source (str): A directory, whose files of a supported type are taken, or a glob pattern such as
+            "courses/**/*.pdf".
+        recursive (bool): Whether to include subdirectories of a directory, and let "**" match them in a pattern.
+
+    Returns:
+        list of str: The document paths, sorted.
+    """
+
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "**", "*") if recursive else os.path.join(source, "*")
+        paths = [
+            path
+            for path in glob.glob(pattern, recursive=recursive)
+            if path.split(".")[-1].lower() in file_handler.stream_handlers
+        ]
+    else:
+        paths = glob.glob(source, recursive=recursive)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def deck_names(paths: List[str], root: str | None = None) -> Dict[str, str]:
+    """
+    Deck name of each document: its file name without extension.
+
+    Args:
+        paths (list of str): The documents.
+        root (str or None): If given, every name is the path relative to root, folders joined with "_",
+            so it stays the same whatever other files there are. Otherwise only files with the same
+            name in different folders get their folders too.
+
+    Returns:
+        dict: Deck name by path.
+    """
+
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    relative_to_root = root is not None
+    if root is None and len(paths) > 1:
+        root = os.path.commonpath([os.path.abspath(path) for path in paths])
+    names = {}
+    for path, stem in zip(paths, stems):
+        if root and (relative_to_root or stems.count(stem) > 1):
+            relative = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+            stem = os.path.splitext(relative)[0].replace(os.sep, "_")
+        names[path] = stem
+    return names
+
+
+def extract_chunks(filepath: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Read and chunk one document, run in a worker process of the batch.
+
+    Args:
+        filepath (str): Path of the document.
+        settings (dict): "extraction_cache" and "chunk_filter" config sections and the "card_amount".
+
+    Returns:
+        dict: The document's 'path', 'chunks', extracted 'chars' and 'seconds' taken, plus an 'error'
+            message if it could not be read.
+    """
+
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"path": filepath, "chunks": [], "chars": 0, "seconds": 0.0, "error": None}
+    try:
+        cache = extraction_cache.from_config(settings["extraction_cache"])
+        pieces = (cache.iter_file if cache is not None else file_handler.iter_file)(filepath, 0)
+        if pieces is None:
+            result["error"] = "unsupported file type"
+            return result
+
+        def counted(pieces: Iterable[str]) -> Generator[str, None, None]:
+            for piece in pieces:
+                result["chars"] += len(piece)
+                yield piece
+
+        pieces = counted(pieces)
+        card_filter = chunk_filter.from_config(settings["chunk_filter"])
+        if card_filter is not None:
+            pieces = card_filter.pages(pieces)
+        chunks: Iterable[str] = file_handler.chunk_pieces(pieces)
+        if card_filter is not None:
+            chunks = card_filter.chunks(chunks, settings["card_amount"])
+        result["chunks"] = list(chunks)
+    except Exception as err:
+        # a broken document fails on its own instead of ending the batch
+        result["error"] = f"{type(err).__name__}: {err}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+class DeckJob:
+    """
+    The deck store and job manifest of one deck of a batch, a file's own deck or the merged one.
+
+    Args:
+        topic (str): Topic of the batch.
+        deck_name (str): Name of the deck.
+        decks_path (str): Directory of the deck files.
+        resume (bool): Whether to continue the deck's last job instead of starting over.
+    """
+
+    def __init__(self, topic: str, deck_name: str, decks_path: str, resume: bool) -> None:
+        self.deck_name = deck_name
+        self.store = deck_store.DeckStore.for_deck(topic, deck_name, decks_path)
+        self.manifest = job_manifest.JobManifest.for_deck(topic, deck_name, decks_path)
+        if not resume:
+            self.manifest.reset()
+
+    def finish(self, export_apkg: bool, anki_ready: bool, batch_size: int) -> int:
+        """Write the JSON (and optionally .apkg) deck, add new cards to Anki and close. Returns the card count."""
+        self.store.export_json()
+        cards = self.store.read()
+        if export_apkg:
+            apkg_export.export_apkg(cards, self.deck_name, os.path.splitext(self.store.path)[0] + ".apkg")
+        if anki_ready:
+            helpers.add_new_cards(self.deck_name, cards, self.manifest, batch_size)
+        self.store.close()
+        self.manifest.close()
+        return len(cards)
+
+
+def _rate(count: float, seconds: float) -> float:
+    return count / seconds if seconds > 0 else 0.0
+
+
+def print_summary(report: Dict[str, Any]) -> None:
+    totals = report["totals"]
+    print(
+        f"Batch done in {totals['seconds']:.0f} s: {totals['files']} files ({totals['done']} done, "
+        f"{totals['incomplete']} with failed chunks, {totals['unreadable']} unreadable), "
+        f"{totals['chunks']} chunks, {totals['cards']} cards"
+    )
+    print(
+        f"extraction: {totals['chars'] / 1e6:.1f} MB of text, {totals['extract_mb_per_s']:.2f} MB/s of worker time; "
+        f"generation: {totals['chunks_per_s']:.2f} chunks/s, {totals['cards_per_min']:.1f} cards/min"
+    )
+    for entry in report["files"]:
+        if entry["status"] != "done":
+            print(f"  {entry['status']}: {entry['path']} {entry['error'] or ''}")
+
+
+def _warm_worker() -> None:
+    # loads the tokenizer once per worker process instead of once per document
+    file_handler.get_encoder()
+
+
+class BatchRunner:
+    """
+    Turns lists of documents into decks; one runner serves a whole batch or every round of a watch daemon.
+
+    Documents are read and chunked in a process pool (see `extract_chunks`), at most prefetch_files
+    ahead of generation, so memory stays bounded however many files there are. The chunks of all files
+    of a run feed one `helpers.generate_cards_concurrently` run, so max_concurrent_requests LLM requests
+    are in flight across files, and packing (see `helpers.pack_chunks`) can fill a request with the tails
+    of several small files. Each file gets its own deck, named after it, unless a merged deck is asked
+    for. A deck is written, exported and sent to Anki as soon as its last chunk is done; its job manifest
+    lets a resumed run pick up where the last one stopped.
+
+    Args:
+        config (dict): The configuration, reads the `batch` section and `options`.
+        os_name (str): Key of the `filepaths` section to take the decks path from.
+        prompts (dict): Prompt templates.
+        topic (str or None): Topic of the cards, config.yaml's if None.
+        card_amount (int or None): Cards per chunk, config.yaml's if None.
+        merge_deck (str or None): Name of the one deck to put all cards into, one deck per file if None.
+        resume (bool): Whether to continue the decks' last jobs instead of starting them over.
+        extract_workers (int or None): Number of extraction processes, from the `batch` section if None.
+        anki_ready (bool): Whether Anki is reachable to add the cards to.
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        os_name: str,
+        prompts: Dict[str, str],
+        topic: str | None = None,
+        card_amount: int | None = None,
+        merge_deck: str | None = None,
+        resume: bool = False,
+        extract_workers: int | None = None,
+        anki_ready: bool = True,
+    ) -> None:
+        settings = config.get("batch") or {}
+        self.config = config
+        self.prompts = prompts
+        self.decks_path = config["filepaths"][os_name]["decks_path"]
+        self.options = {
+            "topic": topic or config["options"]["topic"],
+            "card_amount": str(card_amount or config["options"]["card_amount"]),
+        }
+        self.merge_deck = merge_deck
+        self.resume = resume
+        self.anki_ready = anki_ready
+        self.max_workers = int(config["options"].get("max_concurrent_requests", 1))
+        self.batch_size = int(config["options"].get("anki_batch_size", 500))
+        self.export_apkg = config["options"].get("export_apkg", "n").lower() in ["yes", "y"]
+        self.workers = extract_workers or int(settings.get("extract_workers", 0)) or os.cpu_count() or 1
+        self.prefetch = max(self.workers, int(settings.get("prefetch_files", 0)) or self.workers * 2)
+        self.worker_settings = {
+            "extraction_cache": config.get("extraction_cache", {}),
+            "chunk_filter": config.get("chunk_filter"),
+            "card_amount": int(self.options["card_amount"]),
+        }
+        self.duplicates = helpers.load_duplicate_index(config, self.decks_path)
+
+    def start_pool(self) -> Any:
+        """
+        Start the extraction processes, each with the tokenizer loaded.
+
+        Call this before any generation thread runs: on Linux the workers are forked, which is unsafe
+        with threads running. The pool can then serve any number of `run` calls.
+
+        Returns:
+            concurrent.futures.ProcessPoolExecutor: The pool, to be shut down by the caller.
+        """
+
+        from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing, only needed here
+
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        # the workers are started on the first submit
+        wait([pool.submit(time.sleep, 0) for _ in range(self.workers)])
+        return pool
+
+    def run(self, paths: List[str], pool: Any, names: Dict[str, str] | None = None) -> Dict[str, Any]:
+        """
+        Make the decks of a list of documents.
+
+        Args:
+            paths (list of str): The documents.
+            pool (concurrent.futures.ProcessPoolExecutor): Extraction pool, see `start_pool`.
+            names (dict or None): Deck name of each document, see `deck_names` if None.
+
+        Returns:
+            dict: The report: 'files', one entry per document, and 'totals'.
+        """
+
+        names = names or deck_names(paths)
+        topic = self.options["topic"]
+        merged = DeckJob(topic, self.merge_deck, self.decks_path, self.resume) if self.merge_deck else None
+        entries: Dict[str, Dict[str, Any]] = {
+            path: {
+                "path": path,
+                "deck": self.merge_deck or names[path],
+                "status": "queued",
+                "error": None,
+                "chunks": 0,
+                "failed_chunks": 0,
+                "cards": 0,
+                "chars": 0,
+                "extract_seconds": 0.0,
+            }
+            for path in paths
+        }
+        jobs: Dict[str, DeckJob] = {}
+        pending_chunks = {path: 0 for path in paths}
+        fed: set[str] = set()
+        owners: List[tuple[str, str]] = []  # (path, chunk hash) of every chunk handed to generation, by index
+        finished = 0
+        start = time.perf_counter()
+
+        def finish_file(path: str) -> None:
+            nonlocal finished
+            entry = entries[path]
+            job = jobs.pop(path, None)
+            if job is not None and job is not merged:
+                job.finish(self.export_apkg, self.anki_ready, self.batch_size)
+            entry["status"] = "incomplete" if entry["failed_chunks"] else "done"
+            finished += 1
+            metrics.inc("batch_files_total", status=entry["status"])
+            elapsed = time.perf_counter() - start
+            done_chunks = sum(e["chunks"] for e in entries.values() if e["status"] in ("done", "incomplete"))
+            failed = f", {entry['failed_chunks']} failed" if entry["failed_chunks"] else ""
+            print(
+                f"[{finished}/{len(paths)}] {path}: {entry['chunks']} chunks, {entry['cards']} cards{failed} "
+                f"({_rate(done_chunks, elapsed):.2f} chunks/s overall)"
+            )
+
+        queue = iter(paths)
+        extracting: Dict[Future[Dict[str, Any]], str] = {}
+
+        def submit() -> None:
+            path = next(queue, None)
+            if path is not None:
+                extracting[pool.submit(extract_chunks, path, self.worker_settings)] = path
+
+        for _ in range(self.prefetch):
+            submit()
+
+        def feed() -> Generator[str, None, None]:
+            nonlocal finished
+            while extracting:
+                done, _ = wait(list(extracting), return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = extracting.pop(future)
+                    submit()
+                    result = future.result()
+                    entry = entries[path]
+                    entry["chars"], entry["extract_seconds"] = result["chars"], result["seconds"]
+                    metrics.observe("batch_extract", result["seconds"])
+                    if result["error"]:
+                        entry["status"], entry["error"] = "unreadable", result["error"]
+                        finished += 1
+                        metrics.inc("batch_files_total", status="unreadable")
+                        print(f"[{finished}/{len(paths)}] {path}: could not be read - {result['error']}")
+                        continue
+                    entry["status"] = "generating"
+                    job = merged or DeckJob(topic, names[path], self.decks_path, self.resume)
+                    jobs[path] = job
+                    for chunk in job.manifest.track(result["chunks"], path):
+                        owners.append((path, job.manifest.submitted[-1]))
+                        pending_chunks[path] += 1
+                        entry["chunks"] += 1
+                        yield chunk
+                    fed.add(path)
+                    if not pending_chunks[path]:
+                        finish_file(path)  # nothing to generate, e.g. every chunk was done in an earlier run
+
+        for index, cards in helpers.generate_cards_concurrently(
+            self.options, self.config, self.prompts, feed(), self.max_workers
+        ):
+            path, key = owners[index]
+            job = jobs[path]
+            if cards is None:
+                job.manifest.fail(key, "generation failed")
+                entries[path]["failed_chunks"] += 1
+            else:
+                kept = self.duplicates.filter(cards) if self.duplicates is not None else cards
+                job.store.append(kept)
+                job.manifest.finish(key, cards)
+                entries[path]["cards"] += len(kept)
+            pending_chunks[path] -= 1
+            if path in fed and not pending_chunks[path]:
+                finish_file(path)
+
+        if self.duplicates is not None:
+            self.duplicates.save(self.config["dedup"].get("path", "./.cache/dedup_index.pickle"))
+        if merged is not None:
+            merged.finish(self.export_apkg, self.anki_ready, self.batch_size)
+
+        seconds = time.perf_counter() - start
+        files = list(entries.values())
+        chunks = sum(entry["chunks"] for entry in files)
+        cards = sum(entry["cards"] for entry in files)
+        chars = sum(entry["chars"] for entry in files)
+        return {
+            "files": files,
+            "totals": {
+                "files": len(files),
+                "done": sum(entry["status"] == "done" for entry in files),
+                "incomplete": sum(entry["status"] == "incomplete" for entry in files),
+                "unreadable": sum(entry["status"] == "unreadable" for entry in files),
+                "chunks": chunks,
+                "failed_chunks": sum(entry["failed_chunks"] for entry in files),
+                "cards": cards,
+                "chars": chars,
+                "seconds": seconds,
+                "extract_mb_per_s": _rate(chars / 1e6, sum(entry["extract_seconds"] for entry in files)),
+                "chunks_per_s": _rate(chunks, seconds),
+                "cards_per_min": _rate(cards * 60, seconds),
+            },
+        }
+
+
+def run_batch(
+    args: Any, config: Dict[str, Any], os_name: str, prompts: Dict[str, str], anki_ready: bool = True
+) -> Dict[str, Any]:
+    """
+    Turn a folder of documents into decks without asking anything, see `BatchRunner`.
+
+    Args:
+        args (argparse.Namespace): Command line arguments: batch, merge_deck, topic, card_amount,
+            extract_workers, batch_report and resume.
+        config (dict): The configuration.
+        os_name (str): Key of the `filepaths` section to take the decks path from.
+        prompts (dict): Prompt templates.
+        anki_ready (bool): Whether Anki is reachable to add the cards to.
+
+    Returns:
+        dict: The report, see `BatchRunner.run`.
+    """
+
+    paths = find_documents(args.batch, bool((config.get("batch") or {}).get("recursive", True)))
+    if not paths:
+        print(f"No documents found for '{args.batch}'")
+        return {"files": [], "totals": {}}
+
+    runner = BatchRunner(
+        config,
+        os_name,
+        prompts,
+        topic=args.topic,
+        card_amount=args.card_amount,
+        merge_deck=args.merge_deck,
+        resume=args.resume,
+        extract_workers=args.extract_workers,
+        anki_ready=anki_ready,
+    )
+    pool = runner.start_pool()
+    try:
+        report = runner.run(paths, pool)
+    finally:
+        pool.shutdown(cancel_futures=True)
+    print_summary(report)
+    if not anki_ready:
+        print("Anki is not reachable, run the batch again with --resume to add the cards once it is.")
+    if args.batch_report:
+        deck_store.write_atomic(args.batch_report, json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"Batch report written to '{args.batch_report}'")
+    return report
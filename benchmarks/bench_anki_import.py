@@ -0,0 +1,55 @@
+"""
+Compare per-card `anki_handler.add_cards` with batched `anki_handler.add_cards_bulk`.
+
+Run from the repository root:
+    python -m benchmarks.bench_anki_import --cards 3000
+
+Both paths run against the in-process fake AnkiConnect server, so no Anki install is needed.
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import anki_handler
+from benchmarks import fake_anki_connect
+
+
+def make_cards(count: int, prefix: str) -> list[dict[str, str]]:
+    return [
+        {"front": f"{prefix} question {i}?", "back": f"answer {i}", "tags": "benchmark"}
+        for i in range(count)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cards", type=int, default=3000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.001, help="seconds added to every request")
+    args = parser.parse_args()
+
+    server, anki, url = fake_anki_connect.start_server(latency=args.latency)
+    anki_handler.ANKI_CONNECT_URL = url
+    try:
+        for name, run in [
+            ("add_cards", lambda cards: anki_handler.add_cards("bench", cards)),
+            ("add_cards_bulk", lambda cards: anki_handler.add_cards_bulk("bench", cards, args.batch_size)),
+        ]:
+            cards = make_cards(args.cards, name)
+            requests_before = anki.request_count
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run(cards)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>15}: {elapsed:7.3f}s, {anki.request_count - requests_before:>6} requests, "
+                f"{args.cards / elapsed:9.0f} cards/s"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
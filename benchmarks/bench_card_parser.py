@@ -0,0 +1,106 @@
+"""
+Check and benchmark the card parser against the reply corpus in benchmarks/card_replies.
+
+Run from the repository root:
+    python -m benchmarks.bench_card_parser
+    python -m benchmarks.bench_card_parser --scale 1 10 100 1000
+
+Every corpus file is parsed and its card count compared to expected.json. Then the whole corpus is
+repeated `scale` times into one long reply and parsed whole and streamed in 16-character pieces, next to
+the regex parser it replaced. Time per MB should stay flat as the reply grows.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import card_parser
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "card_replies")
+
+
+def load_corpus() -> tuple[Dict[str, str], Dict[str, int]]:
+    with open(os.path.join(CORPUS_PATH, "expected.json"), "r", encoding="utf-8") as f:
+        expected = json.load(f)
+    replies = {}
+    for name in expected:
+        with open(os.path.join(CORPUS_PATH, name), "r", encoding="utf-8") as f:
+            replies[name] = f.read()
+    return replies, expected
+
+
+def regex_parse(reply: str) -> List[Dict[str, Any]]:
+    # the parser before card_parser.scan_cards: non-greedy array regex, then json.loads per {...} fragment
+    match = re.search(r"\[.*?\]", reply, re.DOTALL)
+    if not match:
+        return []
+    cards = []
+    for card_str in re.findall(r"\{[^{}]*\}", match.group(0)):
+        try:
+            cards.append(json.loads(card_str.strip().rstrip(",")))
+        except json.JSONDecodeError:
+            pass
+    return cards
+
+
+def stream_parse(reply: str) -> List[Dict[str, Any]]:
+    parser = card_parser.CardStreamParser()
+    cards: List[Dict[str, Any]] = []
+    for i in range(0, len(reply), 16):
+        cards += parser.feed(reply[i : i + 16])
+    return cards + parser.close()
+
+
+def check_corpus(replies: Dict[str, str], expected: Dict[str, int]) -> int:
+    failures = 0
+    print(f"{'reply':<40} {'expected':>8} {'parsed':>7} {'stream':>7} {'regex':>6}")
+    for name, reply in replies.items():
+        parsed = card_parser.parse_cards(reply)
+        streamed = stream_parse(reply)
+        ok = len(parsed) == expected[name] and streamed == parsed
+        failures += not ok
+        print(
+            f"{name:<40} {expected[name]:>8} {len(parsed):>7} {len(streamed):>7} {len(regex_parse(reply)):>6}"
+            f"{'' if ok else '  FAIL'}"
+        )
+    return failures
+
+
+def time_parser(parse: Callable[[str], List[Dict[str, Any]]], reply: str, repeat: int = 3) -> tuple[float, int]:
+    best = float("inf")
+    cards = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cards = len(parse(reply))
+        best = min(best, time.perf_counter() - start)
+    return best, cards
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    replies, expected = load_corpus()
+    failures = check_corpus(replies, expected)
+
+    corpus = "\n".join(replies.values())
+    print(f"\n{'scale':>6} {'MB':>7} {'parser':<8} {'cards':>7} {'seconds':>9} {'s/MB':>8}")
+    for scale in args.scale:
+        reply = corpus * scale
+        size_mb = len(reply.encode("utf-8")) / 1024 / 1024
+        for label, parse in (("whole", card_parser.parse_cards), ("stream", stream_parse), ("regex", regex_parse)):
+            elapsed, cards = time_parser(parse, reply)
+            print(f"{scale:>6} {size_mb:>7.2f} {label:<8} {cards:>7} {elapsed:>9.4f} {elapsed / size_mb:>8.3f}")
+
+    if failures:
+        print(f"\n{failures} corpus replies parsed wrong")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
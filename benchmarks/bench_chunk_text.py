@@ -0,0 +1,35 @@
+"""
+Benchmark `file_handler.chunk_text` over growing synthetic documents.
+
+Run from the repository root:
+    python -m benchmarks.bench_chunk_text
+
+Time per MB should stay roughly flat as the document grows, showing that chunking is linear.
+"""
+
+import argparse
+import time
+
+import file_handler
+from benchmarks.synthetic_docs import make_document
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[250, 500, 1000, 2000, 4000])
+    parser.add_argument("--max-tokens", type=int, default=3000)
+    parser.add_argument("--overlap-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    file_handler.get_encoder()  # keep encoder loading out of the timings
+    print(f"{'size (KB)':>10} {'chunks':>8} {'seconds':>10} {'s/MB':>8}")
+    for size_kb in args.sizes_kb:
+        document = make_document(size_kb * 1024)
+        start = time.perf_counter()
+        chunks = sum(1 for _ in file_handler.chunk_text(document, args.max_tokens, args.overlap_tokens))
+        elapsed = time.perf_counter() - start
+        print(f"{size_kb:>10} {chunks:>8} {elapsed:>10.3f} {elapsed / (size_kb / 1024):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Check that importing the app stays cheap.
+
+Run from the repository root:
+    python -m benchmarks.bench_import_time
+    python -m benchmarks.bench_import_time --module main --budget-ms 200 --runs 5
+
+`python -X importtime -c "import main"` is run in fresh interpreters. The best cumulative import time of
+the module is compared to the budget, and none of the heavy libraries that are meant to load on first use
+(readers, tokenizer, numpy, LLM and HTTP clients) may show up in the import tree. Exits with status 1 on
+a regression, so it can run in CI. The slowest direct imports of the module are listed.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import List
+
+HEAVY_MODULES = ("ollama", "pydantic", "httpx", "requests", "numpy", "tiktoken", "pdfplumber", "docx", "psutil")
+
+
+def import_times(module: str) -> List[tuple[int, int, str]]:
+    # (depth, cumulative microseconds, name) per imported module, in the order -X importtime reports them
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, int(cumulative), name.strip()))
+    return entries
+
+
+def direct_imports(entries: List[tuple[int, int, str]], module: str) -> List[tuple[int, str]]:
+    # children are reported before their parent, so the module's direct imports are the depth-1 entries
+    # between the previous top-level entry and the module's own entry
+    children: List[tuple[int, str]] = []
+    for depth, cumulative, name in entries:
+        if depth == 0:
+            if name == module:
+                return children
+            children = []
+        elif depth == 1:
+            children.append((cumulative, name))
+    return []
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=200.0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    best: List[tuple[int, int, str]] = []
+    best_us = None
+    for _ in range(args.runs):
+        entries = import_times(args.module)
+        total = next(cumulative for depth, cumulative, name in entries if depth == 0 and name == args.module)
+        if best_us is None or total < best_us:
+            best, best_us = entries, total
+    assert best_us is not None
+
+    print(f"import {args.module}: {best_us / 1000:.1f} ms (best of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"\n{'ms':>8}  slowest direct imports")
+    for cumulative, name in sorted(direct_imports(best, args.module), reverse=True)[: args.top]:
+        print(f"{cumulative / 1000:>8.1f}  {name}")
+
+    problems = []
+    if best_us / 1000 > args.budget_ms:
+        problems.append(f"import took {best_us / 1000:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    loaded = sorted({name.split(".")[0] for _, _, name in best} & set(HEAVY_MODULES))
+    if loaded:
+        problems.append(f"heavy modules imported eagerly: {', '.join(loaded)}")
+    for problem in problems:
+        print(f"\nFAIL: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+End-to-end throughput benchmark of the chunk → prompt → parse → store → Anki pipeline.
+
+Everything runs locally: a fake LLM server (Ollama or OpenAI API) and a fake AnkiConnect server
+are started in-process, and the source documents are synthetic. Generation goes through
+`helpers.generate_cards_concurrently` like `main.generate_deck` does; with --stream, replies are
+streamed and cards go through a `helpers.CardSink` to the deck store and Anki as they are parsed.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline --sizes 10KB 1MB --llm-latency 0.2 --concurrency 8
+    python -m benchmarks.bench_pipeline --sizes 10KB 1MB --stream
+
+Stage timings are normalized (seconds per MB of source text, or per 1000 cards) and compared to
+benchmarks/baselines.json. A stage more than --tolerance slower than its baseline is reported as a
+regression and the exit status is 1. The generate stage is not compared since it is dominated by the
+configured fake latency. Parse, store and Anki times are summed over the worker threads.
+
+Timings depend on the machine, so no baseline is committed. Record one on a known good revision first,
+with the same sizes and flags the comparison runs will use:
+    python -m benchmarks.bench_pipeline --sizes 10KB 1MB --save-baseline
+Without a baseline for a size, its stages are printed but not compared.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List
+
+import metrics
+from benchmarks import fake_anki_connect, fake_llm_server, synthetic_docs
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# stage -> unit its time is normalized by, stages without a unit are reported but not compared
+STAGE_UNITS = {
+    "extract": "MB",
+    "chunk": "MB",
+    "generate": None,
+    "parse": "1k cards",
+    "store": "1k cards",
+    "anki": "1k cards",
+}
+
+
+@contextlib.contextmanager
+def stage(timings: Dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    timings[name] = time.perf_counter() - start
+
+
+def timer_total(name: str, **labels: str) -> float:
+    # seconds recorded under a metrics timer, summed over its labels (threads record concurrently)
+    return sum(
+        values["sum"]
+        for (timer, timer_labels), values in metrics.registry.timers.items()
+        if timer == name and all((label, value) in timer_labels for label, value in labels.items())
+    )
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_pipeline(label: str, args: argparse.Namespace, llm: fake_llm_server.FakeLLM) -> Dict[str, Any]:
+    """
+    Run every pipeline stage once over a synthetic document.
+
+    Args:
+        label (str): Document size label, see `synthetic_docs.SIZES`.
+        args (argparse.Namespace): Command line settings.
+        llm (fake_llm_server.FakeLLM): The fake LLM, used to read token counters.
+
+    Returns:
+        dict: Raw stage timings, counts and normalized timings.
+    """
+
+    # imported here so OLLAMA_HOST is set before the ollama client is created
+    import anki_handler
+    import deck_store
+    import file_handler
+    import helpers
+
+    path = synthetic_docs.ensure_document(label)
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    timings: Dict[str, float] = {}
+    tokens_before = (llm.prompt_tokens, llm.completion_tokens)
+
+    with stage(timings, "extract"):
+        pieces = list(file_handler.iter_file(path) or [])
+    with stage(timings, "chunk"):
+        chunks = list(file_handler.chunk_pieces(pieces, args.max_tokens))
+    llm_chunks = chunks[: args.max_chunks] if args.max_chunks else chunks
+
+    options = {"topic": "benchmark", "card_amount": str(llm.cards)}
+    prompts = {
+        "generate_flashcards_system": "Create flashcards about {{topic}} from the text below.",
+        "generate_flashcards_request": "Create {{card_amount}} cards from:\n{{text}}",
+    }
+    config = {"provider": args.provider, "model": "fake"}
+    deck_name = f"bench {label} {time.time()}"
+
+    metrics.registry.reset()
+    cards: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        with deck_store.DeckStore(os.path.join(directory, "bench.jsonl")) as store:
+            with stage(timings, "generate"):
+                sink = helpers.CardSink(store, deck_name) if args.stream else None
+                for _, chunk_cards in helpers.generate_cards_concurrently(
+                    options, config, prompts, llm_chunks, args.concurrency, sink.add if sink is not None else None
+                ):
+                    if chunk_cards is None:
+                        continue
+                    if sink is None:
+                        store.append(chunk_cards)
+                    cards += chunk_cards
+    timings["store"] = timer_total("deck_store_append")
+    if args.stream:
+        # cards were parsed while streaming, inside the generate stage, and added to anki one at a time
+        timings["anki"] = timer_total("anki_request", action="addNote")
+    else:
+        timings["parse"] = timer_total("parse")
+        with stage(timings, "anki"):
+            anki_handler.add_cards_bulk(deck_name, cards, args.anki_batch_size)
+
+    per_unit = {"MB": size_mb, "1k cards": max(len(cards), 1) / 1000}
+    normalized = {
+        name: timings[name] / per_unit[unit] for name, unit in STAGE_UNITS.items() if unit and name in timings
+    }
+    return {
+        "size_mb": size_mb,
+        "chunks": len(chunks),
+        "llm_calls": len(llm_chunks),
+        "cards": len(cards),
+        "timings": timings,
+        "normalized": normalized,
+        "cards_per_second": len(cards) / sum(timings.values()),
+        "prompt_tokens": llm.prompt_tokens - tokens_before[0],
+        "completion_tokens": llm.completion_tokens - tokens_before[1],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def report(label: str, result: Dict[str, Any], baseline: Dict[str, float] | None, tolerance: float) -> List[str]:
+    """
+    Print one run's results and return the stages that regressed against the baseline.
+
+    Args:
+        label (str): Document size label.
+        result (dict): Output of `run_pipeline`.
+        baseline (dict or None): Normalized stage timings to compare against.
+        tolerance (float): Allowed relative slowdown, e.g. 0.25 for 25 %.
+
+    Returns:
+        list of str: Descriptions of the regressed stages.
+    """
+
+    print(
+        f"\n== {label}: {result['size_mb']:.2f} MB, {result['chunks']} chunks, {result['llm_calls']} LLM calls, "
+        f"{result['cards']} cards"
+    )
+    regressions: List[str] = []
+    for name, unit in STAGE_UNITS.items():
+        if name not in result["timings"]:
+            continue
+        line = f"  {name:<8} {result['timings'][name]:9.3f}s"
+        if unit:
+            value = result["normalized"][name]
+            line += f"   {value:9.4f}s per {unit}"
+            if baseline and name in baseline:
+                change = value / baseline[name] - 1 if baseline[name] else 0.0
+                line += f"   ({change:+.0%} vs baseline)"
+                if change > tolerance:
+                    line += "  REGRESSION"
+                    regressions.append(f"{label}/{name}: {change:+.0%}")
+        print(line)
+    print(
+        f"  {result['cards_per_second']:.1f} cards/s, peak RSS {result['peak_rss_mb']:.1f} MB, "
+        f"LLM tokens {result['prompt_tokens']} prompt / {result['completion_tokens']} completion"
+    )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["10KB", "100KB", "1MB"], choices=list(synthetic_docs.SIZES))
+    parser.add_argument("--provider", default="ollama", choices=["ollama", "openai"])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-tokens", type=int, default=3000, help="chunk size in tokens")
+    parser.add_argument("--max-chunks", type=int, default=0, help="limit LLM calls per document, 0 for all chunks")
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--llm-token-latency", type=float, default=0.0)
+    parser.add_argument("--cards-per-reply", type=int, default=5)
+    parser.add_argument("--answer-words", type=int, default=12)
+    parser.add_argument("--anki-port", type=int, default=8765, help="port of the fake AnkiConnect, 0 for any free port")
+    parser.add_argument("--anki-batch-size", type=int, default=500)
+    parser.add_argument("--stream", action="store_true", help="stream replies into a CardSink, like stream_responses")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a stage is flagged")
+    args = parser.parse_args()
+
+    llm_server, llm, llm_url = fake_llm_server.start_server(
+        latency=args.llm_latency,
+        token_latency=args.llm_token_latency,
+        cards=args.cards_per_reply,
+        answer_words=args.answer_words,
+    )
+    anki_server, _, anki_url = fake_anki_connect.start_server(args.anki_port)
+    os.environ["OLLAMA_HOST"] = llm_url
+    os.environ["OPENAI_API_URL"] = f"{llm_url}/v1/chat/completions"
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    import anki_handler
+
+    anki_handler.ANKI_CONNECT_URL = anki_url
+
+    baselines: Dict[str, Dict[str, float]] = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    regressions: List[str] = []
+    missing: List[str] = []
+    try:
+        for label in args.sizes:
+            # streamed runs time different stages, they are compared to their own baseline
+            key = f"{label} stream" if args.stream else label
+            result = run_pipeline(label, args, llm)
+            if not args.save_baseline and key not in baselines:
+                missing.append(key)
+            regressions += report(label, result, None if args.save_baseline else baselines.get(key), args.tolerance)
+            if args.save_baseline:
+                baselines[key] = result["normalized"]
+    finally:
+        llm_server.shutdown()
+        anki_server.shutdown()
+
+    if args.save_baseline:
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2)
+        print(f"\nbaseline saved to {BASELINES_PATH}")
+        return
+    if missing:
+        print(f"\nno baseline for {', '.join(missing)}, record one with --save-baseline to compare against")
+    if regressions:
+        print("\nregressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Regression checks for `file_handler.chunk_text`.
+
+Run from the repository root:
+    python -m benchmarks.check_chunk_text
+
+Checks that
+- chunking ends for every overlap below max_tokens, also when the overlap is more than half a chunk and
+  paragraph breaks fall inside the carried-over overlap (this used to loop forever for (50, 45)),
+- no chunk is longer than max_tokens tokens,
+- sentences longer than max_tokens are cut without splitting a multi-byte character into U+FFFD.
+
+Exits with status 1 on the first failure.
+"""
+
+import itertools
+import sys
+from typing import List
+
+import file_handler
+
+# short paragraphs of one or two sentences, so every few sentences there is a paragraph break to cut at
+PARAGRAPHS = "\n\n".join(
+    f"Paragraph {i} talks about topic number {i}. It has a second sentence about detail {i}."
+    if i % 2
+    else f"Paragraph {i} is a single sentence about subject {i}."
+    for i in range(200)
+)
+# no spaces or sentence ends, so the whole text is one sentence cut at token boundaries
+LONG_SENTENCES = ["漢字かな交じり文" * 400, "🙂🚀🧪" * 400, "Größenänderungsübersicht" * 200]
+LAYOUTS = [(50, 0), (50, 30), (50, 45), (50, 49), (120, 100), (3000, 1000)]
+
+
+def check(ok: bool, message: str) -> None:
+    if not ok:
+        print(f"FAIL: {message}")
+        sys.exit(1)
+
+
+def chunks(text: str, max_tokens: int, overlap_tokens: int) -> List[str]:
+    # a chunker that loops forever would produce far more chunks than the text has tokens
+    limit = len(file_handler.get_encoder().encode_ordinary(text)) + 10
+    result = list(itertools.islice(file_handler.chunk_text(text, max_tokens, overlap_tokens), limit))
+    check(len(result) < limit, f"chunk_text({max_tokens}, {overlap_tokens}) does not terminate")
+    return result
+
+
+def main() -> None:
+    enc = file_handler.get_encoder()
+    for max_tokens, overlap_tokens in LAYOUTS:
+        result = chunks(PARAGRAPHS, max_tokens, overlap_tokens)
+        for chunk in result:
+            check(
+                len(enc.encode_ordinary(chunk)) <= max_tokens,
+                f"chunk_text({max_tokens}, {overlap_tokens}) made a chunk over the limit: {chunk[:60]!r}",
+            )
+        check("Paragraph 199" in result[-1], f"chunk_text({max_tokens}, {overlap_tokens}) lost the end of the text")
+        print(f"paragraphs, max {max_tokens}, overlap {overlap_tokens}: {len(result)} chunks ok")
+
+    for text in LONG_SENTENCES:
+        for max_tokens in (7, 50, 333):
+            result = chunks(text, max_tokens, 0)
+            check(
+                all("�" not in chunk for chunk in result),
+                f"a cut through {text[:8]!r} at {max_tokens} tokens split a character",
+            )
+            check("".join(result) == text, f"cutting {text[:8]!r} at {max_tokens} tokens changed the text")
+        print(f"long sentence {text[:8]!r}: ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+In-memory stand-in for the AnkiConnect add-on, for benchmarks and local testing without Anki.
+
+Run from the repository root:
+    python -m benchmarks.fake_anki_connect --port 8765
+
+or start it in-process with `start_server()`.
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List
+
+
+class FakeAnki:
+    """
+    Minimal AnkiConnect (version 6) action implementation backed by dictionaries.
+
+    Duplicates are detected like Anki does by default: same note type and same first field.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.decks: Dict[str, int] = {"Default": 1}
+        self.notes: Dict[int, Dict[str, Any]] = {}
+        self.first_fields: Dict[tuple[str, str], int] = {}
+        self.next_id = int(time.time() * 1000)
+        self.request_count = 0
+        self.action_counts: Dict[str, int] = {}
+        self.actions: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            "version": lambda params: 6,
+            "deckNames": lambda params: list(self.decks),
+            "createDeck": self.create_deck,
+            "addNote": self.add_note,
+            "addNotes": self.add_notes,
+            "canAddNotes": self.can_add_notes,
+            "findNotes": self.find_notes,
+            "notesInfo": self.notes_info,
+            "updateNoteFields": self.update_note_fields,
+            "deleteNotes": self.delete_notes,
+            "multi": self.multi,
+        }
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        action = request.get("action", "")
+        with self.lock:
+            self.action_counts[action] = self.action_counts.get(action, 0) + 1
+        handler = self.actions.get(action)
+        if handler is None:
+            return {"result": None, "error": "unsupported action"}
+        try:
+            with self.lock:
+                return {"result": handler(request.get("params", {})), "error": None}
+        except Exception as err:
+            return {"result": None, "error": str(err)}
+
+    def create_deck(self, params: Dict[str, Any]) -> int:
+        return self.decks.setdefault(params["deck"], len(self.decks) + 1)
+
+    @staticmethod
+    def _key(note: Dict[str, Any]) -> tuple[str, str]:
+        return note["modelName"], next(iter(note["fields"].values()), "")
+
+    def _index(self, note: Dict[str, Any], delta: int) -> None:
+        key = self._key(note)
+        self.first_fields[key] = self.first_fields.get(key, 0) + delta
+        if self.first_fields[key] <= 0:
+            del self.first_fields[key]
+
+    def _is_duplicate(self, note: Dict[str, Any]) -> bool:
+        return self._key(note) in self.first_fields
+
+    def _can_add(self, note: Dict[str, Any]) -> bool:
+        fields = note.get("fields", {})
+        return bool(next(iter(fields.values()), "")) and note.get("deckName") in self.decks and not self._is_duplicate(note)
+
+    def add_note(self, params: Dict[str, Any]) -> int:
+        note = params["note"]
+        if not self._can_add(note):
+            raise ValueError("cannot create note because it is a duplicate")
+        self.next_id += 1
+        self.notes[self.next_id] = {
+            "deckName": note["deckName"],
+            "modelName": note["modelName"],
+            "fields": dict(note["fields"]),
+            "tags": list(note.get("tags", [])),
+        }
+        self._index(note, 1)
+        return self.next_id
+
+    def add_notes(self, params: Dict[str, Any]) -> List[int | None]:
+        ids: List[int | None] = []
+        for note in params["notes"]:
+            try:
+                ids.append(self.add_note({"note": note}))
+            except ValueError:
+                ids.append(None)
+        return ids
+
+    def can_add_notes(self, params: Dict[str, Any]) -> List[bool]:
+        return [self._can_add(note) for note in params["notes"]]
+
+    def find_notes(self, params: Dict[str, Any]) -> List[int]:
+        match = re.search(r'deck:"?([^"]+)"?', params.get("query", ""))
+        if not match:
+            return list(self.notes)
+        deck = match.group(1)
+        return [note_id for note_id, note in self.notes.items() if note["deckName"] == deck]
+
+    def notes_info(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        info: List[Dict[str, Any]] = []
+        for note_id in params["notes"]:
+            note = self.notes.get(note_id)
+            if note is None:
+                info.append({})
+                continue
+            info.append(
+                {
+                    "noteId": note_id,
+                    "modelName": note["modelName"],
+                    "tags": note["tags"],
+                    "fields": {
+                        name: {"value": value, "order": order}
+                        for order, (name, value) in enumerate(note["fields"].items())
+                    },
+                }
+            )
+        return info
+
+    def update_note_fields(self, params: Dict[str, Any]) -> None:
+        note = params["note"]
+        existing = self.notes[note["id"]]
+        self._index(existing, -1)
+        existing["fields"].update(note["fields"])
+        self._index(existing, 1)
+
+    def delete_notes(self, params: Dict[str, Any]) -> None:
+        for note_id in params["notes"]:
+            note = self.notes.pop(note_id, None)
+            if note is not None:
+                self._index(note, -1)
+
+    def multi(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        for action in params["actions"]:
+            handler = self.actions.get(action["action"])
+            try:
+                if handler is None:
+                    raise ValueError("unsupported action")
+                results.append({"result": handler(action.get("params", {})), "error": None})
+            except Exception as err:
+                results.append({"result": None, "error": str(err)})
+        return results
+
+
+def make_handler(anki: FakeAnki) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real add-on
+        disable_nagle_algorithm = True
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            anki.request_count += 1
+            if anki.latency:
+                time.sleep(anki.latency)
+            payload = json.dumps(anki.handle(json.loads(body or b"{}"))).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def start_server(port: int = 0, latency: float = 0.0) -> tuple[ThreadingHTTPServer, FakeAnki, str]:
+    """
+    Start a fake AnkiConnect server in a background thread.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        latency (float): Seconds of artificial delay added to every request.
+
+    Returns:
+        tuple: (server, fake anki state, base url). Call `server.shutdown()` when done.
+    """
+
+    anki = FakeAnki(latency)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(anki))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, anki, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake AnkiConnect server.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    args = parser.parse_args()
+    anki = FakeAnki(args.latency)
+    print(f"fake AnkiConnect listening on http://127.0.0.1:{args.port}")
+    ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(anki)).serve_forever()
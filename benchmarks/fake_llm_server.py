@@ -0,0 +1,211 @@
+"""
+Deterministic stand-in for an LLM server speaking both the Ollama and the OpenAI chat APIs.
+
+Run from the repository root:
+    python -m benchmarks.fake_llm_server --port 11434 --latency 0.5 --cards 5
+
+or start it in-process with `start_server()`. Point the app at it with OLLAMA_HOST=http://127.0.0.1:<port>
+or OPENAI_API_URL=http://127.0.0.1:<port>/v1/chat/completions.
+
+Replies are a list of flashcards in the Python dict format the prompt asks for. Their content is derived
+from a hash of the prompt, so the same prompt always gets the same reply.
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class FakeLLM:
+    """
+    Reply generator and usage counters shared by all requests of a fake server.
+
+    Args:
+        latency (float): Seconds of delay before the first token of every reply.
+        token_latency (float): Seconds of delay per generated token, spread over the stream.
+        cards (int): Number of cards in every reply.
+        answer_words (int): Number of words in each card's answer, controls reply size.
+        think (bool): Prefix replies with a `<think>` block like deepseek-r1 does.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        cards: int = 5,
+        answer_words: int = 12,
+        think: bool = False,
+    ) -> None:
+        self.latency = latency
+        self.token_latency = token_latency
+        self.cards = cards
+        self.answer_words = answer_words
+        self.think = think
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        # rough cl100k_base estimate, good enough for throughput numbers
+        return max(1, len(text) // 4)
+
+    def reply(self, messages: List[Dict[str, str]]) -> List[str]:
+        """
+        Build the reply for a conversation and record its usage.
+
+        Args:
+            messages (list of dict): Chat messages with 'role' and 'content'.
+
+        Returns:
+            list of str: The reply split into stream pieces of a few characters each.
+        """
+
+        prompt = "\n".join(message.get("content", "") for message in messages)
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        lines: List[str] = []
+        if self.think:
+            lines.append("<think>\nThe user wants flashcards {like these}. Let me write them.\n</think>\n")
+        lines.append("[\n")
+        for i in range(self.cards):
+            answer = " ".join(f"word{(int(seed[i % 56 : i % 56 + 8], 16) + j) % 997}" for j in range(self.answer_words))
+            lines.append(
+                f'    {{"front": "Question {seed[:12]}-{i}?", "back": "{answer}.", "tags": "benchmark"}},\n'
+            )
+        lines.append("]")
+        text = "".join(lines)
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += self.count_tokens(prompt)
+            self.completion_tokens += self.count_tokens(text)
+        return [text[i : i + 16] for i in range(0, len(text), 16)]
+
+
+def make_handler(llm: FakeLLM) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            pieces = llm.reply(body.get("messages", []))
+            stream = body.get("stream", self.path == "/api/chat")  # ollama streams unless told not to
+            if llm.latency:
+                time.sleep(llm.latency)
+            if self.path == "/api/chat":
+                self.ollama(body, pieces, stream)
+            elif self.path == "/v1/chat/completions":
+                self.openai(body, pieces, stream)
+            else:
+                self.send_json(404, {"error": f"unknown path {self.path}"})
+
+        def piece_delay(self, pieces: List[str]) -> float:
+            return llm.token_latency * sum(llm.count_tokens(piece) for piece in pieces) / max(1, len(pieces))
+
+        def ollama(self, body: Dict[str, Any], pieces: List[str], stream: bool) -> None:
+            model = body.get("model", "fake")
+            if not stream:
+                time.sleep(self.piece_delay(pieces) * len(pieces))
+                self.send_json(
+                    200,
+                    {
+                        "model": model,
+                        "message": {"role": "assistant", "content": "".join(pieces)},
+                        "done": True,
+                        "done_reason": "stop",
+                    },
+                )
+                return
+            self.start_chunked("application/x-ndjson")
+            for piece in pieces:
+                time.sleep(self.piece_delay(pieces))
+                self.write_chunk(json.dumps({"model": model, "message": {"role": "assistant", "content": piece}, "done": False}) + "\n")
+            self.write_chunk(json.dumps({"model": model, "message": {"role": "assistant", "content": ""}, "done": True}) + "\n")
+            self.write_chunk("")
+
+        def openai(self, body: Dict[str, Any], pieces: List[str], stream: bool) -> None:
+            model = body.get("model", "fake")
+            if not stream:
+                time.sleep(self.piece_delay(pieces) * len(pieces))
+                text = "".join(pieces)
+                self.send_json(
+                    200,
+                    {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                        "usage": {
+                            "prompt_tokens": FakeLLM.count_tokens(json.dumps(body.get("messages", []))),
+                            "completion_tokens": FakeLLM.count_tokens(text),
+                        },
+                    },
+                )
+                return
+            self.start_chunked("text/event-stream")
+            for piece in pieces:
+                time.sleep(self.piece_delay(pieces))
+                event = {"object": "chat.completion.chunk", "model": model, "choices": [{"index": 0, "delta": {"content": piece}}]}
+                self.write_chunk(f"data: {json.dumps(event)}\n\n")
+            self.write_chunk("data: [DONE]\n\n")
+            self.write_chunk("")
+
+        def send_json(self, status: int, payload: Dict[str, Any]) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def start_chunked(self, content_type: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def write_chunk(self, text: str) -> None:
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def start_server(port: int = 0, **settings: Any) -> tuple[ThreadingHTTPServer, FakeLLM, str]:
+    """
+    Start a fake LLM server in a background thread.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        **settings: Passed on to `FakeLLM`.
+
+    Returns:
+        tuple: (server, fake llm state, base url). Call `server.shutdown()` when done.
+    """
+
+    llm = FakeLLM(**settings)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(llm))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, llm, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama / OpenAI chat server.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per generated token")
+    parser.add_argument("--cards", type=int, default=5, help="cards per reply")
+    parser.add_argument("--answer-words", type=int, default=12, help="words per answer")
+    parser.add_argument("--think", action="store_true", help="prefix replies with a <think> block")
+    args = parser.parse_args()
+    llm = FakeLLM(args.latency, args.token_latency, args.cards, args.answer_words, args.think)
+    print(f"fake LLM server listening on http://127.0.0.1:{args.port}")
+    ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(llm)).serve_forever()
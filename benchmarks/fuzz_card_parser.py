@@ -0,0 +1,114 @@
+"""
+Fuzz the card parser with mutated replies from benchmarks/card_replies.
+
+Run from the repository root:
+    python -m benchmarks.fuzz_card_parser --iterations 20000 --seed 1
+
+Each iteration takes a corpus reply, applies a few random mutations (truncation, deleted, duplicated
+or inserted characters, swapped quote styles, unbalanced brackets, think tags) and checks that
+- parsing never raises,
+- every returned card has 'front', 'back' and 'tags',
+- streaming the reply in random pieces gives the same cards as parsing it whole,
+- parsing stays linear: a reply is not allowed to take much longer per character than the corpus average.
+
+Failing inputs are written to the directory given by --failures for reproduction.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+import card_parser
+from benchmarks.bench_card_parser import load_corpus
+
+NOISE = list("{}[]()\"'“”‘’,:;\\\n\t ") + ["<think>", "</think>", "True", "None", "\\u00e4", "```", "..."]
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    for _ in range(rng.randint(1, 4)):
+        if not text:
+            break
+        i = rng.randrange(len(text))
+        kind = rng.randrange(7)
+        if kind == 0:
+            text = text[:i]
+        elif kind == 1:
+            text = text[:i] + text[i + rng.randint(1, 8) :]
+        elif kind == 2:
+            text = text[:i] + rng.choice(NOISE) + text[i:]
+        elif kind == 3:
+            j = min(len(text), i + rng.randint(1, 200))
+            text = text[:j] + text[i:j] + text[j:]
+        elif kind == 4:
+            quotes = ['"', "'", "“", "”"]
+            old, new = rng.sample(quotes, 2)
+            text = text.replace(old, new)
+        elif kind == 5:
+            text = rng.choice(["{", "[", "<think>", "{'front': \""]) * rng.randint(1, 50) + text
+        else:
+            text = text[:i] + "".join(rng.choice(NOISE) for _ in range(rng.randint(1, 30))) + text[i:]
+    return text
+
+
+def stream(text: str, rng: random.Random) -> List[Dict[str, Any]]:
+    parser = card_parser.CardStreamParser()
+    cards: List[Dict[str, Any]] = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 40)
+        cards += parser.feed(text[i : i + size])
+        i += size
+    return cards + parser.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slowdown", type=float, default=50.0, help="allowed time per character vs the corpus average")
+    parser.add_argument("--failures", default="./.cache/fuzz_failures")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    replies = list(load_corpus()[0].values())
+
+    corpus = "".join(replies)
+    start = time.perf_counter()
+    for _ in range(20):
+        card_parser.parse_cards(corpus)
+    per_char = (time.perf_counter() - start) / 20 / len(corpus)
+
+    failures = 0
+    for iteration in range(args.iterations):
+        text = mutate(rng.choice(replies), rng)
+        problem = ""
+        try:
+            start = time.perf_counter()
+            cards = card_parser.parse_cards(text)
+            elapsed = time.perf_counter() - start
+            if not all(card_parser.is_card(card) for card in cards):
+                problem = "returned a card without the required keys"
+            elif stream(text, rng) != cards:
+                problem = "streamed cards differ from whole-reply cards"
+            elif elapsed > 0.001 and elapsed > per_char * len(text) * args.slowdown:
+                problem = f"slow: {elapsed * 1000:.1f} ms for {len(text)} characters"
+        except Exception as err:
+            problem = f"raised {err!r}"
+        if problem:
+            failures += 1
+            os.makedirs(args.failures, exist_ok=True)
+            path = os.path.join(args.failures, f"seed{args.seed}_{iteration}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            print(f"iteration {iteration}: {problem} ({path})")
+
+    print(f"{args.iterations} mutated replies, {failures} failures")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Deterministic synthetic source documents for the benchmarks, from 10 KB to 50 MB.
+
+Documents are generated on demand and kept under .cache/bench_docs, nothing large is committed.
+
+Run from the repository root to pre-generate all standard sizes:
+    python -m benchmarks.synthetic_docs
+"""
+
+import os
+import random
+
+WORDS = [
+    "puolustus", "ryhmä", "joukkue", "tuli", "asema", "maasto", "tehtävä", "johtaja",
+    "the", "squad", "defends", "position", "terrain", "order", "fire", "sector",
+]
+
+SIZES = {
+    "10KB": 10 * 1024,
+    "100KB": 100 * 1024,
+    "1MB": 1024 * 1024,
+    "10MB": 10 * 1024 * 1024,
+    "50MB": 50 * 1024 * 1024,
+}
+
+
+def make_document(size_bytes: int, seed: int = 0) -> str:
+    """
+    Build a deterministic pseudo-text of roughly size_bytes bytes with sentences and paragraphs.
+
+    Args:
+        size_bytes (int): Approximate size of the document in bytes.
+        seed (int): Random seed so runs are comparable.
+
+    Returns:
+        str: The generated document.
+    """
+
+    rng = random.Random(seed)
+    paragraphs: list[str] = []
+    size = 0
+    while size < size_bytes:
+        sentences = [
+            " ".join(rng.choices(WORDS, k=rng.randint(4, 30))).capitalize() + "."
+            for _ in range(rng.randint(1, 8))
+        ]
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph.encode("utf-8")) + 2
+    return "\n\n".join(paragraphs)
+
+
+def ensure_document(label: str, directory: str = "./.cache/bench_docs") -> str:
+    """
+    Return the path of a standard-size synthetic .txt document, generating it if missing.
+
+    Args:
+        label (str): One of the keys of SIZES.
+        directory (str): Where generated documents are kept.
+
+    Returns:
+        str: Path to the document.
+    """
+
+    path = os.path.join(directory, f"synthetic_{label}.txt")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_document(SIZES[label]))
+    return path
+
+
+if __name__ == "__main__":
+    for label in SIZES:
+        print(ensure_document(label))
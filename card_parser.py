@@ -0,0 +1,356 @@
+import re
+from typing import Any, Dict, List
+
+REQUIRED_KEYS = ("front", "back", "tags")
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+# cards are flat, deeper nesting is garbage and would only exhaust the stack
+MAX_DEPTH = 16
+
+# opening quote -> characters that may close it; smart quotes are often mixed up by models
+_CLOSERS = {
+    '"': '"',
+    "'": "'",
+    "“": "”“\"",
+    "”": "”“\"",
+    "„": "“”\"",
+    "‘": "’‘'",
+    "’": "’‘'",
+}
+# a string ends at the next closing quote or backslash that matters, found with one regex search
+_STRING_STOP = {quote: re.compile("[\\\\" + re.escape(closers) + "]") for quote, closers in _CLOSERS.items()}
+_STRUCTURAL = ",:}]"
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_WHITESPACE = re.compile(r"\s*")
+_BARE_KEY = re.compile(r"[^:,{}\[\]\s]+")
+_BARE_VALUE = re.compile(r"[^,}\]\n]*")
+_NUMBER = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?")
+
+
+class _Incomplete(Exception):
+    """The text ended inside a value; more input may complete it."""
+
+
+class _Malformed(Exception):
+    def __init__(self, pos: int) -> None:
+        super().__init__(pos)
+        self.pos = pos
+
+
+class _Reader:
+    """
+    Tolerant recursive-descent reader for the JSON-like objects models write.
+
+    Accepts JSON and Python literal syntax: double, single and smart quotes, trailing or doubled commas,
+    unquoted keys, True/False/None and bare words. A quote only closes a string when it is followed by
+    `,`, `:`, `}`, `]` or the end of the text, so apostrophes and unescaped quotes inside values survive.
+
+    Args:
+        text (str): The text to read from.
+        final (bool): Whether text is complete. If not, values running into the end raise `_Incomplete`.
+    """
+
+    def __init__(self, text: str, final: bool = True) -> None:
+        self.text = text
+        self.final = final
+        self.depth = 0
+
+    def skip_ws(self, i: int) -> int:
+        return _WHITESPACE.match(self.text, i).end()  # type: ignore[union-attr]
+
+    def value(self, i: int) -> tuple[Any, int]:
+        text = self.text
+        i = self.skip_ws(i)
+        if i >= len(text):
+            raise _Incomplete
+        char = text[i]
+        if char in "{[":
+            if self.depth >= MAX_DEPTH:
+                raise _Malformed(i)
+            self.depth += 1
+            try:
+                return self.object(i) if char == "{" else self.array(i)
+            finally:
+                self.depth -= 1
+        if char in _CLOSERS:
+            return self.string(i)
+        match = _BARE_VALUE.match(text, i)
+        end = match.end()  # type: ignore[union-attr]
+        if end >= len(text) and not self.final:
+            raise _Incomplete
+        word = text[i:end].strip()
+        if not word:
+            raise _Malformed(i)
+        if word in _LITERALS:
+            return _LITERALS[word], end
+        if _NUMBER.fullmatch(word):
+            return (float(word) if any(c in word for c in ".eE") else int(word)), end
+        return word, end
+
+    def string(self, i: int) -> tuple[str, int]:
+        text = self.text
+        stop = _STRING_STOP[text[i]]
+        parts: List[str] = []
+        start = i + 1
+        j = start
+        while True:
+            match = stop.search(text, j)
+            if match is None:
+                raise _Incomplete
+            k = match.start()
+            if text[k] == "\\":
+                if k + 1 >= len(text):
+                    raise _Incomplete
+                parts.append(text[start:k])
+                escaped = text[k + 1]
+                if escaped == "u":
+                    digits = text[k + 2 : k + 6]
+                    if len(digits) < 4 and not self.final:
+                        raise _Incomplete
+                    try:
+                        parts.append(chr(int(digits, 16)))
+                        start = j = k + 6
+                    except ValueError:
+                        parts.append("u")
+                        start = j = k + 2
+                else:
+                    parts.append(_ESCAPES.get(escaped, escaped))
+                    start = j = k + 2
+                continue
+            after = self.skip_ws(k + 1)
+            if after >= len(text):
+                if not self.final:
+                    raise _Incomplete
+            elif text[after] not in _STRUCTURAL:
+                # a quote inside the value, e.g. an apostrophe
+                j = k + 1
+                continue
+            parts.append(text[start:k])
+            return "".join(parts), k + 1
+
+    def object(self, i: int) -> tuple[Dict[str, Any], int]:
+        text = self.text
+        result: Dict[str, Any] = {}
+        i += 1
+        while True:
+            i = self.skip_ws(i)
+            if i >= len(text):
+                raise _Incomplete
+            char = text[i]
+            if char == "}":
+                return result, i + 1
+            if char == ",":
+                i += 1
+                continue
+            if char in _CLOSERS:
+                key, i = self.string(i)
+            else:
+                match = _BARE_KEY.match(text, i)
+                if match is None:
+                    raise _Malformed(i)
+                key, i = match.group(), match.end()
+            i = self.skip_ws(i)
+            if i >= len(text):
+                raise _Incomplete
+            if text[i] != ":":
+                raise _Malformed(i)
+            value, i = self.value(i + 1)
+            result[key.strip().lower()] = value
+
+    def array(self, i: int) -> tuple[List[Any], int]:
+        text = self.text
+        result: List[Any] = []
+        i += 1
+        while True:
+            i = self.skip_ws(i)
+            if i >= len(text):
+                raise _Incomplete
+            char = text[i]
+            if char == "]":
+                return result, i + 1
+            if char == ",":
+                i += 1
+                continue
+            if char == "}":
+                raise _Malformed(i)
+            value, i = self.value(i)
+            result.append(value)
+
+
+def is_card(value: Any) -> bool:
+    return isinstance(value, dict) and all(key in value for key in REQUIRED_KEYS)
+
+
+def _collect_cards(value: Any, cards: List[Dict[str, Any]]) -> int:
+    # cards may come wrapped, e.g. {"cards": [...]}
+    if is_card(value):
+        cards.append(value)
+        return 1
+    found = 0
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            if isinstance(item, (dict, list)):
+                found += _collect_cards(item, cards)
+    return found
+
+
+def scan_cards(text: str, pos: int = 0, final: bool = True) -> tuple[List[Dict[str, Any]], int, int]:
+    """
+    Read every card object in a model reply in a single pass.
+
+    `<think>...</think>` blocks are skipped. Each top-level `{...}` object is read in place with `_Reader`,
+    so the text is not split or copied first. A malformed object is counted as skipped and reading resumes
+    where it went wrong, which keeps the whole scan linear in the length of the text.
+
+    Args:
+        text (str): The reply, or the unread part of a streamed reply.
+        pos (int): Index to start reading at.
+        final (bool): Whether text is complete. If not, scanning stops before an unfinished object.
+
+    Returns:
+        tuple: (cards, number of skipped objects, index where reading should resume).
+    """
+
+    reader = _Reader(text, final)
+    cards: List[Dict[str, Any]] = []
+    skipped = 0
+    think = text.find(THINK_OPEN, pos)
+    while True:
+        start = text.find("{", pos)
+        if think != -1 and think < pos:
+            think = text.find(THINK_OPEN, pos)
+        if think != -1 and (start == -1 or think < start):
+            end = text.find(THINK_CLOSE, think)
+            if end == -1:
+                return cards, skipped, len(text) if final else think
+            pos = end + len(THINK_CLOSE)
+            continue
+        if start == -1:
+            # keep a possibly split "<think>" tag of a streamed reply
+            return cards, skipped, len(text) if final else max(pos, len(text) - len(THINK_OPEN))
+        try:
+            value, pos = reader.object(start)
+        except _Incomplete:
+            if not final:
+                return cards, skipped, start
+            # a truncated or unterminated object, the next one can start after its first closing brace at the earliest
+            skipped += 1
+            close = text.find("}", start)
+            if close == -1:
+                return cards, skipped, len(text)
+            pos = close + 1
+            continue
+        except _Malformed as err:
+            skipped += 1
+            pos = max(err.pos, start + 1)
+            continue
+        if not _collect_cards(value, cards):
+            skipped += 1
+
+
+def parse_cards(text: str) -> List[Dict[str, Any]]:
+    """
+    Parse all cards out of a complete model reply, see `scan_cards`.
+
+    Args:
+        text (str): The reply.
+
+    Returns:
+        list of dict: The cards with 'front', 'back' and 'tags' keys, in reply order.
+    """
+
+    return scan_cards(text)[0]
+
+
+def parse_card(card_str: str) -> Dict[str, Any] | None:
+    """
+    Parse one card object, accepting both JSON and Python dict syntax.
+
+    Args:
+        card_str (str): Text of a single `{...}` object.
+
+    Returns:
+        dict or None: The card, or None if it cannot be parsed or misses one of 'front', 'back', 'tags'.
+    """
+
+    cards = parse_cards(card_str)
+    return cards[0] if cards else None
+
+
+def find_array(text: str) -> tuple[int, int] | None:
+    """
+    Locate the first top-level `[...]` list of a reply, outside of `<think>` blocks.
+
+    Args:
+        text (str): The reply.
+
+    Returns:
+        tuple or None: (start, end) of the list, None if there is none. An unterminated
+            or malformed list extends to the end of the text.
+    """
+
+    pos = 0
+    while True:
+        start = text.find("[", pos)
+        think = text.find(THINK_OPEN, pos)
+        if think != -1 and (start == -1 or think < start):
+            end = text.find(THINK_CLOSE, think)
+            if end == -1:
+                return None
+            pos = end + len(THINK_CLOSE)
+            continue
+        if start == -1:
+            return None
+        try:
+            return start, _Reader(text).array(start)[1]
+        except (_Incomplete, _Malformed):
+            return start, len(text)
+
+
+class CardStreamParser:
+    """
+    Incremental parser that picks card objects out of an LLM reply while it is being generated.
+
+    Text is fed in arbitrary pieces. Only the unread tail of the reply is kept, and it is only
+    re-scanned (see `scan_cards`) when a piece could have completed an object or a think block.
+    """
+
+    def __init__(self) -> None:
+        self.pending = ""
+        self.skipped = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Consume the next piece of the reply.
+
+        Args:
+            text (str): The next piece of model output.
+
+        Returns:
+            list of dict: Cards completed by this piece, possibly empty.
+        """
+
+        self.pending += text
+        if "}" not in text and ">" not in text and "{" in self.pending:
+            return []
+        cards, skipped, pos = scan_cards(self.pending, final=False)
+        self.skipped += skipped
+        self.pending = self.pending[pos:]
+        return cards
+
+    def close(self) -> List[Dict[str, Any]]:
+        """
+        Finish the reply, reading what is left as complete text.
+
+        Returns:
+            list of dict: Cards that could only be told apart from an unfinished object once the reply ended.
+        """
+
+        cards, skipped, _ = scan_cards(self.pending)
+        self.skipped += skipped
+        self.pending = ""
+        return cards
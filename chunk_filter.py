@@ -0,0 +1,357 @@
+import re
+from typing import Any, Dict, Generator, Iterable, Iterator, List
+
+import file_handler
+import metrics
+
+_WORD = re.compile(r"\w+")
+_NUMBER = re.compile(r"\b\d+\b")
+# headers and footers are short, longer lines are body text even if they repeat
+_MAX_BOILERPLATE_CHARS = 120
+
+
+class ScoredChunk(str):
+    """
+    A text chunk with the number of cards to ask for it, see `score_chunks`.
+
+    Being a str, it passes through chunking, the job manifest and prompt building unchanged;
+    `helpers.build_prompt` picks up card_amount.
+    """
+
+    card_amount: int
+    score: float
+
+    def __new__(cls, text: str, card_amount: int, score: float) -> "ScoredChunk":
+        chunk = super().__new__(cls, text)
+        chunk.card_amount = card_amount
+        chunk.score = score
+        return chunk
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # keeps card_amount when a chunk is sent to or from a worker process
+        return (ScoredChunk, (str(self), self.card_amount, self.score))
+
+
+def _normalize_line(line: str) -> str:
+    # page numbers and dates change from page to page, the header or footer around them does not
+    if len(line) > _MAX_BOILERPLATE_CHARS:
+        return ""
+    return " ".join(_NUMBER.sub("#", line.lower()).split())
+
+
+def _strip_window(pages: List[str], share: float, min_pages: int) -> List[str]:
+    if len(pages) < min_pages:
+        return pages
+    counts: Dict[str, int] = {}
+    for page in pages:
+        for line in {_normalize_line(line) for line in page.splitlines()}:
+            if line:
+                counts[line] = counts.get(line, 0) + 1
+    limit = max(min_pages, share * len(pages))
+    boilerplate = {line for line, count in counts.items() if count >= limit}
+    if not boilerplate:
+        return pages
+    stripped = []
+    removed = 0
+    for page in pages:
+        kept = [line for line in page.splitlines() if _normalize_line(line) not in boilerplate]
+        removed += page.count("\n") + 1 - len(kept)
+        stripped.append("\n".join(kept))
+    metrics.inc("boilerplate_lines_total", removed)
+    return stripped
+
+
+def strip_boilerplate(
+    pages: Iterable[str], window: int = 32, share: float = 0.5, min_pages: int = 3
+) -> Generator[str, None, None]:
+    """
+    Remove repeated headers, footers and page numbers from the pages of a document.
+
+    Pages are looked at in windows of `window` pages, so the document is still read lazily. A short line that,
+    with its numbers ignored, appears on at least `share` of a window's pages (and on min_pages of them) is
+    boilerplate and is removed from every page of the window.
+
+    Args:
+        pages (iterable of str): The document's pages, e.g. from `file_handler.iter_file`.
+        window (int): Number of pages compared with each other.
+        share (float): Share of pages a line must appear on to count as boilerplate.
+        min_pages (int): Minimum number of pages a line must appear on; smaller windows are left as they are.
+
+    Yields:
+        str: The pages without their boilerplate lines.
+    """
+
+    buffer: List[str] = []
+    for page in pages:
+        buffer.append(page)
+        if len(buffer) >= window:
+            yield from _strip_window(buffer, share, min_pages)
+            buffer = []
+    if buffer:
+        yield from _strip_window(buffer, share, min_pages)
+
+
+def score_window(chunks: List[str]) -> Any:
+    """
+    Information density of each chunk, compared to the other chunks of the window.
+
+    The score is the product of three parts, each computed for all chunks at once with NumPy:
+    - TF-IDF density: the term-frequency weighted mean IDF of the chunk's words, low for text that
+      repeats what every chunk says,
+    - normalized entropy of the word distribution, low for repetitive text such as dot leaders and tables,
+    - the share of words that are not numbers, low for indexes, tables of contents and number tables.
+
+    Args:
+        chunks (list of str): The chunks of the window.
+
+    Returns:
+        numpy.ndarray: One score per chunk, 0 for chunks without words.
+    """
+
+    import numpy as np
+
+    tokens = [_WORD.findall(chunk.lower()) for chunk in chunks]
+    n = len(chunks)
+    if not any(tokens):
+        return np.zeros(n)
+
+    # a dict builds the vocabulary faster than np.unique on strings
+    vocabulary: Dict[str, int] = {}
+    term_ids = np.array([vocabulary.setdefault(word, len(vocabulary)) for words in tokens for word in words])
+    doc_ids = np.repeat(np.arange(n), [len(words) for words in tokens])
+    size = len(vocabulary)
+    pairs, counts = np.unique(doc_ids * size + term_ids, return_counts=True)
+    docs, terms = pairs // size, pairs % size
+    lengths = np.bincount(docs, weights=counts, minlength=n)
+    doc_freq = np.bincount(terms, minlength=size)
+    idf = np.log((1 + n) / (1 + doc_freq)) + 1
+
+    tf = counts / lengths[docs]
+    density = np.bincount(docs, weights=tf * idf[terms], minlength=n)
+    entropy = -np.bincount(docs, weights=tf * np.log2(tf), minlength=n)
+    normalized_entropy = np.divide(entropy, np.log2(np.maximum(lengths, 2)), out=np.zeros(n), where=lengths > 1)
+    is_word = np.array([not word.isdigit() for word in vocabulary], dtype=bool)
+    word_share = np.divide(
+        np.bincount(docs, weights=counts * is_word[terms], minlength=n), lengths, out=np.zeros(n), where=lengths > 0
+    )
+    return density * normalized_entropy * word_share
+
+
+def allocate_cards(scores: Any, total: int, cap: int) -> List[int]:
+    """
+    Split a card budget over chunks in proportion to their scores, by largest remainder.
+
+    Every chunk gets one card first, the rest of the budget is shared out by score.
+
+    Args:
+        scores (numpy.ndarray): Score of each chunk, all positive.
+        total (int): Number of cards to hand out.
+        cap (int): Maximum number of cards for one chunk.
+
+    Returns:
+        list of int: Cards per chunk, each between 1 and cap. They add up to total, unless total is below
+            the number of chunks or above what the cap allows.
+    """
+
+    import numpy as np
+
+    extra = max(0, total - len(scores))
+    room = max(0, cap - 1)
+    raw = extra * scores / scores.sum()
+    amounts = np.minimum(np.floor(raw).astype(int), room)
+    remaining = extra - int(amounts.sum())
+    order = np.argsort(amounts - raw)
+    while remaining > 0 and (amounts < room).any():
+        for i in order:
+            if remaining == 0:
+                break
+            if amounts[i] < room:
+                amounts[i] += 1
+                remaining -= 1
+    return [int(amount) + 1 for amount in amounts]
+
+
+def _combine(pieces: List[tuple[str, int]], max_tokens: int) -> List[tuple[str, int]]:
+    # joins consecutive (text, token count) pieces as long as they fit max_tokens
+    combined: List[tuple[str, int]] = []
+    for text, size in pieces:
+        if combined and combined[-1][1] + size + 1 <= max_tokens:
+            combined[-1] = (f"{combined[-1][0]}\n\n{text}", combined[-1][1] + size + 1)
+            metrics.inc("chunks_merged_total")
+        else:
+            combined.append((text, size))
+    return combined
+
+
+def _merge_short(chunks: List[str], min_words: int, max_tokens: int) -> List[str]:
+    # near-empty chunks, e.g. the tail of a document or a mostly blank page, join their predecessor
+    # (or the next chunk, at the start of a window) if the two still fit the chunker's token limit;
+    # the separator counts as one token, as in file_handler.chunk_segments
+    enc = file_handler.get_encoder()
+    merged: List[str] = []
+    sizes: List[int | None] = []  # token counts, only taken for chunks a short one may join
+
+    def join(text: str, size: int, before: bool) -> bool:
+        if sizes[-1] is None:
+            sizes[-1] = len(enc.encode_ordinary(merged[-1]))
+        if sizes[-1] + size + 1 > max_tokens:
+            return False
+        merged[-1] = f"{text}\n\n{merged[-1]}" if before else f"{merged[-1]}\n\n{text}"
+        sizes[-1] += size + 1
+        metrics.inc("chunks_merged_total")
+        return True
+
+    leading: List[tuple[str, int]] = []  # short chunks at the start of the window, before any full one
+    for chunk in chunks:
+        words = len(_WORD.findall(chunk))
+        if words == 0:
+            continue
+        if words >= min_words:
+            merged.append(chunk)
+            sizes.append(None)
+            if leading:
+                pieces = _combine(leading, max_tokens)
+                if join(*pieces[-1], before=True):
+                    pieces.pop()
+                merged[-1:-1] = [text for text, _ in pieces]
+                sizes[-1:-1] = [size for _, size in pieces]
+                leading = []
+            continue
+        size = len(enc.encode_ordinary(chunk))
+        if not merged:
+            leading.append((chunk, size))
+        elif not join(chunk, size, before=False):
+            merged.append(chunk)
+            sizes.append(size)
+    # a window of short chunks only: they are joined with each other as far as they fit
+    merged += [text for text, _ in _combine(leading, max_tokens)]
+    return merged
+
+
+def score_chunks(
+    chunks: Iterable[str],
+    card_amount: int,
+    window: int = 16,
+    min_words: int = 40,
+    drop_below: float = 0.35,
+    max_share: float = 3.0,
+    max_tokens: int = 3000,
+) -> Iterator[ScoredChunk]:
+    """
+    Drop or merge low-information chunks and spread the card budget over the rest by their score.
+
+    Chunks are taken in windows of `window` chunks, so generation can start before the whole document
+    is read. In each window, chunks with fewer than min_words words are merged into the chunk before
+    them if the two fit in max_tokens tokens, every chunk is scored with `score_window`, and chunks scoring below drop_below times the
+    window's median are dropped. The window's budget, card_amount per kept chunk, is then split over the
+    kept chunks by score times word count (see `allocate_cards`), at most max_share * card_amount cards
+    per chunk.
+
+    Args:
+        chunks (iterable of str): Text chunks, e.g. from `file_handler.chunk_pieces`.
+        card_amount (int): Requested cards per chunk.
+        window (int): Number of chunks scored together.
+        min_words (int): Chunks with fewer words are merged with a neighbour.
+        drop_below (float): Share of the window's median score under which a chunk is dropped.
+        max_share (float): Cap on a chunk's cards, as a multiple of card_amount.
+        max_tokens (int): Token limit of the chunker, e.g. `file_handler.chunk_pieces`; merged chunks stay within it.
+
+    Yields:
+        ScoredChunk: The kept chunks, in document order.
+    """
+
+    import numpy as np
+
+    buffer: List[str] = []
+    iterator = iter(chunks)
+    while True:
+        for chunk in iterator:
+            buffer.append(chunk)
+            if len(buffer) >= window:
+                break
+        if not buffer:
+            return
+        merged = _merge_short(buffer, min_words, max_tokens)
+        buffer = []
+        if not merged:
+            continue
+        scores = score_window(merged)
+        keep = (scores > 0) & (scores >= drop_below * np.median(scores))
+        metrics.inc("chunks_dropped_total", int((~keep).sum()))
+        for i in np.flatnonzero(~keep):
+            print(f"skipping low-information chunk: {merged[i][:80]!r}...")
+        kept = [chunk for chunk, k in zip(merged, keep) if k]
+        if not kept:
+            continue
+        # density times length: a short tail chunk holds less to ask about than a full one of the same density
+        content = scores[keep] * np.array([len(_WORD.findall(chunk)) for chunk in kept])
+        amounts = allocate_cards(content, card_amount * len(kept), max(1, round(card_amount * max_share)))
+        for chunk, amount, score in zip(kept, amounts, scores[keep]):
+            yield ScoredChunk(chunk, amount, float(score))
+
+
+class ChunkFilter:
+    """
+    Pre-LLM filter of a document: boilerplate is stripped from its pages (see `strip_boilerplate`) and its
+    chunks are scored, merged or dropped and given their share of the cards (see `score_chunks`).
+
+    Args:
+        window (int): Number of chunks scored together.
+        min_words (int): Chunks with fewer words are merged with a neighbour.
+        drop_below (float): Share of the window's median score under which a chunk is dropped.
+        max_share (float): Cap on a chunk's cards, as a multiple of the requested card amount.
+        boilerplate_window (int): Number of pages compared with each other for boilerplate.
+        boilerplate_share (float): Share of pages a line must appear on to count as boilerplate.
+        max_tokens (int): Token limit of the chunker, merged chunks stay within it.
+    """
+
+    def __init__(
+        self,
+        window: int = 16,
+        min_words: int = 40,
+        drop_below: float = 0.35,
+        max_share: float = 3.0,
+        boilerplate_window: int = 32,
+        boilerplate_share: float = 0.5,
+        max_tokens: int = 3000,
+    ) -> None:
+        self.window = window
+        self.min_words = min_words
+        self.drop_below = drop_below
+        self.max_share = max_share
+        self.boilerplate_window = boilerplate_window
+        self.boilerplate_share = boilerplate_share
+        self.max_tokens = max_tokens
+
+    def pages(self, pages: Iterable[str]) -> Iterator[str]:
+        return strip_boilerplate(pages, self.boilerplate_window, self.boilerplate_share)
+
+    def chunks(self, chunks: Iterable[str], card_amount: int) -> Iterator[ScoredChunk]:
+        return score_chunks(
+            chunks, card_amount, self.window, self.min_words, self.drop_below, self.max_share, self.max_tokens
+        )
+
+
+def from_config(settings: Dict[str, Any] | None) -> ChunkFilter | None:
+    """
+    Build a ChunkFilter from the `chunk_filter` section of config.yaml.
+
+    Args:
+        settings (dict or None): The `chunk_filter` config section, keys: enabled, window, min_words,
+            drop_below, max_share, boilerplate_window and boilerplate_share.
+
+    Returns:
+        ChunkFilter or None: The filter, None if it is disabled.
+    """
+
+    settings = settings or {}
+    if not settings.get("enabled", False):
+        return None
+    return ChunkFilter(
+        window=int(settings.get("window", 16)),
+        min_words=int(settings.get("min_words", 40)),
+        drop_below=float(settings.get("drop_below", 0.35)),
+        max_share=float(settings.get("max_share", 3.0)),
+        boilerplate_window=int(settings.get("boilerplate_window", 32)),
+        boilerplate_share=float(settings.get("boilerplate_share", 0.5)),
+    )
@@ -0,0 +1,147 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List
+
+import metrics
+
+
+def write_atomic(filepath: str, content: str) -> None:
+    """
+    Replace a file's content atomically by writing a temp file next to it and renaming it over the original.
+
+    Args:
+        filepath (str): Path of the file to write.
+        content (str): The new file content.
+    """
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(filepath))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class DeckStore:
+    """
+    Append-only card storage in JSON Lines format, one card per line.
+
+    Appending a batch writes only that batch and syncs it to disk with a single fsync, so the cost
+    of an append does not depend on the size of the deck. A line left half-written by a crash is
+    ignored when reading. `export_json` produces the JSON array format read by `file_handler.read_json_file`.
+
+    If the store is new but a JSON array deck with the same name exists, its cards are migrated first.
+
+    Args:
+        path (str): Path to the `.jsonl` file.
+    """
+
+    # subclasses that store other records than cards report their appends under their own names
+    append_metric = "deck_store_append"
+    count_metric = "deck_store_cards_total"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file: Any = None
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            legacy = self.json_path
+            cards: List[Dict[str, Any]] = []
+            if os.path.exists(legacy):
+                with open(legacy, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                cards = data if isinstance(data, list) else []
+            write_atomic(path, "".join(json.dumps(card, ensure_ascii=False) + "\n" for card in cards))
+
+    @classmethod
+    def for_deck(cls, topic: str, deck_name: str, decks_path: str = "./decks/") -> "DeckStore":
+        return cls(os.path.join(decks_path, f"{topic}_{deck_name}.jsonl"))
+
+    @property
+    def json_path(self) -> str:
+        return os.path.splitext(self.path)[0] + ".json"
+
+    def append(self, cards: List[Dict[str, Any]]) -> None:
+        """
+        Append cards to the end of the store.
+
+        Args:
+            cards (list of dict): Cards to append.
+        """
+
+        if not cards:
+            return
+        data = "".join(json.dumps(card, ensure_ascii=False) + "\n" for card in cards)
+        with self._lock, metrics.timer(self.append_metric):
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+                if self._ends_mid_line():
+                    # start on a fresh line after a crash left a partial record behind
+                    data = "\n" + data
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        metrics.inc(self.count_metric, len(cards))
+
+    def _ends_mid_line(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def read(self) -> List[Dict[str, Any]]:
+        """
+        Read every stored card.
+
+        Returns:
+            list of dict: The cards, in the order they were appended.
+        """
+
+        cards: List[Dict[str, Any]] = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    cards.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"skipping unreadable line in '{self.path}'")
+        return cards
+
+    def export_json(self, filepath: str | None = None) -> str:
+        """
+        Write the deck as a JSON array, replacing the target atomically.
+
+        Args:
+            filepath (str or None): Target path, defaults to the store path with a `.json` extension.
+
+        Returns:
+            str: Path of the written JSON file.
+        """
+
+        filepath = filepath or self.json_path
+        write_atomic(filepath, json.dumps(self.read(), indent=2, ensure_ascii=False))
+        return filepath
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "DeckStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
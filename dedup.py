@@ -0,0 +1,331 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+import random
+import re
+import unicodedata
+import zlib
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List
+
+import anki_sync
+import job_manifest
+import metrics
+
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize card text for duplicate detection: unicode-fold, lowercase, drop punctuation, collapse whitespace.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def shingles(text: str, size: int = 4) -> set[int]:
+    """
+    Hash the overlapping character n-grams of a normalized text.
+
+    Args:
+        text (str): Normalized text.
+        size (int): Length of each n-gram.
+
+    Returns:
+        set of int: 32-bit hashes of the n-grams.
+    """
+
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))}
+    return {zlib.crc32(text[i : i + size].encode("utf-8")) for i in range(len(text) - size + 1)}
+
+
+def deck_files(decks_path: str) -> List[str]:
+    """
+    List the deck files in decks_path.
+
+    These are the JSON Lines deck stores and the JSON array decks that have no store, e.g. readymade decks.
+    The JSON export of a store holds the same cards as the store, and job manifests and Anki sync states
+    are no decks at all, so they are left out.
+
+    Args:
+        decks_path (str): Directory holding the decks.
+
+    Returns:
+        list of str: Paths of the deck files.
+    """
+
+    stores = [
+        path
+        for path in glob.glob(os.path.join(decks_path, "*.jsonl"))
+        if not path.endswith(job_manifest.MANIFEST_SUFFIX)
+    ]
+    exports = {os.path.splitext(path)[0] + ".json" for path in stores}
+    arrays = [
+        path
+        for path in glob.glob(os.path.join(decks_path, "*.json"))
+        if path not in exports and not path.endswith(anki_sync.STATE_SUFFIX)
+    ]
+    return sorted(stores + arrays)
+
+
+def _appended(path: str, source: tuple[Any, ...]) -> bool:
+    # whether the file still starts with exactly the content it had when it was indexed
+    if len(source) < 3 or os.path.getsize(path) < source[1]:
+        return False
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(source[1])).hexdigest() == source[2]
+
+
+class DuplicateIndex:
+    """
+    Index of existing cards that finds exact and near-duplicate card fronts in sub-linear time.
+
+    Exact duplicates are found through a set of hashes of the normalized front. Near duplicates are
+    found with MinHash signatures over character 4-grams, bucketed by locality-sensitive hashing:
+    only cards sharing at least min_band_matches band buckets are compared, and a card counts as a
+    duplicate when its estimated Jaccard similarity to one of them reaches threshold.
+
+    Generated fronts share a lot of template text ("How do you say ... in Finnish?"), so unrelated cards
+    often reach a similarity of 0.5. Long bands and requiring two matching bands keep those out of the
+    candidate set, which stays small as the index grows.
+
+    Args:
+        threshold (float): Minimum estimated Jaccard similarity for a near duplicate.
+        num_perm (int): Number of MinHash permutations.
+        bands (int): Number of LSH bands, must divide num_perm.
+        min_band_matches (int): Number of shared band buckets that makes an indexed card a candidate.
+    """
+
+    def __init__(
+        self, threshold: float = 0.8, num_perm: int = 128, bands: int = 16, min_band_matches: int = 2
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm.")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.min_band_matches = min_band_matches
+        # numpy is only loaded once an index is built, it is slow to import
+        import numpy as np
+
+        # multiply-shift hashing, ((a * x + b) mod 2**64) >> 32, relies on uint64 wrap-around
+        rng = random.Random(1)
+        self._a = np.array([rng.getrandbits(64) | 1 for _ in range(num_perm)], dtype=np.uint64)[:, None]
+        self._b = np.array([rng.getrandbits(64) for _ in range(num_perm)], dtype=np.uint64)[:, None]
+        self.exact: set[str] = set()
+        self.signatures = array("I")
+        self.buckets: Dict[tuple[int, int], List[int]] = {}
+        self.sources: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.signatures) // self.num_perm
+
+    def signature(self, text: str) -> List[int]:
+        import numpy as np
+
+        hashes = np.fromiter(shingles(text), dtype=np.uint64)
+        return ((self._a * hashes + self._b) >> np.uint64(32)).min(axis=1).tolist()
+
+    def _band_keys(self, signature: List[int]) -> List[tuple[int, int]]:
+        return [
+            (band, hash(tuple(signature[band * self.rows : (band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+
+    def _find(self, text: str, check_near: bool = True) -> tuple[str, List[int], bool]:
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        if key in self.exact:
+            return key, [], True
+        signature = self.signature(text)
+        if not check_near:
+            return key, signature, False
+        band_matches: Counter[int] = Counter()
+        for band_key in self._band_keys(signature):
+            band_matches.update(self.buckets.get(band_key, ()))
+        for candidate, matches in band_matches.items():
+            if matches < self.min_band_matches:
+                continue
+            start = candidate * self.num_perm
+            other = self.signatures[start : start + self.num_perm]
+            if sum(1 for x, y in zip(signature, other) if x == y) >= self.threshold * self.num_perm:
+                return key, signature, True
+        return key, signature, False
+
+    def _insert(self, key: str, signature: List[int]) -> None:
+        position = len(self)
+        self.exact.add(key)
+        self.signatures.extend(signature)
+        for band_key in self._band_keys(signature):
+            self.buckets.setdefault(band_key, []).append(position)
+
+    def add(self, card: Dict[str, Any], check_near: bool = True) -> bool:
+        """
+        Add a card to the index unless it duplicates an indexed card.
+
+        Args:
+            card (dict): Card with a 'front' key.
+            check_near (bool): If False, only exact duplicates are rejected, which is faster for bulk indexing.
+
+        Returns:
+            bool: True if the card was new and has been added, False if it is a duplicate.
+        """
+
+        text = normalize_text(str(card.get("front", "")))
+        key, signature, duplicate = self._find(text, check_near)
+        if duplicate:
+            return False
+        self._insert(key, signature)
+        return True
+
+    def filter(self, cards: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Drop cards that duplicate indexed cards or each other, and index the kept ones.
+
+        Args:
+            cards (iterable of dict): New cards.
+
+        Returns:
+            list of dict: The cards that are not duplicates, in their original order.
+        """
+
+        kept: List[Dict[str, Any]] = []
+        dropped = 0
+        for card in cards:
+            if self.add(card):
+                kept.append(card)
+            else:
+                dropped += 1
+        if dropped:
+            print(f"dropped {dropped} duplicate cards")
+            metrics.inc("duplicates_dropped_total", dropped)
+        return kept
+
+    def index_decks(self, decks_path: str) -> int:
+        """
+        Index every deck in decks_path (see `deck_files`) that changed since it was last indexed.
+
+        Decks that only had cards appended, which is how a run extends a deck, just have the new cards indexed.
+        Indexed cards cannot be taken out one by one, so when a deck was rewritten or deleted the index is
+        rebuilt from the decks as they are now: a deleted deck's cards would otherwise keep matching, and a
+        regenerated deck would come out empty.
+
+        Args:
+            decks_path (str): Directory holding the decks.
+
+        Returns:
+            int: Number of newly indexed cards.
+        """
+
+        current = {}
+        for path in deck_files(decks_path):
+            stat = os.stat(path)
+            current[path] = (stat.st_mtime_ns, stat.st_size)
+        stale = [
+            path
+            for path, source in self.sources.items()
+            if path not in current or (source[:2] != current[path] and not _appended(path, source))
+        ]
+        if stale:
+            print(f"duplicate index: {len(stale)} decks were rewritten or deleted, rebuilding")
+            self.clear()
+
+        added = 0
+        for path, fingerprint in current.items():
+            if self.sources.get(path, ())[:2] == fingerprint:
+                continue
+            with open(path, "rb") as f:
+                content = f.read()
+            if path.endswith(".jsonl"):
+                cards: List[Any] = []
+                for line in content.decode("utf-8").splitlines():
+                    try:
+                        cards.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # blank, or the torn tail of an interrupted append
+            else:
+                data = json.loads(content)
+                cards = data if isinstance(data, list) else []
+            added += sum(1 for card in cards if isinstance(card, dict) and self.add(card, check_near=False))
+            self.sources[path] = (*fingerprint, hashlib.sha1(content).hexdigest())
+        return added
+
+    def clear(self) -> None:
+        """
+        Empty the index, keeping its settings.
+        """
+
+        self.exact = set()
+        self.signatures = array("I")
+        self.buckets = {}
+        self.sources = {}
+
+    def index_cards(self, cards: Iterable[Dict[str, Any]]) -> int:
+        """
+        Index existing cards, e.g. the notes of an Anki deck, rejecting only exact duplicates.
+
+        Args:
+            cards (iterable of dict): Cards with a 'front' key.
+
+        Returns:
+            int: Number of newly indexed cards.
+        """
+
+        return sum(1 for card in cards if self.add(card, check_near=False))
+
+    def save(self, path: str) -> None:
+        state = {
+            "threshold": self.threshold,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "min_band_matches": self.min_band_matches,
+            "exact": self.exact,
+            "signatures": self.signatures.tobytes(),
+            "buckets": self.buckets,
+            "sources": self.sources,
+        }
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = 0.8) -> "DuplicateIndex":
+        """
+        Load a saved index, or return an empty one if there is none or it was built with other settings.
+
+        Args:
+            path (str): Path of the saved index.
+            threshold (float): Similarity threshold for the returned index.
+
+        Returns:
+            DuplicateIndex: The index.
+        """
+
+        index = cls(threshold)
+        if not os.path.exists(path):
+            return index
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if (state["num_perm"], state["bands"], state["min_band_matches"]) != (
+            index.num_perm, index.bands, index.min_band_matches
+        ):
+            return index
+        index.exact = state["exact"]
+        index.sources = state["sources"]
+        index.buckets = state["buckets"]
+        index.signatures.frombytes(state["signatures"])
+        return index
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Generator, Iterator, List
+
+import deck_store
+import file_handler
+import metrics
+
+
+class ExtractionCache:
+    """
+    Persistent cache of text extracted from source documents.
+
+    Entries are keyed on the file's fingerprint plus the reader's name and version, so editing the file
+    or changing a reader (see `file_handler.reader_versions`) misses the cache. Each entry stores the
+    normalized text of the whole document and the offset of every piece (page, paragraph, row) in it.
+
+    Args:
+        path (str): Directory holding one JSON file per entry.
+        fingerprint (str): "hash" to fingerprint files by a sha256 of their content, "stat" to use mtime and size.
+    """
+
+    def __init__(self, path: str = "./.cache/extracted", fingerprint: str = "hash") -> None:
+        if fingerprint not in ("hash", "stat"):
+            raise ValueError(f"Unknown fingerprint mode: {fingerprint}")
+        self.path = path
+        self.fingerprint = fingerprint
+
+    def file_fingerprint(self, filepath: str) -> str:
+        if self.fingerprint == "stat":
+            stat = os.stat(filepath)
+            return f"{stat.st_mtime_ns}-{stat.st_size}"
+        return file_sha256(filepath)
+
+    def entry_path(self, filepath: str) -> str:
+        reader = filepath.split(".")[-1].lower()
+        version = file_handler.reader_versions.get(reader, 0)
+        key = hashlib.sha256(f"{reader}:{version}:{self.file_fingerprint(filepath)}".encode("utf-8")).hexdigest()
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, filepath: str) -> Dict[str, Any] | None:
+        entry_path = self.entry_path(filepath)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, filepath: str, pieces: List[str]) -> None:
+        offsets: List[int] = []
+        position = 0
+        for piece in pieces:
+            offsets.append(position)
+            position += len(piece) + 2
+        entry = {"source": os.path.abspath(filepath), "text": "\n\n".join(pieces), "offsets": offsets}
+        deck_store.write_atomic(self.entry_path(filepath), json.dumps(entry, ensure_ascii=False))
+
+    def iter_file(self, filepath: str, workers: int = 0) -> Iterator[str] | None:
+        """
+        Same as `file_handler.iter_file`, served from the cache when possible.
+
+        On a miss the pieces are still yielded as they are extracted, and the entry is written
+        once the whole document has been read.
+
+        Args:
+            filepath (str): Path to the file.
+            workers (int): Number of PDF extraction processes on a cache miss.
+
+        Returns:
+            iterator of str or None: The document's normalized pieces, or None if the file type is unsupported.
+        """
+
+        entry = self.get(filepath)
+        metrics.inc("extraction_cache_lookups_total", result="hit" if entry is not None else "miss")
+        if entry is not None:
+            print(f"Using cached text extraction for '{filepath}'")
+            return _split_entry(entry)
+
+        pieces = file_handler.iter_file(filepath, workers)
+        if pieces is None:
+            return None
+        return self._collect(filepath, pieces)
+
+    def _collect(self, filepath: str, pieces: Iterator[str]) -> Generator[str, None, None]:
+        collected: List[str] = []
+        for piece in pieces:
+            piece = normalize_piece(piece)
+            collected.append(piece)
+            yield piece
+        self.put(filepath, collected)
+
+    def invalidate(self, filepath: str | None = None) -> int:
+        """
+        Drop cached extractions.
+
+        Args:
+            filepath (str or None): Only drop entries extracted from this file, or everything if None.
+
+        Returns:
+            int: Number of removed entries.
+        """
+
+        if not os.path.isdir(self.path):
+            return 0
+        if filepath is None:
+            removed = len(os.listdir(self.path))
+            shutil.rmtree(self.path)
+            return removed
+
+        source = os.path.abspath(filepath)
+        removed = 0
+        for name in os.listdir(self.path):
+            entry_path = os.path.join(self.path, name)
+            try:
+                with open(entry_path, "r", encoding="utf-8") as f:
+                    matches = json.load(f).get("source") == source
+            except (OSError, json.JSONDecodeError):
+                matches = True
+            if matches:
+                os.remove(entry_path)
+                removed += 1
+        return removed
+
+
+def file_sha256(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_piece(piece: str) -> str:
+    lines = piece.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def _split_entry(entry: Dict[str, Any]) -> Generator[str, None, None]:
+    text: str = entry["text"]
+    offsets: List[int] = entry["offsets"]
+    for i, start in enumerate(offsets):
+        end = offsets[i + 1] - 2 if i + 1 < len(offsets) else len(text)
+        yield text[start:end]
+
+
+def from_config(settings: Dict[str, Any]) -> ExtractionCache | None:
+    """
+    Build an ExtractionCache from the `extraction_cache` section of config.yaml.
+
+    Args:
+        settings (dict): The `extraction_cache` config section, keys: enabled, path, fingerprint.
+
+    Returns:
+        ExtractionCache or None: The cache, or None if it is disabled.
+    """
+
+    if not settings or not settings.get("enabled", True):
+        return None
+    return ExtractionCache(settings.get("path", "./.cache/extracted"), settings.get("fingerprint", "hash"))
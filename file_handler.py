@@ -2,13 +2,18 @@ import csv
 import json
 import os
 import re
+import time
+from collections import deque
+from concurrent.futures import Future
 
-import docx
-import pdfplumber
-from psutil import process_iter, NoSuchProcess, AccessDenied, Process
-import tiktoken
+# docx, pdfplumber, psutil and tiktoken are imported where they are needed: together they take longer to
+# import than the rest of the app, and most runs only use one of them, if any
 import yaml
-from typing import List, Dict, Any, cast, Generator, Iterator
+
+import card_parser
+import deck_store
+import metrics
+from typing import List, Dict, Any, cast, Generator, Iterable, Iterator
 
 def format_and_split_cards(cards_json: str) -> List[Dict[str, str]]:
     """
@@ -22,28 +27,14 @@ def format_and_split_cards(cards_json: str) -> List[Dict[str, str]]:
 
     Notes:
         - Skips cards missing any of the required keys: 'front', 'back', 'tags'.
-        - Attempts to clean malformed JSON-like strings before parsing.
+        - Malformed JSON-like text (Python dict syntax, smart quotes, trailing commas) is read in the
+          same pass, see `card_parser.scan_cards`.
     """
 
-    cards_as_dicts: List[Dict[str, str]] = []
-    split_cards = re.findall(r"\{[^{}]*\}", cards_json)
-    for card_str in split_cards:
-        if not all(key in card_str for key in ["front", "back", "tags"]):
-            print(f"card '{card_str}' is missing required keys and will be skipped.")
-            continue
-
-        card_str = card_str.strip()
-        if card_str[-1] == ",":
-            card_str = card_str[:-1]
-        if card_str[-1] != "}":
-            card_str = card_str + "}"
-        if card_str[0] != "{":
-            card_str = "{" + card_str
-        if card_str == "{}":
-            continue
-        cards_as_dicts.append(json.loads(card_str))
-
-    print(f"successfully formatted {len(cards_as_dicts)}/{len(split_cards)} cards")
+    cards_as_dicts, skipped, _ = card_parser.scan_cards(cards_json)
+    if skipped:
+        print(f"{skipped} cards were malformed or missing required keys and were skipped.")
+    print(f"successfully formatted {len(cards_as_dicts)}/{len(cards_as_dicts) + skipped} cards")
     return cards_as_dicts
 
 
@@ -81,21 +72,23 @@ def append_to_json_file(cards_dicts: List[Dict[str, str]], topic: str, deck_name
 
     Raises:
         ValueError: If existing file content is not a list.
+
+    Notes:
+        Rewrites the whole file (atomically) on every call. For repeated appends use `deck_store.DeckStore`,
+        which only writes the new cards.
     """
 
     filename = f"./decks/{topic}_{deck_name}.json"
-    if not os.path.exists(filename):
-        create_json_file(filename)
-        existing_data: List[Dict[str, str]] = []
-    else:
+    existing_data: List[Dict[str, str]] = []
+    if os.path.exists(filename):
         with open(filename, "r", encoding="utf-8") as f:
             data = json.load(f)
             if not isinstance(data, list):
                 raise ValueError("Existing file is not a list.")
             existing_data = cast(List[Dict[str, str]], data)
 
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(existing_data, f, indent=2, ensure_ascii=False)
+    existing_data.extend(cards_dicts)
+    deck_store.write_atomic(filename, json.dumps(existing_data, indent=2, ensure_ascii=False))
 
     print(f"Appended {len(cards_dicts)} entries to '{filename}'")
     return filename
@@ -105,22 +98,22 @@ def extract_json(str:str):
     """
     Extract the first JSON array found within a string.
 
+    Brackets inside quoted card text and `<think>` blocks are skipped, see `card_parser.find_array`.
+
     Args:
         str (str): Input string that may contain a JSON array.
 
     Returns:
-        str: Extracted JSON array string.
+        str: Extracted JSON array string, up to the end of the input if the array is not closed.
 
     Raises:
         Exception: If no JSON array is found in the input string.
     """
 
-    pattern = re.compile(r"\[.*?\]", re.DOTALL)
-    match = pattern.search(str)
-    if match:
-        return match.group(0)
-    else:
-        raise Exception
+    span = card_parser.find_array(str)
+    if span is None:
+        raise Exception("no JSON array found in the reply")
+    return str[span[0] : span[1]]
 
 
 def clean_malformed_json(json_str:str):
@@ -254,9 +247,9 @@ def write_to_yaml_file(data: List[Dict[str, str]], filepath: str) -> None:
 #             continue
 #     return False
 
-import psutil
-
 def is_anki_running():
+    import psutil
+
     for proc in psutil.process_iter(attrs=["name"]):
         try:
             if "anki" in proc.info["name"].lower():
@@ -316,6 +309,8 @@ def read_docx(filepath:str) -> str:
         str: Concatenated text content from all paragraphs.
     """
 
+    import docx
+
     doc = docx.Document(filepath)
     return "\n".join([para.text for para in doc.paragraphs])
 
@@ -328,14 +323,10 @@ def read_pdf(filepath:str):
         filepath (str): Path to the PDF file.
 
     Returns:
-        str: Extracted text content from all pages.
+        str: Extracted text content from all pages, pages separated by newlines.
     """
 
-    text = ""
-    with pdfplumber.open(filepath) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() or ""
-    return text
+    return "\n".join(iter_pdf(filepath))
 
 
 def read_csv(filepath:str):
@@ -348,9 +339,8 @@ def read_csv(filepath:str):
     Returns:
         str: CSV contents as a string, rows separated by newlines and columns by commas.
     """
-    with open(filepath, newline="", encoding="utf-8") as csvfile:
-        reader = csv.reader(csvfile)
-        return "\n".join([", ".join(row) for row in reader])
+
+    return "\n".join(iter_csv(filepath))
 
 
 handlers:dict[str, Any] = {
@@ -361,32 +351,353 @@ handlers:dict[str, Any] = {
 }
 
 
-def chunk_text(text:str, max_tokens:int=3000)-> Generator[Any, Any, Any]:
+def iter_file(filepath: str, workers: int = 0) -> Iterator[str] | None:
+    """
+    Lazily read a file piece by piece (pages, paragraphs or rows) based on its extension.
+
+    Args:
+        filepath (str): Path to the file.
+        workers (int): Number of processes used to extract PDF pages in parallel, 0 or 1 reads them in-process.
+
+    Returns:
+        iterator of str or None: The file's pieces in document order if the type is supported; otherwise None.
+
+    Side effects:
+        Prints an error message if the file type is unsupported.
+    """
+
+    filetype = filepath.split(".")[-1].lower()
+
+    handler = stream_handlers.get(filetype)
+    if handler is None:
+        print(f"Filetype '{filetype}' is not supported. Please use another filetype.")
+        return None
+    if filetype == "pdf":
+        return handler(filepath, workers)
+    return handler(filepath)
+
+
+def iter_txt(filepath: str) -> Generator[str, None, None]:
+    """
+    Yield the paragraphs of a plain text (.txt) file without loading the whole file.
+
+    Args:
+        filepath (str): Path to the text file.
+
+    Yields:
+        str: One paragraph (lines up to the next blank line) at a time.
+    """
+
+    with open(filepath, "r", encoding="utf-8") as file:
+        paragraph: List[str] = []
+        for line in file:
+            if line.strip():
+                paragraph.append(line)
+            elif paragraph:
+                yield "".join(paragraph)
+                paragraph = []
+        if paragraph:
+            yield "".join(paragraph)
+
+
+def iter_docx(filepath: str) -> Generator[str, None, None]:
+    """
+    Yield the paragraphs of a Microsoft Word (.docx) file.
+
+    Args:
+        filepath (str): Path to the .docx file.
+
+    Yields:
+        str: The text of one paragraph at a time, empty paragraphs are skipped.
+    """
+
+    import docx
+
+    doc = docx.Document(filepath)
+    for para in doc.paragraphs:
+        if para.text.strip():
+            yield para.text
+
+
+def _extract_pdf_pages(filepath: str, start: int, end: int) -> List[str]:
+    # runs in a worker process, so it opens its own handle on the pdf
+    import pdfplumber
+
+    with pdfplumber.open(filepath) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages[start:end]]
+
+
+def iter_pdf(filepath: str, workers: int = 0, pages_per_task: int = 8) -> Generator[str, None, None]:
+    """
+    Yield the text of a PDF file page by page.
+
+    With workers > 1 page ranges are extracted in a process pool. Pages are still yielded in order,
+    and only about two ranges per worker are in flight, so memory stays bounded.
+
+    Args:
+        filepath (str): Path to the PDF file.
+        workers (int): Number of worker processes, 0 or 1 extracts in-process.
+        pages_per_task (int): Number of pages each worker extracts per task.
+
+    Yields:
+        str: Extracted text of one page at a time.
+    """
+
+    import pdfplumber
+
+    if workers <= 1:
+        with pdfplumber.open(filepath) as pdf:
+            for page in pdf.pages:
+                yield page.extract_text() or ""
+        return
+
+    with pdfplumber.open(filepath) as pdf:
+        page_count = len(pdf.pages)
+    from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing, only needed here
+
+    ranges = iter([(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque[Future[List[str]]] = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_extract_pdf_pages, filepath, start, end))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(executor.submit(_extract_pdf_pages, filepath, *next_range))
+            yield from pages
+
+
+def iter_csv(filepath: str) -> Generator[str, None, None]:
+    """
+    Yield the rows of a CSV file one at a time, columns joined by commas.
+
+    Args:
+        filepath (str): Path to the CSV file.
+
+    Yields:
+        str: One row at a time.
+    """
+
+    with open(filepath, newline="", encoding="utf-8") as csvfile:
+        for row in csv.reader(csvfile):
+            yield ", ".join(row)
+
+
+stream_handlers: dict[str, Any] = {
+    "txt": iter_txt,
+    "docx": iter_docx,
+    "pdf": iter_pdf,
+    "csv": iter_csv,
+}
+
+# bump a reader's version whenever its output changes, this invalidates cached extractions
+reader_versions: dict[str, int] = {
+    "txt": 1,
+    "docx": 1,
+    "pdf": 2,
+    "csv": 1,
+}
+
+
+_ENCODER: Any = None
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def get_encoder() -> Any:
+    """
+    Return the shared 'cl100k_base' tiktoken encoder, loading it on first use.
+
+    Returns:
+        tiktoken.Encoding: The cached encoder instance.
+    """
+
+    global _ENCODER
+    if _ENCODER is None:
+        import tiktoken
+
+        _ENCODER = tiktoken.get_encoding("cl100k_base")
+    return _ENCODER
+
+
+def split_segments(text: str) -> Generator[tuple[str, bool], None, None]:
+    """
+    Split text into whitespace-normalized sentences.
+
+    Args:
+        text (str): The text to split.
+
+    Yields:
+        tuple: (sentence, ends_paragraph) where ends_paragraph is True for the last sentence of a paragraph.
+    """
+
+    for paragraph in _PARAGRAPH_RE.split(text):
+        sentences = [" ".join(s.split()) for s in _SENTENCE_RE.split(paragraph)]
+        sentences = [s for s in sentences if s]
+        for i, sentence in enumerate(sentences):
+            yield sentence, i == len(sentences) - 1
+
+
+def _join_segments(window: List[tuple[str, int, bool, bool]]) -> str:
+    parts: List[str] = []
+    for i, (segment, _, ends_paragraph, _) in enumerate(window):
+        parts.append(segment)
+        if i < len(window) - 1:
+            parts.append("\n\n" if ends_paragraph else " ")
+    return "".join(parts)
+
+
+def _cut_point(window: List[tuple[str, int, bool, bool]], max_tokens: int) -> int:
+    # prefer the last paragraph break, as long as it leaves the chunk at least half full;
+    # a break inside the carried-over overlap would emit no new text and never advance the window
+    used = 0
+    best = len(window)
+    for i, (_, tokens, ends_paragraph, is_overlap) in enumerate(window[:-1]):
+        used += tokens + 1
+        if ends_paragraph and not is_overlap and used >= max_tokens // 2:
+            best = i + 1
+    return best
+
+
+def _continues_character(token: bytes) -> bool:
+    # utf-8 continuation bytes are 10xxxxxx, a token starting with one holds the tail of a character
+    return bool(token) and 0x80 <= token[0] < 0xC0
+
+
+def _split_tokens(enc: Any, tokens: List[int], max_tokens: int) -> List[tuple[str, int]]:
+    # cuts an over-long sentence into pieces of at most max_tokens tokens, moving each cut back to a token
+    # that starts a character, so no multi-byte character is split into two U+FFFD halves
+    token_bytes = enc.decode_tokens_bytes(tokens)
+    pieces: List[tuple[str, int]] = []
+    start = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        cut = end
+        while start + 1 < cut < len(tokens) and _continues_character(token_bytes[cut]):
+            cut -= 1
+        if cut < len(tokens) and _continues_character(token_bytes[cut]):
+            cut = end  # one character spans more than max_tokens tokens, cutting it is unavoidable
+        pieces.append((b"".join(token_bytes[start:cut]).decode("utf-8", errors="replace"), cut - start))
+        start = cut
+    return pieces
+
+
+def chunk_segments(
+    segments: Iterable[tuple[str, bool]], max_tokens: int = 3000, overlap_tokens: int = 0
+) -> Generator[str, None, None]:
+    """
+    Pack sentences into chunks of at most max_tokens tokens.
+
+    Every sentence is encoded exactly once, so the total work is linear in the size of the input.
+    Chunks are cut at paragraph boundaries where possible, otherwise at sentence boundaries;
+    sentences longer than max_tokens are cut at token boundaries that do not split a character.
+
+    Args:
+        segments (iterable of tuple): (sentence, ends_paragraph) pairs, e.g. from `split_segments`.
+        max_tokens (int): Maximum number of tokens per chunk.
+        overlap_tokens (int): Number of trailing tokens (in whole sentences) repeated at the start of the next chunk.
+
+    Yields:
+        str: Text chunks that do not exceed the max_tokens limit.
+
+    Raises:
+        ValueError: If overlap_tokens is not smaller than max_tokens.
+    """
+
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens.")
+
+    enc = get_encoder()
+    # entries are (text, token_count, ends_paragraph, is_overlap); every entry costs one extra separator token
+    window: List[tuple[str, int, bool, bool]] = []
+    window_tokens = 0
+    encode_seconds = 0.0
+    total_tokens = 0
+
+    for sentence, ends_paragraph in segments:
+        start = time.perf_counter()
+        tokens = enc.encode_ordinary(sentence)
+        encode_seconds += time.perf_counter() - start
+        total_tokens += len(tokens)
+        if len(tokens) > max_tokens:
+            pieces = _split_tokens(enc, tokens, max_tokens)
+        else:
+            pieces = [(sentence, len(tokens))]
+
+        for n, (piece, piece_tokens) in enumerate(pieces):
+            piece_ends_paragraph = ends_paragraph and n == len(pieces) - 1
+            while window and window_tokens + piece_tokens + 1 > max_tokens:
+                if all(entry[3] for entry in window):
+                    # only carried-over overlap left, drop it rather than emitting a duplicate chunk
+                    window, window_tokens = [], 0
+                    break
+                cut = _cut_point(window, max_tokens)
+                emitted, rest = window[:cut], window[cut:]
+                metrics.inc("chunks_created_total")
+                yield _join_segments(emitted)
+
+                overlap: List[tuple[str, int, bool, bool]] = []
+                overlap_used = 0
+                for entry in reversed(emitted):
+                    if overlap_used + entry[1] + 1 > overlap_tokens:
+                        break
+                    overlap.insert(0, (entry[0], entry[1], entry[2], True))
+                    overlap_used += entry[1] + 1
+                window = overlap + rest
+                window_tokens = sum(entry[1] + 1 for entry in window)
+
+            window.append((piece, piece_tokens, piece_ends_paragraph, False))
+            window_tokens += piece_tokens + 1
+
+    if window and not all(entry[3] for entry in window):
+        metrics.inc("chunks_created_total")
+        yield _join_segments(window)
+
+    metrics.observe("tokenize", encode_seconds)
+    metrics.inc("tokens_encoded_total", total_tokens)
+
+
+def chunk_pieces(
+    pieces: Iterable[str], max_tokens: int = 3000, overlap_tokens: int = 0
+) -> Generator[str, None, None]:
+    """
+    Yield chunks from a lazily produced document, e.g. from `iter_file`.
+
+    Each piece (page, paragraph, row) ends a paragraph. Chunks are yielded as soon as they are full,
+    so generation can start while later pieces are still being read.
+
+    Args:
+        pieces (iterable of str): The document's pieces in order.
+        max_tokens (int): Maximum number of tokens per chunk.
+        overlap_tokens (int): Number of trailing tokens repeated at the start of the next chunk.
+
+    Yields:
+        str: Text chunks that do not exceed the max_tokens limit.
+    """
+
+    segments = (segment for piece in pieces for segment in split_segments(piece))
+    yield from chunk_segments(segments, max_tokens, overlap_tokens)
+
+
+def chunk_text(text: str, max_tokens: int = 3000, overlap_tokens: int = 0) -> Generator[str, None, None]:
     """
     Yield successive chunks of text, each fitting within a maximum token count.
 
     Args:
         text (str): The full text to split.
         max_tokens (int): Maximum number of tokens per chunk.
+        overlap_tokens (int): Number of trailing tokens repeated at the start of the next chunk.
 
     Yields:
         str: Text chunks that do not exceed the max_tokens limit.
 
     Notes:
-        Uses the 'cl100k_base' tokenizer from tiktoken to count tokens.
+        Uses the cached 'cl100k_base' tokenizer from tiktoken to count tokens. Runs in linear time,
+        see `chunk_segments`.
     """
 
-    enc = tiktoken.get_encoding("cl100k_base")
-    words = text.split()
-    current_chunk = []
-
-    for word in words:
-        current_chunk.append(word)
-        tokens = enc.encode(" ".join(current_chunk))
-        if len(tokens) > max_tokens:
-            current_chunk.pop()
-            yield " ".join(current_chunk)
-            current_chunk = [word]
-
-    if current_chunk:
-        yield " ".join(current_chunk)
+    yield from chunk_segments(split_segments(text), max_tokens, overlap_tokens)
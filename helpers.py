@@ -1,18 +1,29 @@
-from tenacity import retry, stop_after_attempt, wait_fixed
+import platform
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import ai_handler
+import anki_handler
+import card_parser
+import deck_store
+import dedup
 import file_handler
-from typing import Dict, Any
+import job_manifest
+import metrics
+import scheduler
+from typing import Dict, Any, Callable, Generator, Iterable, List
 
 
-def get_settings(use_inputs: bool, config: dict[str, Any]) -> dict[str, str]:
+def get_settings(use_inputs: bool, config: dict[str, Any], os_name: str = platform.system().lower()) -> dict[str, str]:
     """
     Gather configuration options either from user input or a provided config file.
 
     Args:
         use_inputs (bool): If True, prompts the user for input. If False, loads settings from `config`.
         config (dict): Configuration dictionary containing default options and file paths.
-        file_handler (module): Module for reading input text files.
+        os_name (str): Key of the `filepaths` section to take the text file from.
 
     Returns:
         dict: A dictionary containing configuration options such as:
@@ -21,11 +32,13 @@ def get_settings(use_inputs: bool, config: dict[str, Any]) -> dict[str, str]:
             - deck_name (str): Name of the deck to be created.
             - card_amount (str): Number of cards to generate.
             - text (str): Text description or content to base the cards on.
+            - text_file (str): Path of the file to base the cards on, only set if use_file is enabled.
+              The file is not read here, see `file_handler.iter_file`.
     """
     options: Dict[str, str] = {}
     if use_inputs:
         options["topic"] = input("deck topic(s): ")
-        options["use_topic_file"] = input("use topic file to base cards on? (Y/N): ")
+        options["use_file"] = input("use topic file to base cards on? (Y/N): ")
         options["deck_name"] = input("deck name: ")
         options["card_amount"] = str(input("amount of cards to generate: "))
         options["text"] = input(
@@ -33,7 +46,7 @@ def get_settings(use_inputs: bool, config: dict[str, Any]) -> dict[str, str]:
         )
     else:
         options["topic"] = config["options"]["topic"]
-        options["use_file"] = config["options"]["use_file"]
+        options["use_file"] = config["options"].get("use_file", config["options"].get("use_topic_file", "n"))
         options["deck_name"] = config["options"]["deck_name"]
         options["card_amount"] = config["options"]["card_amount"]
         options["text"] = config["options"]["text"]
@@ -41,28 +54,483 @@ def get_settings(use_inputs: bool, config: dict[str, Any]) -> dict[str, str]:
     if options["use_file"].lower() in ["yes", "y"]:
         if use_inputs:
             filename_key = input("yaml filename key value: ")
-            filepath = config["filepaths"][filename_key]
+            filepath = config["filepaths"][os_name][filename_key]
         else:
-            filepath = config["filepaths"]["text_file"]
-
-        options["text"] = "create cards based on this text: \n"
-        text = file_handler.read_file(filepath)
-        if text is None:
-            options["text"] += "No text found."
-        else:
-            options["text"] += text
+            filepath = config["filepaths"][os_name]["text_file"]
+        options["text_file"] = filepath
 
     return options
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(2))
+def load_duplicate_index(
+    config: dict[str, Any], decks_path: str, anki_deck_name: str | None = None
+) -> dedup.DuplicateIndex | None:
+    """
+    Load the persistent duplicate index and bring it up to date with the decks on disk and, optionally, in Anki.
+
+    Args:
+        config (dict): Configuration dictionary, reads the `dedup` section (enabled, path, threshold, include_anki).
+        decks_path (str): Directory holding the JSON and JSON Lines decks.
+        anki_deck_name (str or None): Anki deck whose notes are indexed as well if include_anki is enabled.
+
+    Returns:
+        dedup.DuplicateIndex or None: The index, or None if deduplication is disabled.
+    """
+
+    settings = config.get("dedup", {})
+    if not settings.get("enabled", False):
+        return None
+    index = dedup.DuplicateIndex.load(
+        settings.get("path", "./.cache/dedup_index.pickle"), float(settings.get("threshold", 0.8))
+    )
+    added = index.index_decks(decks_path)
+    if anki_deck_name and str(settings.get("include_anki", "n")).lower() in ["yes", "y"]:
+        try:
+            added += index.index_cards(anki_handler.fetch_deck_cards(anki_deck_name))
+        except Exception as err:
+            print(f"could not index anki deck '{anki_deck_name}' - {err}")
+    print(f"duplicate index: {len(index)} cards, {added} newly indexed")
+    return index
+
+
+def add_new_cards(
+    deck_name: str, cards: List[Dict[str, Any]], manifest: job_manifest.JobManifest, batch_size: int = 500
+) -> int:
+    """
+    Add the cards of a job to Anki that are not there yet and record their note IDs in the job manifest.
+
+    Cards the manifest already has a note ID for, from an earlier run of the job, are not sent again.
+
+    Args:
+        deck_name (str): Name of the Anki deck.
+        cards (list of dict): All cards of the job's deck.
+        manifest (job_manifest.JobManifest): The job's manifest.
+        batch_size (int): Maximum number of notes per AnkiConnect request.
+
+    Returns:
+        int: Number of cards added.
+    """
+
+    known = manifest.note_ids()
+    new_cards = [card for card in cards if job_manifest.card_id(card) not in known]
+    note_ids = anki_handler.add_cards_bulk(deck_name, new_cards, batch_size)
+    manifest.add_note_ids({job_manifest.card_id(card): note_id for card, note_id in zip(new_cards, note_ids)})
+    return sum(1 for note_id in note_ids if note_id is not None)
+
+
+def fill_template(template: str, values: Dict[str, str]) -> str:
+    for name, value in values.items():
+        template = template.replace("{{" + name + "}}", value)
+    return template
+
+
+def assemble_prompt(
+    prompts: dict[str, str], name: str, fixed: Dict[str, str], variable: Dict[str, str]
+) -> tuple[str, str]:
+    """
+    Fill a two-part prompt template, `{name}_system` and `{name}_request` in prompts.yaml.
+
+    The system part is filled with the values that stay the same for the whole run only, so it is
+    byte-identical from request to request, and is sent first as the system message. Everything that
+    changes per chunk goes into the request part, the last message. Ollama keeps the evaluated prompt of
+    the loaded model and OpenAI caches prompt prefixes, so both skip re-reading the instructions on every
+    request after the first.
+
+    Args:
+        prompts (dict): Prompt templates.
+        name (str): Name of the prompt, e.g. "generate_flashcards".
+        fixed (dict): Placeholder values shared by all requests of a run, e.g. the topic.
+        variable (dict): Placeholder values of this request, e.g. the chunk.
+
+    Returns:
+        tuple: (system prompt, request prompt).
+    """
+
+    return (
+        fill_template(prompts[f"{name}_system"], fixed),
+        fill_template(prompts[f"{name}_request"], {**fixed, **variable}),
+    )
+
+
+def build_prompt(options: dict[str, str], prompts: dict[str, str], chunk: str) -> tuple[str, str]:
+    """
+    Fill the flashcard prompt with the user options and a text chunk, see `assemble_prompt`.
+
+    Args:
+        options (dict): User-defined options, expects "topic" and "card_amount".
+        prompts (dict): Dictionary containing the "generate_flashcards" prompt templates.
+        chunk (str): A segment of text to be used as input content for flashcard generation. A
+            `chunk_filter.ScoredChunk` brings its own card amount.
+
+    Returns:
+        tuple: (system prompt, request prompt).
+    """
+
+    return assemble_prompt(
+        prompts,
+        "generate_flashcards",
+        {"topic": options["topic"]},
+        {"text": chunk, "card_amount": str(getattr(chunk, "card_amount", options["card_amount"]))},
+    )
+
+
+def build_packed_prompt(options: dict[str, str], prompts: dict[str, str], pack: List[str]) -> tuple[str, str]:
+    """
+    Fill the packed flashcard prompt with the user options and several text chunks, see `assemble_prompt`.
+
+    Each chunk is wrapped in a `<chunk id="n" cards="k">` tag, n counting from 1 and k being its card
+    amount (see `build_prompt`), and the template asks for a "chunk" key with that ID on every card,
+    see `split_packed_cards`.
+
+    Args:
+        options (dict): User-defined options, expects "topic" and "card_amount" (cards per chunk).
+        prompts (dict): Dictionary containing the "generate_flashcards_packed" prompt templates.
+        pack (list of str): The text chunks.
+
+    Returns:
+        tuple: (system prompt, request prompt).
+    """
+
+    tagged = "\n\n".join(
+        f'<chunk id="{i}" cards="{getattr(chunk, "card_amount", options["card_amount"])}">\n{chunk}\n</chunk>'
+        for i, chunk in enumerate(pack, 1)
+    )
+    return assemble_prompt(prompts, "generate_flashcards_packed", {"topic": options["topic"]}, {"chunks": tagged})
+
+
+def pack_chunks(
+    chunks: Iterable[str],
+    context_tokens: int,
+    fixed_tokens: int,
+    reserve_tokens: Callable[[str], int],
+    max_chunks: int = 8,
+) -> Generator[List[str], None, None]:
+    """
+    Group consecutive chunks into packs that fit one request.
+
+    A pack is closed when the next chunk would push it past context_tokens. A chunk that does not fit
+    even on its own becomes a pack by itself.
+
+    Args:
+        chunks (iterable of str): Text chunks, pulled lazily.
+        context_tokens (int): Token budget of one request, prompt and reply.
+        fixed_tokens (int): Tokens of the prompt without any chunk.
+        reserve_tokens (callable): Tokens reserved for a chunk on top of its text, i.e. its tag and its cards
+            in the reply.
+        max_chunks (int): Maximum number of chunks per pack.
+
+    Yields:
+        list of str: The packs, in chunk order.
+    """
+
+    enc = file_handler.get_encoder()
+    pack: List[str] = []
+    used = fixed_tokens
+    for chunk in chunks:
+        cost = len(enc.encode_ordinary(chunk)) + reserve_tokens(chunk)
+        if pack and (used + cost > context_tokens or len(pack) >= max_chunks):
+            yield pack
+            pack = []
+            used = fixed_tokens
+        pack.append(chunk)
+        used += cost
+    if pack:
+        yield pack
+
+
+def _pack_index(card: Dict[str, Any], pack_size: int, previous: int) -> int:
+    # pops the card's chunk ID, models write it as 2, "2" or "chunk 2"
+    digits = "".join(char for char in str(card.pop("chunk", "")) if char.isdigit())
+    number = int(digits) if digits else 0
+    return number - 1 if 1 <= number <= pack_size else previous
+
+
+def split_packed_cards(cards: List[Dict[str, Any]], pack_size: int) -> List[List[Dict[str, Any]]]:
+    """
+    Sort the cards of a packed reply back to their chunks by their "chunk" key, which is removed.
+
+    A card without a valid chunk ID belongs to the chunk of the card before it, as models keep to
+    the chunk order, or to the first chunk.
+
+    Args:
+        cards (list of dict): Parsed cards of the reply.
+        pack_size (int): Number of chunks in the pack.
+
+    Returns:
+        list of list of dict: The cards of each chunk, in pack order.
+    """
+
+    per_chunk: List[List[Dict[str, Any]]] = [[] for _ in range(pack_size)]
+    current = 0
+    for card in cards:
+        current = _pack_index(card, pack_size, current)
+        per_chunk[current].append(card)
+    return per_chunk
+
+
+def generate_pack_cards(
+    options: dict[str, str],
+    config: dict[str, Any],
+    prompts: dict[str, str],
+    pack: List[str],
+    on_card: Callable[[Dict[str, str]], None] | None = None,
+) -> List[List[Dict[str, str]] | None]:
+    """
+    Generate flashcards for several text chunks with a single LLM request, see `build_packed_prompt`.
+
+    Args:
+        options (dict): User-defined options, see `generate_chunk_cards`.
+        config (dict): Configuration dictionary, see `generate_chunk_cards`.
+        prompts (dict): Dictionary containing the "generate_flashcards_packed" prompt templates.
+        pack (list of str): The text chunks, e.g. from `pack_chunks`.
+        on_card (callable or None): If given, the reply is streamed and every card is passed to it
+            as soon as it is parsed, see `generate_chunk_cards_streaming`.
+
+    Returns:
+        list: The cards of each chunk in pack order, None for a chunk the reply has no cards for.
+
+    Raises:
+        ValueError: If no reply contained a readable card, see `generate_chunk_cards`.
+    """
+
+    prompt = build_packed_prompt(options, prompts, pack)
+    metrics.inc("packed_chunks_total", len(pack))
+    if on_card is None:
+        per_chunk = split_packed_cards(generate_chunk_cards(options, config, prompts, "", prompt=prompt), len(pack))
+    else:
+        per_chunk = [[] for _ in pack]
+        current = 0
+
+        def route(card: Dict[str, str]) -> None:
+            nonlocal current
+            current = _pack_index(card, len(pack), current)
+            per_chunk[current].append(card)
+            on_card(card)
+
+        generate_chunk_cards_streaming(options, config, prompts, "", route, prompt=prompt)
+    # a chunk the model skipped is reported as failed, so that a resumed job asks for it again
+    return [cards or None for cards in per_chunk]
+
+
+def parse_reply(reply: str) -> List[Dict[str, str]]:
+    """
+    Parse the cards out of a complete LLM reply.
+
+    The whole reply is read in one pass by the tolerant `card_parser`, which skips `<think>` blocks and
+    copes with Python dict syntax, smart quotes and trailing commas, so a merely malformed reply does not
+    cost another LLM request.
+
+    Args:
+        reply (str): The model's reply.
+
+    Returns:
+        list of dict: The parsed cards, empty if none could be read.
+    """
+
+    with metrics.timer("parse"):
+        cards = file_handler.format_and_split_cards(reply)
+    metrics.inc("cards_parsed_total", len(cards))
+    return cards
+
+
+def generate_chunk_cards(
+    options: dict[str, str],
+    config: dict[str, Any],
+    prompts: dict[str, str],
+    chunk: str,
+    llm_attempts: int = 2,
+    prompt: tuple[str, str] | None = None,
+) -> List[Dict[str, str]]:
+    """
+    Generate flashcards for a single text chunk without writing them anywhere.
+
+    Throttling and transient request failures are retried by `ai_handler.request_scheduler`. A reply
+    without any readable card (see `parse_reply`) is requested again, bypassing the cached copy of the
+    bad reply.
+
+    Args:
+        options (dict): User-defined options, expects "topic" and "card_amount".
+        config (dict): Configuration dictionary, expects "provider", "model" and optionally "llm_options".
+        prompts (dict): Dictionary containing the "generate_flashcards" prompt templates.
+        chunk (str): A segment of text to be used as input content for flashcard generation.
+        llm_attempts (int): Maximum number of LLM requests for the chunk.
+        prompt (tuple or None): (system prompt, request prompt) to send instead of filling the template
+            with chunk, e.g. from `build_packed_prompt`.
+
+    Returns:
+        list of dict: The generated cards, each with 'front', 'back' and 'tags' keys.
+
+    Raises:
+        ValueError: If no reply contained a readable card.
+    """
+
+    system_prompt, filled_prompt = prompt if prompt is not None else build_prompt(options, prompts, chunk)
+    print(f'''topic:{options["topic"]}, card amount: {options["card_amount"]}''')
+    for attempt in range(1, llm_attempts + 1):
+        cards_to_add_response = ai_handler.prompt_ai(
+            config["provider"],
+            filled_prompt,
+            model=config["model"],
+            system_prompt=system_prompt,
+            options=config.get("llm_options"),
+            refresh=attempt > 1,
+        )
+        cards = parse_reply(cards_to_add_response)
+        if cards:
+            return cards
+        if attempt < llm_attempts:
+            metrics.inc("generation_retries_total")
+            print(f"no cards found in reply, requesting a new one (attempt {attempt}/{llm_attempts})")
+    raise ValueError("no readable cards in the model's reply")
+
+
+def generate_chunk_cards_streaming(
+    options: dict[str, str],
+    config: dict[str, Any],
+    prompts: dict[str, str],
+    chunk: str,
+    on_card: Callable[[Dict[str, str]], None],
+    attempts: int = 5,
+    prompt: tuple[str, str] | None = None,
+) -> List[Dict[str, str]]:
+    """
+    Generate flashcards for a single text chunk, handing each card to on_card as soon as the model has written it.
+
+    The reply is streamed and run through `card_parser.CardStreamParser`, so the first cards reach on_card
+    while the model is still generating. A stream that breaks off is retried with the backoff of
+    `ai_handler.request_scheduler`. Retries are idempotent: a card that an earlier attempt already handed
+    to on_card (same `job_manifest.card_id`) is not handed out again.
+
+    Args:
+        options (dict): User-defined options, expects "topic" and "card_amount".
+        config (dict): Configuration dictionary, expects "provider", "model" and optionally "llm_options".
+        prompts (dict): Dictionary containing the "generate_flashcards" prompt templates.
+        chunk (str): A segment of text to be used as input content for flashcard generation.
+        on_card (callable): Called with every card as it is parsed.
+        attempts (int): Maximum number of attempts.
+        prompt (tuple or None): (system prompt, request prompt) to send instead of filling the template
+            with chunk, e.g. from `build_packed_prompt`.
+
+    Returns:
+        list of dict: All cards handed to on_card for the chunk, in the order they were generated.
+
+    Raises:
+        ValueError: If no reply contained a readable card.
+    """
+
+    system_prompt, filled_prompt = prompt if prompt is not None else build_prompt(options, prompts, chunk)
+    delivered: List[Dict[str, str]] = []
+    delivered_ids: set[str] = set()
+
+    def deliver(card: Dict[str, str]) -> None:
+        metrics.inc("cards_parsed_total")
+        key = job_manifest.card_id(card)
+        if key in delivered_ids:
+            return
+        delivered_ids.add(key)
+        delivered.append(card)
+        on_card(card)
+
+    for attempt in range(1, attempts + 1):
+        parser = card_parser.CardStreamParser()
+        parsed = 0
+        try:
+            for piece in ai_handler.prompt_ai_stream(
+                config["provider"],
+                filled_prompt,
+                model=config["model"],
+                system_prompt=system_prompt,
+                options=config.get("llm_options"),
+                refresh=attempt > 1,
+            ):
+                for card in parser.feed(piece):
+                    parsed += 1
+                    deliver(card)
+            for card in parser.close():
+                parsed += 1
+                deliver(card)
+        except Exception as err:
+            retryable, status, retry_after = scheduler.classify_error(err)
+            if attempt == attempts or not retryable:
+                raise
+            delay = ai_handler.request_scheduler.backoff(attempt, retry_after)
+            if status == 429:
+                ai_handler.request_scheduler.throttled(config["provider"], config["model"], delay)
+            metrics.inc("generation_retries_total")
+            print(f"streaming attempt {attempt} failed after {parsed} cards, retrying in {delay:.1f}s - {err}")
+            time.sleep(delay)
+            continue
+        if parsed:
+            print(f"successfully streamed {len(delivered)} cards, skipped {parser.skipped} malformed")
+            return delivered
+        if attempt < attempts:
+            metrics.inc("generation_retries_total")
+            print(f"no cards found in reply, requesting a new one (attempt {attempt}/{attempts})")
+    raise ValueError("no readable cards in the model's reply")
+
+
+class CardSink:
+    """
+    Thread-safe destination for cards produced by `generate_chunk_cards_streaming`.
+
+    Each card is appended to the deck store and, if anki_deck_name is given, added to Anki right away.
+
+    Args:
+        store (deck_store.DeckStore): The deck to append cards to.
+        anki_deck_name (str or None): Anki deck to push cards to, or None to only write the deck store.
+        duplicates (dedup.DuplicateIndex or None): If given, cards duplicating an indexed card are dropped.
+    """
+
+    def __init__(
+        self,
+        store: deck_store.DeckStore,
+        anki_deck_name: str | None = None,
+        duplicates: dedup.DuplicateIndex | None = None,
+    ) -> None:
+        self.store = store
+        self.anki_deck_name = anki_deck_name
+        self.duplicates = duplicates
+        self.count = 0
+        self.note_ids: Dict[str, int | None] = {}
+        self._lock = threading.Lock()
+        if anki_deck_name:
+            anki_handler.ensure_deck_exists(anki_deck_name)
+
+    def add(self, card: Dict[str, str]) -> None:
+        with self._lock:
+            if self.duplicates is not None and not self.duplicates.add(card):
+                print(f"dropped duplicate card: {card['front']}")
+                metrics.inc("duplicates_dropped_total")
+                return
+            self.store.append([card])
+            self.count += 1
+            if self.anki_deck_name:
+                self.note_ids[job_manifest.card_id(card)] = anki_handler.add_card(self.anki_deck_name, card)
+
+    def pop_note_ids(self, card_ids: Iterable[str]) -> Dict[str, int | None]:
+        """
+        Take the Anki note IDs of some added cards, e.g. those of a chunk that just finished.
+
+        Chunks finish out of order, so the IDs of other chunks' cards are kept until those chunks are done.
+
+        Args:
+            card_ids (iterable of str): Card IDs, see `job_manifest.card_id`.
+
+        Returns:
+            dict: Note ID by card ID, for the given cards that were added.
+        """
+
+        with self._lock:
+            return {key: self.note_ids.pop(key) for key in card_ids if key in self.note_ids}
+
+
 def generate_cards(options: dict[str, str], config: dict[str, Any], prompts: dict[str, str], chunk: str) -> str:
     """
     Generate flashcards based on a given topic and text chunk using AI prompts.
 
     This function fills a template prompt with user options and a text chunk, sends it to an AI
     handler to generate flashcards, extracts and formats the resulting JSON, and appends
-    the new cards to a JSON file. The operation is retried up to 5 times with a fixed 2-second wait on failure.
+    the new cards to the deck's JSON Lines store. Generation is retried as described in `generate_chunk_cards`.
 
     Args:
         options (dict): User-defined options including:
@@ -70,37 +538,25 @@ def generate_cards(options: dict[str, str], config: dict[str, Any], prompts: dic
             - "card_amount" (str or int): Number of cards to generate.
             - "deck_name" (str): Name of the deck file to append cards to.
         config (dict): Configuration dictionary for AI model and other settings, e.g.:
+            - "provider" (str): AI provider, "ollama" or "openai".
             - "model" (str): AI model name to be used for generating prompts.
         prompts (dict): Dictionary containing prompt templates, expects key:
-            - "generate_flashcards" (str): Prompt template with placeholders {{topic}}, {{text}}, {{card_amount}}.
+            - "generate_flashcards_system" and "generate_flashcards_request" (str): Prompt templates with
+              placeholders {{topic}}, {{text}}, {{card_amount}}, see `assemble_prompt`.
         chunk (str): A segment of text to be used as input content for flashcard generation.
 
     Returns:
-        str: The filename of the JSON file where the generated flashcards were appended.
+        str: The filename of the JSON Lines deck file where the generated flashcards were appended,
+            see `deck_store.DeckStore`.
 
     Raises:
-        Exception: If AI response JSON extraction or formatting fails (commented out logic indicates possible exceptions).
-
-    Notes:
-        The function uses exponential retry logic from the `retry` decorator to handle transient failures
-        in AI prompt processing or file handling.
+        ValueError: If no reply contained a readable card, see `generate_chunk_cards`.
     """
 
-    filled_prompt = (
-        prompts["generate_flashcards"]
-        .replace("{{topic}}", options["topic"])
-        .replace("{{text}}", chunk)
-        .replace("{{card_amount}}", options["card_amount"])
-    )
-    print(f'''topic:{options["topic"]}, card amount: {options["card_amount"]}''')
-    cards_to_add_response = ai_handler.prompt_ai(filled_prompt, model=config["model"])
-    raw_json_str = file_handler.extract_json(
-        cards_to_add_response
-    )  # extract the json part of LLM response
-    list_of_cards_dicts = file_handler.format_and_split_cards(raw_json_str)
-    filename = file_handler.append_to_json_file(
-        list_of_cards_dicts, options["topic"], options["deck_name"]
-    )
+    list_of_cards_dicts = generate_chunk_cards(options, config, prompts, chunk)
+    with deck_store.DeckStore.for_deck(options["topic"], options["deck_name"]) as store:
+        store.append(list_of_cards_dicts)
+    filename = store.path
 
     # if config["simple_reply_format"]: #add enums for different response types?
     #     cleaned_card_json_str = file_handler.clean_malformed_json(raw_json_str)
@@ -112,3 +568,93 @@ def generate_cards(options: dict[str, str], config: dict[str, Any], prompts: dic
     #         raise Exception
 
     return filename
+
+
+def generate_cards_concurrently(
+    options: dict[str, str],
+    config: dict[str, Any],
+    prompts: dict[str, str],
+    chunks: Iterable[str],
+    max_workers: int = 4,
+    on_card: Callable[[Dict[str, str]], None] | None = None,
+    window: int | None = None,
+) -> Generator[tuple[int, List[Dict[str, str]] | None], None, None]:
+    """
+    Generate flashcards for many chunks with up to max_workers LLM requests in flight.
+
+    Chunks are pulled lazily and at most `window` requests' worth of chunks are held at once, counting
+    both the running requests and the finished ones waiting for an earlier chunk. Results are yielded in
+    chunk order, but since the window is larger than max_workers, a slow chunk does not hold up the
+    requests behind it: they keep running and their results wait in the window until it is done.
+    A chunk whose generation fails after all retries is reported and yields None instead of a card list,
+    the remaining chunks carry on.
+
+    If the `packing` config section is enabled, consecutive chunks are packed into shared requests up
+    to its context_tokens budget (see `pack_chunks` and `generate_pack_cards`), so small chunks do not
+    each pay for the prompt header and a round trip.
+
+    Args:
+        options (dict): User-defined options, see `generate_chunk_cards`.
+        config (dict): Configuration dictionary, see `generate_chunk_cards`.
+        prompts (dict): Dictionary containing prompt templates.
+        chunks (iterable of str): Text chunks, e.g. from `file_handler.chunk_text`.
+        max_workers (int): Maximum number of concurrent LLM requests.
+        on_card (callable or None): If given, replies are streamed and every card is passed to it
+            as soon as it is parsed, see `generate_chunk_cards_streaming`.
+        window (int or None): Maximum number of requests submitted but not yet yielded, 4 * max_workers if None.
+
+    Yields:
+        tuple: (chunk_index, cards or None if the chunk failed) in chunk order.
+    """
+
+    packing = config.get("packing") or {}
+    if packing.get("enabled", False):
+        enc = file_handler.get_encoder()
+        packs: Iterable[List[str]] = pack_chunks(
+            chunks,
+            int(packing.get("context_tokens", 8192)),
+            sum(len(enc.encode_ordinary(part)) for part in build_packed_prompt(options, prompts, [])),
+            # the chunk's tag plus room for its cards in the reply
+            lambda chunk: 20
+            + int(getattr(chunk, "card_amount", options["card_amount"])) * int(packing.get("tokens_per_card", 80)),
+            int(packing.get("max_chunks", 8)),
+        )
+    else:
+        packs = ([chunk] for chunk in chunks)
+
+    workers = max(1, max_workers)
+    window = max(workers, window or 4 * workers)
+    pending: deque[tuple[Future[Any], int]] = deque()
+    index = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pack_iter = iter(packs)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < window:
+                pack = next(pack_iter, None)
+                if pack is None:
+                    exhausted = True
+                    break
+                if len(pack) > 1:
+                    future = executor.submit(generate_pack_cards, options, config, prompts, pack, on_card)
+                elif on_card is None:
+                    future = executor.submit(generate_chunk_cards, options, config, prompts, pack[0])
+                else:
+                    future = executor.submit(
+                        generate_chunk_cards_streaming, options, config, prompts, pack[0], on_card
+                    )
+                pending.append((future, len(pack)))
+            if not pending:
+                break
+            future, size = pending.popleft()
+            results: List[List[Dict[str, str]] | None]
+            try:
+                results = future.result() if size > 1 else [future.result()]
+            except Exception as err:
+                label = f"chunks {index}-{index + size - 1}" if size > 1 else f"chunk {index}"
+                print(f"{label} failed and will be skipped - {err}")
+                results = [None] * size
+            for cards in results:
+                metrics.inc("chunks_total", status="ok" if cards is not None else "failed")
+                yield index, cards
+                index += 1
@@ -0,0 +1,104 @@
+import threading
+from typing import TYPE_CHECKING, Any, Dict
+
+if TYPE_CHECKING:
+    # imported on first use, loading it costs more than a whole readymade-deck sync
+    import requests
+
+# client names used by the app, each gets its own connection pool and may override the defaults
+# in the `http` section of config.yaml, e.g. `anki: {read_timeout: 60}`
+CLIENT_NAMES = ("openai", "anki")
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "pool_size": 10,
+    "connect_timeout": 5.0,
+    "read_timeout": 300.0,
+}
+
+_settings: Dict[str, Any] = dict(DEFAULT_SETTINGS)
+_sessions: Dict[str, "requests.Session"] = {}
+_lock = threading.Lock()
+
+
+def configure(settings: Dict[str, Any] | None) -> None:
+    """
+    Set pool sizes and timeouts for all clients. Sessions created before are closed and rebuilt on next use.
+
+    Args:
+        settings (dict or None): The `http` config section, keys: pool_size, connect_timeout, read_timeout,
+            plus optional per-client sections with the same keys.
+    """
+
+    global _settings
+    with _lock:
+        _settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def client_settings(name: str) -> Dict[str, Any]:
+    overrides = _settings.get(name) or {}
+    return {key: overrides.get(key, _settings[key]) for key in DEFAULT_SETTINGS}
+
+
+def timeout(name: str) -> tuple[float, float]:
+    """(connect, read) timeout of a client, in the form `requests` expects."""
+    settings = client_settings(name)
+    return float(settings["connect_timeout"]), float(settings["read_timeout"])
+
+
+def get_session(name: str) -> "requests.Session":
+    """
+    Return the shared keep-alive session of a client, creating it on first use.
+
+    The session's connection pool holds up to pool_size connections per host, so that many concurrent
+    requests reuse open connections (and TLS sessions) instead of connecting for every call.
+
+    Args:
+        name (str): Client name, see `CLIENT_NAMES`.
+
+    Returns:
+        requests.Session: The pooled session.
+    """
+
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _lock:
+        if name not in _sessions:
+            pool_size = int(client_settings(name)["pool_size"])
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Connection"] = "keep-alive"
+            _sessions[name] = session
+        return _sessions[name]
+
+
+def post(name: str, url: str, **kwargs: Any) -> "requests.Response":
+    """
+    POST through a client's pooled session, with its timeouts unless `timeout` is given.
+
+    Args:
+        name (str): Client name, see `CLIENT_NAMES`.
+        url (str): Target URL.
+        **kwargs: Passed on to `requests.Session.post`, e.g. json, headers or stream.
+
+    Returns:
+        requests.Response: The response.
+    """
+
+    kwargs.setdefault("timeout", timeout(name))
+    return get_session(name).post(url, **kwargs)
+
+
+def close() -> None:
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
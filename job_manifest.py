@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List
+
+import deck_store
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+# manifests live next to the decks in decks_path
+MANIFEST_SUFFIX = ".job.jsonl"
+
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def card_id(card: Dict[str, Any]) -> str:
+    # stable across runs: a card is identified by its question and answer
+    return hashlib.sha1(f"{card.get('front', '')}\x1f{card.get('back', '')}".encode("utf-8")).hexdigest()
+
+
+class _ManifestLog(deck_store.DeckStore):
+    # the manifest's lines are chunk records, they are not counted as cards appended to a deck
+    append_metric = "job_manifest_append"
+    count_metric = "job_manifest_records_total"
+
+
+class JobManifest:
+    """
+    Checkpoint of a generation job: the state of every chunk of every source that went into a deck.
+
+    Each chunk is identified by the hash of its text and has a status (pending, done or failed), the
+    IDs of the cards it produced (see `card_id`) and the Anki note IDs of those cards. Every change is
+    appended as one JSON line and synced to disk, the last line of a chunk wins when the manifest is
+    loaded, so a run that dies mid-way loses nothing that had been recorded.
+
+    Args:
+        path (str): Path of the manifest `.jsonl` file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        self.submitted: List[str] = []
+        self._log = _ManifestLog(path)
+        records = self._log.read()
+        for record in records:
+            if isinstance(record, dict) and "chunk" in record:
+                self.chunks[record["chunk"]] = record
+        if len(records) > 2 * len(self.chunks) + 100:
+            # drop superseded lines so loading stays proportional to the number of chunks
+            deck_store.write_atomic(path, "".join(json.dumps(record) + "\n" for record in self.chunks.values()))
+
+    @classmethod
+    def for_deck(cls, topic: str, deck_name: str, decks_path: str = "./decks/") -> "JobManifest":
+        return cls(os.path.join(decks_path, f"{topic}_{deck_name}{MANIFEST_SUFFIX}"))
+
+    def _save(self, record: Dict[str, Any]) -> None:
+        record["updated"] = time.time()
+        self.chunks[record["chunk"]] = record
+        self._log.append([record])
+
+    def status(self, chunk: str) -> str | None:
+        record = self.chunks.get(chunk)
+        return record["status"] if record else None
+
+    def track(self, chunks: Iterable[str], source: str) -> Iterator[str]:
+        """
+        Pass through the chunks that still need generating, marking each one pending as it is handed out.
+
+        Finished chunks are skipped. The hash of every chunk handed out is appended to `submitted`, so
+        the n-th result of a generation run belongs to `submitted[n]`.
+
+        Args:
+            chunks (iterable of str): All chunks of a source, in order.
+            source (str): Name of the source, e.g. its file path.
+
+        Yields:
+            str: The chunks that are new, pending or failed.
+        """
+
+        skipped = 0
+        for index, chunk in enumerate(chunks):
+            key = chunk_hash(chunk)
+            if self.status(key) == DONE:
+                skipped += 1
+                continue
+            previous = self.chunks.get(key, {})
+            self._save(
+                {
+                    "chunk": key,
+                    "source": source,
+                    "index": index,
+                    "status": PENDING,
+                    "attempts": previous.get("attempts", 0) + 1,
+                    "card_ids": [],
+                    "note_ids": [],
+                }
+            )
+            self.submitted.append(key)
+            yield chunk
+        if skipped:
+            print(f"skipped {skipped} chunks of '{source}' that were already done")
+
+    def finish(self, chunk: str, cards: List[Dict[str, Any]]) -> None:
+        self._save({**self.chunks[chunk], "status": DONE, "card_ids": [card_id(card) for card in cards], "error": None})
+
+    def fail(self, chunk: str, error: str) -> None:
+        self._save({**self.chunks[chunk], "status": FAILED, "error": error})
+
+    def note_ids(self) -> Dict[str, int]:
+        """Anki note ID of every card that has been added to Anki, by card ID."""
+        known: Dict[str, int] = {}
+        for record in self.chunks.values():
+            for key, note_id in zip(record.get("card_ids", []), record.get("note_ids", [])):
+                if note_id is not None:
+                    known[key] = note_id
+        return known
+
+    def add_note_ids(self, note_ids: Dict[str, int | None], chunk: str | None = None) -> None:
+        """
+        Record the Anki note IDs of added cards with the chunks that produced them.
+
+        Args:
+            note_ids (dict): Note ID by card ID, None for cards Anki did not take.
+            chunk (str or None): Hash of the chunk the cards belong to, so only its record is updated;
+                None looks through every chunk, e.g. after a bulk add of the whole deck.
+        """
+
+        records = [self.chunks[chunk]] if chunk is not None else list(self.chunks.values())
+        for record in records:
+            card_ids = record.get("card_ids", [])
+            if not any(note_ids.get(key) is not None for key in card_ids):
+                continue
+            current = list(record.get("note_ids") or []) + [None] * (len(card_ids) - len(record.get("note_ids") or []))
+            updated = [current[i] if note_ids.get(key) is None else note_ids[key] for i, key in enumerate(card_ids)]
+            if updated != record.get("note_ids"):
+                self._save({**record, "note_ids": updated})
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for record in self.chunks.values():
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return counts
+
+    def reset(self) -> None:
+        self._log.close()
+        deck_store.write_atomic(self.path, "")
+        self.chunks.clear()
+        self.submitted.clear()
+
+    def close(self) -> None:
+        self._log.close()
+
+    def __enter__(self) -> "JobManifest":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM replies keyed on a hash of everything that affects the reply.
+
+    Entries live in a single SQLite table. Entries older than max_age_seconds are ignored and
+    removed, and once the stored replies exceed max_bytes the least recently used ones are evicted.
+
+    Args:
+        path (str): Path to the SQLite database file, created if missing.
+        max_bytes (int): Upper bound on the total size of stored replies, 0 for no limit.
+        max_age_seconds (float): Maximum age of an entry, 0 for no limit.
+        refresh (bool): If True, cached replies are never returned but fresh replies are still stored.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int = 0, max_age_seconds: float = 0, refresh: bool = False
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(
+        provider: str, model: str, system_prompt: str, prompt: str, params: Dict[str, Any] | None = None
+    ) -> str:
+        payload = json.dumps([provider, model, system_prompt, prompt, params or {}], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        if self.refresh:
+            self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age_seconds and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+        if self._puts % 100 == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove expired entries, then least recently used entries until the size limit holds.
+
+        Returns:
+            int: Number of removed entries.
+        """
+
+        removed = 0
+        with self._lock:
+            if self.max_age_seconds:
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_seconds,)
+                ).rowcount
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    freed = 0
+                    stale: list[str] = []
+                    for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                        stale.append(key)
+                        freed += size
+                        if freed >= excess:
+                            break
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in stale])
+                    removed += len(stale)
+            self._conn.commit()
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+def from_config(settings: Dict[str, Any], refresh: bool = False) -> ResponseCache | None:
+    """
+    Build a ResponseCache from the `llm_cache` section of config.yaml.
+
+    Args:
+        settings (dict): The `llm_cache` config section, keys: enabled, path, max_size_mb, max_age_days.
+        refresh (bool): Skip cached replies for this run, see `ResponseCache`.
+
+    Returns:
+        ResponseCache or None: The cache, or None if caching is disabled.
+    """
+
+    if not settings or not settings.get("enabled", True):
+        return None
+    return ResponseCache(
+        settings.get("path", "./.cache/llm_responses.sqlite3"),
+        max_bytes=int(float(settings.get("max_size_mb", 0)) * 1024 * 1024),
+        max_age_seconds=float(settings.get("max_age_days", 0)) * 24 * 3600,
+        refresh=refresh,
+    )
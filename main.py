@@ -1,50 +1,248 @@
+import argparse
 import os
-import subprocess
+import ai_handler
 import anki_handler
+import anki_sync
+import apkg_export
+import batch
+import chunk_filter
+import deck_store
+import extraction_cache
 import file_handler
 import helpers
-from typing import Dict
+import http_client
+import job_manifest
+import llm_cache
+import metrics
+import router
+import scheduler
+import watch
+from typing import Any, Dict, List
 import platform 
-import glob 
 
-if __name__ == "__main__":
+def sync_readymade_deck(config: Dict[str, Any], os_name: str) -> None:
+    print(
+        f"Using readymade deck: {config['options']['readymade_deck_name']}. No new cards will be created."
+    )
+    cards = file_handler.read_json_file(
+        config["filepaths"][os_name]["decks_path"] + config["options"]["readymade_deck_name"] + ".json"
+    )
+    if not cards:
+        print("No cards found in the readymade deck file.")
+        exit(1)
+    print(f"Cards found: {len(cards)}")
+    print(f"Syncing cards to deck: {config['options']['readymade_deck_name']}")
+    # only the difference to what the last sync left in anki is sent
+    anki_sync.sync_deck(
+        config["options"]["readymade_deck_name"],
+        cards,
+        anki_sync.SyncState.for_deck(
+            config["options"]["readymade_deck_name"], config["filepaths"][os_name]["decks_path"]
+        ),
+        int(config["options"].get("anki_batch_size", 500)),
+        delete=config["options"].get("anki_sync_deletes", "y").lower() in ["yes", "y"],
+    )
+
+
+def configure_generation(
+    args: argparse.Namespace, config: Dict[str, Any], os_name: str
+) -> tuple[Dict[str, str], extraction_cache.ExtractionCache | None]:
+    # sets up the LLM client side shared by single-deck and batch runs,
+    # returns the prompt templates and the extraction cache (None if it is disabled)
+    ai_handler.configure_scheduler(scheduler.from_config(config.get("rate_limits")))
+    ai_handler.configure_router(
+        router.from_config(config.get("routing"), int(config["options"].get("max_concurrent_requests", 1)))
+    )
+    ai_handler.configure_ollama(config.get("ollama"))
+    if not args.no_cache:
+        ai_handler.configure_cache(llm_cache.from_config(config.get("llm_cache", {}), refresh=args.refresh_cache))
+    extraction = extraction_cache.from_config(config.get("extraction_cache", {}))
+    if extraction is not None and args.invalidate_extraction_cache:
+        print(f"Dropped {extraction.invalidate()} cached text extractions")
+    return file_handler.read_yaml_file(config["filepaths"][os_name]["prompts_fp"]), extraction
+
+
+def generate_deck(args: argparse.Namespace, config: Dict[str, Any], os_name: str, anki_ready: bool = True) -> None:
+    prompts, extraction = configure_generation(args, config, os_name)
+
+    use_inputs = config["options"]["use_inputs"].lower() in ["yes", "y"]
+    options: Dict[str, str] = helpers.get_settings(use_inputs, config, os_name)
+    max_workers = int(config["options"].get("max_concurrent_requests", 1))
+    card_filter = chunk_filter.from_config(config.get("chunk_filter"))
+    if options.get("text_file"):
+        # pages are extracted lazily, so generation starts on the first chunk while the rest is still read
+        read_pieces = extraction.iter_file if extraction is not None else file_handler.iter_file
+        pieces = read_pieces(options["text_file"], int(config["options"].get("pdf_workers", 0)))
+        if pieces is None:
+            exit(1)
+        pieces = metrics.timed_iter(pieces, "extract")
+        if card_filter is not None:
+            pieces = card_filter.pages(pieces)
+        chunks = file_handler.chunk_pieces(pieces)
+    else:
+        chunks = file_handler.chunk_text(options["text"])
+    if card_filter is not None:
+        # low-information chunks never reach the model, the others ask for cards by their score
+        chunks = card_filter.chunks(chunks, int(options["card_amount"]))
+    store = deck_store.DeckStore.for_deck(
+        options["topic"], options["deck_name"], config["filepaths"][os_name]["decks_path"]
+    )
+    manifest = job_manifest.JobManifest.for_deck(
+        options["topic"], options["deck_name"], config["filepaths"][os_name]["decks_path"]
+    )
+    if not args.resume:
+        manifest.reset()
+    # finished chunks are skipped, so a resumed or extended job only pays for the chunks still missing
+    chunks = manifest.track(chunks, options.get("text_file") or "text")
+    duplicates = helpers.load_duplicate_index(config, config["filepaths"][os_name]["decks_path"], options["deck_name"])
+    stream_to_anki = False
+    with store, manifest:
+        sink = None
+        if config["options"].get("stream_responses", "n").lower() in ["yes", "y"]:
+            # cards are written (and optionally sent to anki) while the model is still generating
+            stream_to_anki = config["options"].get("stream_to_anki", "n").lower() in ["yes", "y"]
+            if stream_to_anki and not anki_ready:
+                print("Anki is not reachable, cards are only written to the deck file.")
+                stream_to_anki = False
+            sink = helpers.CardSink(store, options["deck_name"] if stream_to_anki else None, duplicates)
+        for index, chunk_cards in helpers.generate_cards_concurrently(
+            options, config, prompts, chunks, max_workers, sink.add if sink is not None else None
+        ):
+            if chunk_cards is None:
+                manifest.fail(manifest.submitted[index], "generation failed")
+                continue
+            if sink is None:
+                store.append(duplicates.filter(chunk_cards) if duplicates is not None else chunk_cards)
+            manifest.finish(manifest.submitted[index], chunk_cards)
+            if stream_to_anki:
+                key = manifest.submitted[index]
+                manifest.add_note_ids(sink.pop_note_ids(manifest.chunks[key]["card_ids"]), key)
+        if duplicates is not None:
+            duplicates.save(config["dedup"].get("path", "./.cache/dedup_index.pickle"))
+        store.export_json()  # keeps the JSON array deck up to date for the readymade-deck path
+        cards = store.read()
+        if config["options"].get("export_apkg", "n").lower() in ["yes", "y"]:
+            apkg_export.export_apkg(cards, options["deck_name"], os.path.splitext(store.path)[0] + ".apkg")
+        # anki may have been launched at startup, it has had the whole generation time to come up
+        anki_ready = stream_to_anki or anki_handler.wait_until_ready(
+            float((config.get("anki_launch") or {}).get("ready_timeout", 60))
+        )
+        if not anki_ready:
+            print("Anki is not reachable, run again with --resume to add the cards once it is.")
+        elif not stream_to_anki:
+            # cards already in anki from an earlier run of this job are not sent again
+            helpers.add_new_cards(
+                options["deck_name"], cards, manifest, int(config["options"].get("anki_batch_size", 500))
+            )
+        counts = manifest.counts()
+
+    print(
+        f'''card creation done! deck name: {options["deck_name"]}, topic: {options["topic"]}, cards created: {len(cards)}'''
+    )
+    print(f"job manifest '{manifest.path}': {counts}")
+    if counts.get(job_manifest.FAILED) or counts.get(job_manifest.PENDING):
+        print("some chunks did not finish, run again with --resume to retry only those")
+    if ai_handler.response_cache is not None:
+        print(f"LLM response cache: {ai_handler.response_cache.stats()}")
+
+
+def run(args: argparse.Namespace) -> None:
     os_name = platform.system().lower()
     config = file_handler.read_yaml_file("config.yaml")
-    prompts = file_handler.read_yaml_file(config["filepaths"][os_name]["prompts_fp"])
-    # installation_folder = config["filepaths"][os_name]["anki_path"]
-    # installation_file = glob.glob(os.path.join(installation_folder, config["filepaths"][os_name]["installer_name"]))[0]
+    http_settings = config.get("http") or {}
+    # one pooled connection per concurrent generation request
+    http_settings.setdefault("pool_size", max(10, int(config["options"].get("max_concurrent_requests", 1))))
+    http_client.configure(http_settings)
 
-    # if not os.path.exists(config["filepaths"][os_name]["anki_exe_path"]):
-    #     anki_handler.download_anki_installation_file(dest_folder=config["filepaths"][os_name]["anki_path"])
+    launch = config.get("anki_launch") or {}
+    anki_ready = anki_handler.ensure_anki_running(
+        config["filepaths"][os_name]["anki_exe_path"],
+        launch.get("pid_file", "./.cache/anki.pid"),
+        float(launch.get("ready_timeout", 60)),
+    )
 
-    if not file_handler.is_anki_running():
-        subprocess.Popen([config["filepaths"][os_name]["anki_exe_path"]])
-        print("Anki launched!")
+    if args.batch or args.watch:
+        # extraction runs in worker processes there, each opens the cache itself
+        prompts, _ = configure_generation(args, config, os_name)
+        if args.batch:
+            batch.run_batch(args, config, os_name, prompts, anki_ready)
+        else:
+            watch.run_watch(args, config, os_name, prompts, anki_ready)
+    elif config["options"]["use_readymade_deck"].lower() in ["yes", "y"]:
+        if not anki_ready:
+            print("Anki is needed to sync the readymade deck.")
+            exit(1)
+        sync_readymade_deck(config, os_name)
     else:
-        print("Opening Anki failed. Might already be running.")
+        generate_deck(args, config, os_name, anki_ready)
 
-    if config["options"]["use_readymade_deck"].lower() in ["yes", "y"]:
-        print(
-            f"Using readymade deck: {config['options']['readymade_deck_name']}. No new cards will be created."
-        )
-        breakpoint()
-        cards = file_handler.read_json_file(
-            config["filepaths"][os_name]["decks_path"] + config["options"]["readymade_deck_name"] + ".json"
-        )
-        if not cards:
-            print("No cards found in the readymade deck file.")
-            exit(1)
-        print(f"Cards found: {len(cards)}")
-        print(f"Adding cards to deck: {config['options']['readymade_deck_name']}")
-        anki_handler.add_cards(config['options']["readymade_deck_name"], cards)
-    else:    
-        options: Dict[str, str] = helpers.get_settings(config["options"]["use_inputs"], config)
-        filename:str = ""
-        for chunk in file_handler.chunk_text(options["topic"]):
-            filename = helpers.generate_cards(options, config, prompts, chunk)
-        cards = file_handler.read_json_file(filename)
-        anki_handler.add_cards(options["deck_name"], cards)
-
-        print(
-            f'''card creation done! deck name: {options["deck_name"]}, topic: {options["topic"]}, cards created: {len(cards)}'''
-        )
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Generate flashcards with an LLM and add them to Anki.")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the LLM response cache")
+    parser.add_argument("--refresh-cache", action="store_true", help="ignore cached LLM replies and store fresh ones")
+    parser.add_argument(
+        "--invalidate-extraction-cache", action="store_true", help="drop cached text extracted from source files"
+    )
+    parser.add_argument(
+        "--metrics-out", help="write run metrics to this file, Prometheus text format for .prom, JSON lines otherwise"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the deck's last job: skip finished chunks, retry failed or pending ones and only process new ones",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="SOURCE",
+        help="make decks from every document in a directory or matching a glob, without asking anything",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and make cards from every document dropped into files_path",
+    )
+    parser.add_argument(
+        "--merge-deck", metavar="NAME", help="with --batch or --watch, put all cards into this one deck"
+    )
+    parser.add_argument("--topic", help="with --batch or --watch, the topic instead of the one in config.yaml")
+    parser.add_argument(
+        "--card-amount", type=int, help="with --batch or --watch, cards per chunk instead of config.yaml's"
+    )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        help="with --batch or --watch, document extraction processes (default: CPU count)",
+    )
+    parser.add_argument("--batch-report", help="with --batch, write the summary report to this JSON file")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], help="profile the whole run")
+    parser.add_argument("--profile-out", help="save the profile here instead of printing it")
+    return parser
+
+
+def main(argv: List[str] | None = None) -> None:
+    """
+    Command line entry point.
+
+    Only light modules are imported up front: readers, the tokenizer, numpy and the LLM and HTTP client
+    libraries are loaded on first use, so a readymade-deck sync never pays for them.
+    `python -m benchmarks.bench_import_time` checks that this stays true.
+
+    Args:
+        argv (list of str or None): Command line arguments, sys.argv[1:] if None.
+    """
+
+    args = build_parser().parse_args(argv)
+    try:
+        with metrics.profile(args.profile, args.profile_out):
+            run(args)
+    finally:
+        if args.metrics_out:
+            metrics.registry.write(args.metrics_out)
+            print(f"Metrics written to '{args.metrics_out}'")
+        print("Run metrics:")
+        print(metrics.registry.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import contextlib
+import functools
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+LabelKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> LabelKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    Thread-safe in-process store for pipeline counters and timings.
+
+    Counters add up values such as cards, tokens, bytes or retries. Timers keep the count, total, min and max
+    of observed durations. Both are identified by a name plus optional labels, e.g. provider="ollama".
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Dict[LabelKey, float] = {}
+        self.timers: Dict[LabelKey, Dict[str, float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = {"count": 1, "sum": seconds, "min": seconds, "max": seconds}
+            else:
+                timer["count"] += 1
+                timer["sum"] += seconds
+                timer["min"] = min(timer["min"], seconds)
+                timer["max"] = max(timer["max"], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """
+        Time the enclosed block, failed blocks are recorded with status="error".
+
+        Args:
+            name (str): Timer name, e.g. "llm_request".
+            **labels: Extra labels for the timer.
+        """
+
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, status=status, **labels)
+
+    def timed(self, name: str, **labels: Any) -> Callable[[Callable[..., T]], Callable[..., T]]:
+        """Decorator version of `timer`."""
+
+        def decorator(func: Callable[..., T]) -> Callable[..., T]:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> T:
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def timed_iter(self, iterable: Iterable[T], name: str, **labels: Any) -> Iterator[T]:
+        """
+        Pass items through while timing how long producing them took, for lazy stages like extraction.
+
+        Args:
+            iterable (iterable): The lazy stage.
+            name (str): Timer name; one observation covers the whole iteration.
+            **labels: Extra labels for the timer.
+
+        Yields:
+            The items of iterable, unchanged.
+        """
+
+        elapsed = 0.0
+        items = 0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - start
+                    break
+                elapsed += time.perf_counter() - start
+                items += 1
+                yield item
+        finally:
+            self.observe(name, elapsed, **labels)
+            self.inc(f"{name}_items_total", items, **labels)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        Return every metric as a flat record.
+
+        Returns:
+            list of dict: One record per counter or timer with 'type', 'name', 'labels' and its values.
+        """
+
+        with self._lock:
+            records: List[Dict[str, Any]] = [
+                {"type": "counter", "name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            records += [
+                {"type": "timer", "name": name, "labels": dict(labels), **values}
+                for (name, labels), values in sorted(self.timers.items())
+            ]
+        return records
+
+    def to_jsonl(self) -> str:
+        timestamp = time.time()
+        return "".join(json.dumps({"timestamp": timestamp, **record}) + "\n" for record in self.snapshot())
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        typed: set[str] = set()
+        for record in self.snapshot():
+            labels = ",".join(f'{label}="{value}"' for label, value in record["labels"].items())
+            labels = f"{{{labels}}}" if labels else ""
+            if record["type"] == "counter":
+                name = f"flashcards_{record['name']}"
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{labels} {record['value']}")
+            else:
+                name = f"flashcards_{record['name']}_seconds"
+                if name not in typed:
+                    lines.append(f"# TYPE {name} summary")
+                    typed.add(name)
+                lines.append(f"{name}_count{labels} {record['count']}")
+                lines.append(f"{name}_sum{labels} {record['sum']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, filepath: str) -> None:
+        """
+        Export the registry to a file, Prometheus text format for `.prom` files and JSON lines otherwise.
+
+        Args:
+            filepath (str): Target path; JSON lines are appended, Prometheus files are overwritten.
+        """
+
+        if filepath.endswith(".prom"):
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+        else:
+            with open(filepath, "a", encoding="utf-8") as f:
+                f.write(self.to_jsonl())
+
+    def summary(self) -> str:
+        lines: List[str] = []
+        for record in self.snapshot():
+            labels = ", ".join(f"{label}={value}" for label, value in record["labels"].items())
+            labels = f" ({labels})" if labels else ""
+            if record["type"] == "counter":
+                lines.append(f"  {record['name']}{labels}: {record['value']:g}")
+            else:
+                lines.append(
+                    f"  {record['name']}{labels}: {record['count']:g}x, total {record['sum']:.3f}s, "
+                    f"max {record['max']:.3f}s"
+                )
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+registry = MetricsRegistry()
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
+timed_iter = registry.timed_iter
+
+
+@contextlib.contextmanager
+def profile(profiler: str | None, output: str | None = None) -> Iterator[None]:
+    """
+    Optionally profile the enclosed block with cProfile or pyinstrument.
+
+    Args:
+        profiler (str or None): "cprofile", "pyinstrument", or None to do nothing.
+        output (str or None): File to save the profile to (pstats data for cProfile, HTML for pyinstrument).
+            Without it a summary is printed.
+
+    Raises:
+        ValueError: If profiler is not a known profiler.
+        ImportError: If pyinstrument is requested but not installed.
+    """
+
+    if profiler is None:
+        yield
+        return
+
+    if profiler == "cprofile":
+        import cProfile
+        import pstats
+
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            if output:
+                prof.dump_stats(output)
+                print(f"cProfile data saved to '{output}'")
+            else:
+                pstats.Stats(prof).sort_stats("cumulative").print_stats(30)
+    elif profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError as err:
+            raise ImportError("pyinstrument is not installed, run 'pip install pyinstrument'.") from err
+
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            if output:
+                with open(output, "w", encoding="utf-8") as f:
+                    f.write(prof.output_html())
+                print(f"pyinstrument report saved to '{output}'")
+            else:
+                print(prof.output_text(unicode=True, color=False))
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}")
@@ -0,0 +1,175 @@
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+
+import metrics
+
+# sends one request: (provider, model, ollama host or None, options) -> reply
+Leg = Callable[[str, str, str | None, Dict[str, Any] | None], str]
+
+
+class Router:
+    """
+    Picks where an LLM request goes and hedges requests that run too long.
+
+    Ollama requests are spread round-robin over ollama_hosts. With a hedge target configured, a request
+    that has not finished after the given percentile of the recent latencies of its model is sent a
+    second time, to the hedge target, and whichever reply arrives first is used. Only the slowest
+    (100 - percentile) % of requests are hedged, so the extra cost stays at that share.
+
+    Args:
+        ollama_hosts (list of str): Ollama base URLs to rotate through, empty for the default host.
+        hedge (dict or None): Hedge target with optional 'provider', 'model' and 'options', each defaulting
+            to the primary request's. With several Ollama hosts, an Ollama hedge goes to the next host.
+        percentile (float): Latency percentile of the primary model after which the hedge is sent.
+        min_delay (float): Lower bound of the hedge delay in seconds.
+        max_delay (float): Upper bound of the hedge delay, also used until min_samples latencies are known.
+        window (int): Number of recent latencies per model the percentile is taken over.
+        min_samples (int): Latencies needed before the percentile is trusted.
+        max_workers (int): Threads for running hedged requests side by side. Every in-flight request takes
+            one for its primary and one for its hedge, so this should be twice the request concurrency;
+            with fewer, hedges queue behind primaries and only start once those have finished.
+    """
+
+    def __init__(
+        self,
+        ollama_hosts: List[str] | None = None,
+        hedge: Dict[str, Any] | None = None,
+        percentile: float = 95,
+        min_delay: float = 2.0,
+        max_delay: float = 120.0,
+        window: int = 200,
+        min_samples: int = 20,
+        max_workers: int = 16,
+    ) -> None:
+        self.ollama_hosts = list(ollama_hosts or [])
+        self.hedge = hedge
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self._hosts = itertools.cycle(self.ollama_hosts) if self.ollama_hosts else None
+        self._latencies: Dict[tuple[str, str], deque[float]] = {}
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def next_host(self, provider: str) -> str | None:
+        if provider != "ollama" or self._hosts is None:
+            return None
+        with self._lock:
+            return next(self._hosts)
+
+    def record(self, provider: str, model: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault((provider, model), deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, provider: str, model: str) -> float:
+        """
+        Seconds to wait for a primary request before hedging it.
+
+        Args:
+            provider (str): Provider of the primary request.
+            model (str): Model of the primary request.
+
+        Returns:
+            float: The configured percentile of the model's recent latencies, clamped to [min_delay, max_delay].
+        """
+
+        with self._lock:
+            latencies = sorted(self._latencies.get((provider, model), ()))
+        if len(latencies) < self.min_samples:
+            return self.max_delay
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return min(self.max_delay, max(self.min_delay, latencies[index]))
+
+    def _timed(self, leg: Leg, provider: str, model: str, host: str | None, options: Dict[str, Any] | None) -> str:
+        start = time.perf_counter()
+        reply = leg(provider, model, host, options)
+        self.record(provider, model, time.perf_counter() - start)
+        return reply
+
+    def send(self, provider: str, model: str, options: Dict[str, Any] | None, leg: Leg) -> str:
+        """
+        Send a request, hedging it if it runs longer than usual.
+
+        Args:
+            provider (str): Provider of the primary request.
+            model (str): Model of the primary request.
+            options (dict or None): Request options of the primary request.
+            leg (callable): Sends one request, see `Leg`.
+
+        Returns:
+            str: The first reply that arrives.
+
+        Raises:
+            Exception: The primary's error if every sent request failed.
+        """
+
+        host = self.next_host(provider)
+        if self.hedge is None:
+            return self._timed(leg, provider, model, host, options)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+        primary = self._executor.submit(self._timed, leg, provider, model, host, options)
+        done, _ = wait([primary], timeout=self.hedge_delay(provider, model))
+        if done:
+            return primary.result()
+
+        hedge_provider = self.hedge.get("provider") or provider
+        hedge_model = self.hedge.get("model") or model
+        hedge_options = self.hedge.get("options", options)
+        hedge_host = self.next_host(hedge_provider)
+        print(f"{provider}/{model} is slow, hedging with {hedge_provider}/{hedge_model}")
+        secondary = self._executor.submit(self._timed, leg, hedge_provider, hedge_model, hedge_host, hedge_options)
+
+        pending: set[Future[str]] = {primary, secondary}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    metrics.inc("llm_hedges_total", winner="primary" if future is primary else "hedge")
+                    return future.result()
+        metrics.inc("llm_hedges_total", winner="none")
+        return primary.result()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def from_config(settings: Dict[str, Any] | None, max_concurrent_requests: int = 8) -> Router:
+    """
+    Build a Router from the `routing` section of config.yaml.
+
+    Args:
+        settings (dict or None): The `routing` config section, keys: ollama_hosts and hedge, the latter
+            with enabled, provider, model, options, percentile, min_delay, max_delay, window and min_samples.
+        max_concurrent_requests (int): Number of requests sent at once, sizes the hedge thread pool.
+
+    Returns:
+        Router: The router.
+    """
+
+    settings = settings or {}
+    hedge_settings = settings.get("hedge") or {}
+    hedge = None
+    if hedge_settings.get("enabled", False):
+        hedge = {key: hedge_settings[key] for key in ("provider", "model", "options") if hedge_settings.get(key)}
+    return Router(
+        ollama_hosts=settings.get("ollama_hosts") or [],
+        hedge=hedge,
+        percentile=float(hedge_settings.get("percentile", 95)),
+        min_delay=float(hedge_settings.get("min_delay", 2.0)),
+        max_delay=float(hedge_settings.get("max_delay", 120.0)),
+        window=int(hedge_settings.get("window", 200)),
+        min_samples=int(hedge_settings.get("min_samples", 20)),
+        max_workers=2 * max(1, max_concurrent_requests),
+    )
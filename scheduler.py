@@ -0,0 +1,278 @@
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+# statuses worth retrying: request timeout, conflict, throttling and server-side failures
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per-minute rate.
+
+    Reservations are taken immediately and may drive the bucket negative, the caller then waits until
+    the debt is paid back. Concurrent callers thereby queue up in order and the sustained rate stays at
+    the limit. The bucket holds at most ten seconds' worth of tokens, which bounds the burst after idling.
+
+    Args:
+        per_minute (float): Refill rate, e.g. the provider's requests or tokens per minute.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens, not thread-safe on its own.
+
+        Args:
+            amount (float): Tokens to take.
+
+        Returns:
+            float: Seconds the caller has to wait before using the reservation.
+        """
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def drain(self) -> None:
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RequestScheduler:
+    """
+    Gate in front of the LLM providers that paces requests and retries transient failures.
+
+    Every request first reserves capacity from the request and token buckets of its provider and
+    model, so concurrent workers are spread out to the configured limits instead of running into
+    them. Throttled (429), timed out and failed server-side requests are retried with jittered
+    exponential backoff; a Retry-After header is honored and pauses every request to that provider
+    and model, not just the one that got throttled.
+
+    Args:
+        limits (dict): Limits keyed by "provider/model", "provider" or "default", first match wins.
+            Each holds requests_per_minute and tokens_per_minute, 0 or missing for no limit.
+        max_attempts (int): Attempts per request, including the first one.
+        base_delay (float): Backoff before the second attempt, doubled for every further one.
+        max_delay (float): Upper bound of a single backoff.
+        expected_completion_tokens (int): Tokens reserved for a reply when the request does not cap its length.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, float]] | None = None,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        expected_completion_tokens: int = 1000,
+    ) -> None:
+        self.limits = limits or {}
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expected_completion_tokens = expected_completion_tokens
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, tuple[TokenBucket | None, TokenBucket | None]] = {}
+        self._blocked_until: Dict[str, float] = {}
+
+    def _limit_key(self, provider: str, model: str) -> str:
+        for key in (f"{provider}/{model}", provider):
+            if key in self.limits:
+                return key
+        return "default"
+
+    def _buckets_for(self, key: str) -> tuple[TokenBucket | None, TokenBucket | None]:
+        if key not in self._buckets:
+            limit = self.limits.get(key) or {}
+            rpm = float(limit.get("requests_per_minute") or 0)
+            tpm = float(limit.get("tokens_per_minute") or 0)
+            self._buckets[key] = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+        return self._buckets[key]
+
+    def estimate_tokens(self, prompt: str, options: Mapping[str, Any] | None = None) -> int:
+        # about four characters per token; the reply is budgeted at its cap if the request sets one
+        options = options or {}
+        completion = options.get("max_tokens") or options.get("num_predict") or self.expected_completion_tokens
+        return len(prompt) // 4 + int(completion)
+
+    def acquire(self, provider: str, model: str, tokens: int = 0) -> None:
+        """
+        Block until a request of the given size may be sent.
+
+        Args:
+            provider (str): Provider name, e.g. "openai".
+            model (str): Model name.
+            tokens (int): Estimated prompt plus completion tokens of the request.
+        """
+
+        key = self._limit_key(provider, model)
+        with self._lock:
+            request_bucket, token_bucket = self._buckets_for(key)
+            wait = max(0.0, self._blocked_until.get(key, 0.0) - time.monotonic())
+            if request_bucket is not None:
+                wait = max(wait, request_bucket.reserve(1))
+            if token_bucket is not None and tokens:
+                wait = max(wait, token_bucket.reserve(tokens))
+        if wait > 0:
+            metrics.observe("rate_limit_wait", wait, provider=provider, model=model)
+            time.sleep(wait)
+
+    def settle(self, provider: str, model: str, reserved: int, used: int) -> None:
+        """Correct a token reservation once the actual usage of the request is known."""
+        with self._lock:
+            _, token_bucket = self._buckets_for(self._limit_key(provider, model))
+            if token_bucket is not None:
+                token_bucket.tokens += reserved - used
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Delay before the next attempt.
+
+        Args:
+            attempt (int): Number of the attempt that just failed, starting at 1.
+            retry_after (float or None): Delay requested by the server.
+
+        Returns:
+            float: Seconds to wait, full jitter over the exponential delay unless the server asked for one.
+        """
+
+        if retry_after is not None:
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.1))
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def throttled(self, provider: str, model: str, retry_after: float) -> None:
+        """Pause every request to provider and model for retry_after seconds."""
+        key = self._limit_key(provider, model)
+        with self._lock:
+            self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), time.monotonic() + retry_after)
+            for bucket in self._buckets_for(key):
+                if bucket is not None:
+                    bucket.drain()
+
+    def call(self, provider: str, model: str, func: Callable[[], T], tokens: int = 0) -> T:
+        """
+        Run one provider request under the limits, retrying transient failures.
+
+        Args:
+            provider (str): Provider name, e.g. "openai".
+            model (str): Model name.
+            func (callable): Sends the request and returns its result.
+            tokens (int): Estimated prompt plus completion tokens, see `estimate_tokens`.
+
+        Returns:
+            The result of func.
+
+        Raises:
+            Exception: The last error if it is not transient or every attempt failed.
+        """
+
+        for attempt in range(1, self.max_attempts + 1):
+            self.acquire(provider, model, tokens)
+            try:
+                return func()
+            except Exception as err:
+                retryable, status, retry_after = classify_error(err)
+                if not retryable or attempt == self.max_attempts:
+                    raise
+                delay = self.backoff(attempt, retry_after)
+                if status == 429:
+                    self.throttled(provider, model, delay)
+                metrics.inc("llm_retries_total", provider=provider, model=model, reason=str(status or "connection"))
+                print(f"{provider} request failed ({err}), retrying in {delay:.1f}s, attempt {attempt}/{self.max_attempts}")
+                time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    """
+    Read the delay a server asks for from Retry-After (seconds or an HTTP date) or retry-after-ms.
+
+    Args:
+        headers (mapping): Response headers, case-insensitive.
+
+    Returns:
+        float or None: Seconds to wait, or None if the server did not say.
+    """
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _loaded(module: str, *names: str) -> tuple[type, ...]:
+    # an error can only come from a client library that has been imported, the others are not loaded for the check
+    loaded = sys.modules.get(module)
+    return tuple(getattr(loaded, name) for name in names) if loaded is not None else ()
+
+
+def classify_error(err: Exception) -> tuple[bool, int | None, float | None]:
+    """
+    Decide whether a failed provider request is worth retrying.
+
+    Args:
+        err (Exception): The error raised by the request.
+
+    Returns:
+        tuple: (retryable, HTTP status or None, Retry-After seconds or None).
+    """
+
+    status_errors = _loaded("requests", "HTTPError") + _loaded("httpx", "HTTPStatusError")
+    if isinstance(err, status_errors) and getattr(err, "response", None) is not None:
+        status = err.response.status_code  # type: ignore[attr-defined]
+        return status in RETRYABLE_STATUSES, status, parse_retry_after(err.response.headers)  # type: ignore[attr-defined]
+    if isinstance(err, _loaded("ollama", "ResponseError")):
+        return err.status_code in RETRYABLE_STATUSES, err.status_code, None  # type: ignore[attr-defined]
+    transport_errors = _loaded("requests", "ConnectionError", "Timeout") + _loaded("httpx", "TransportError")
+    if isinstance(err, transport_errors + (ConnectionError, TimeoutError)):
+        return True, None, None
+    return False, None, None
+
+
+def from_config(settings: Dict[str, Any] | None) -> RequestScheduler:
+    """
+    Build a RequestScheduler from the `rate_limits` section of config.yaml.
+
+    Args:
+        settings (dict or None): The `rate_limits` config section, keys: max_attempts, base_delay, max_delay,
+            expected_completion_tokens, plus limit sections named "default", a provider or "provider/model".
+
+    Returns:
+        RequestScheduler: The scheduler.
+    """
+
+    settings = dict(settings or {})
+    return RequestScheduler(
+        limits={key: value for key, value in settings.items() if isinstance(value, dict)},
+        max_attempts=int(settings.get("max_attempts", 5)),
+        base_delay=float(settings.get("base_delay", 1.0)),
+        max_delay=float(settings.get("max_delay", 60.0)),
+        expected_completion_tokens=int(settings.get("expected_completion_tokens", 1000)),
+    )
@@ -0,0 +1,438 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import signal
+import struct
+import time
+from typing import Any, Dict, List
+
+import anki_handler
+import batch
+import deck_store
+import extraction_cache
+import file_handler
+import metrics
+
+# inotify(7) flags and event bits
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, followed by len bytes of name
+
+# partial downloads, office lock files and editor backups
+_TEMPORARY_PREFIXES = (".", "~$")
+_TEMPORARY_SUFFIXES = (".part", ".crdownload", ".tmp", ".swp", "~")
+
+# seconds between AnkiConnect probes while anki is down, doubled after every failed probe
+_PROBE_DELAY = 5.0
+_MAX_PROBE_DELAY = 300.0
+
+
+def is_document(path: str) -> bool:
+    name = os.path.basename(path)
+    if name.startswith(_TEMPORARY_PREFIXES) or name.endswith(_TEMPORARY_SUFFIXES):
+        return False
+    return name.split(".")[-1].lower() in file_handler.stream_handlers
+
+
+def scan(root: str, recursive: bool = True) -> Dict[str, tuple[int, int]]:
+    """
+    List the documents under a directory.
+
+    Args:
+        root (str): The directory.
+        recursive (bool): Whether to include subdirectories.
+
+    Returns:
+        dict: (mtime in ns, size) of every document, by path.
+    """
+
+    found: Dict[str, tuple[int, int]] = {}
+    for directory, subdirectories, files in os.walk(root):
+        if not recursive:
+            subdirectories.clear()
+        for name in files:
+            path = os.path.join(directory, name)
+            if not is_document(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed while scanning
+            found[path] = (stat.st_mtime_ns, stat.st_size)
+    return found
+
+
+class PollingWatcher:
+    """
+    Finds new and changed documents by comparing directory scans, works on every platform.
+
+    Args:
+        root (str): The watched directory.
+        recursive (bool): Whether to watch subdirectories too.
+        interval (float): Seconds between scans.
+    """
+
+    name = "polling"
+
+    def __init__(self, root: str, recursive: bool = True, interval: float = 2.0) -> None:
+        self.root = root
+        self.recursive = recursive
+        self.interval = interval
+        self._snapshot = scan(root, recursive)
+        self._next_scan = time.monotonic() + interval
+
+    def changes(self, timeout: float) -> List[str]:
+        """Wait up to timeout seconds and return the documents that appeared or changed since the last call."""
+        wait = self._next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(0.0, timeout))
+            return []
+        time.sleep(max(0.0, wait))
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = scan(self.root, self.recursive)
+        changed = [path for path, stat in snapshot.items() if self._snapshot.get(path) != stat]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    Finds new and changed documents with Linux inotify, called through ctypes so no extra package is needed.
+
+    The kernel reports every write, close and rename in the watched directories as it happens, nothing
+    is scanned. New subdirectories are watched as they appear. If the kernel's event queue overflows,
+    the next call reports every document, and the content hashes of the daemon sort out what changed.
+
+    Args:
+        root (str): The watched directory.
+        recursive (bool): Whether to watch subdirectories too.
+
+    Raises:
+        OSError: If inotify is not available, e.g. on another OS or when the watch limit is reached.
+    """
+
+    name = "inotify"
+
+    def __init__(self, root: str, recursive: bool = True) -> None:
+        self.root = root
+        self.recursive = recursive
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        self._directories: Dict[int, str] = {}
+        try:
+            self._watch_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _watch_tree(self, top: str) -> List[str]:
+        # watches top and, if recursive, its subdirectories; returns the documents already in them,
+        # which were written before the watch existed
+        documents = []
+        for directory, subdirectories, files in os.walk(top):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch '{directory}': {os.strerror(errno)}")
+            self._directories[wd] = directory
+            documents.extend(os.path.join(directory, name) for name in files)
+            if not self.recursive:
+                break
+        return documents
+
+    def changes(self, timeout: float) -> List[str]:
+        """Wait up to timeout seconds and return the documents that were written to since the last call."""
+        readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed: List[str] = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size : offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                metrics.inc("watch_overflows_total")
+                changed.extend(scan(self.root, self.recursive))
+                continue
+            directory = self._directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        changed.extend(self._watch_tree(path))
+                    except OSError as err:
+                        print(f"Cannot watch '{path}' - {err}")
+                continue
+            changed.append(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def make_watcher(
+    root: str, recursive: bool = True, poll_interval: float = 2.0, use_inotify: bool = True
+) -> InotifyWatcher | PollingWatcher:
+    """
+    Watch a directory with inotify where possible, by polling otherwise.
+
+    Args:
+        root (str): The watched directory.
+        recursive (bool): Whether to watch subdirectories too.
+        poll_interval (float): Seconds between scans of the polling watcher.
+        use_inotify (bool): Whether to try inotify first.
+
+    Returns:
+        InotifyWatcher or PollingWatcher: The watcher.
+    """
+
+    if use_inotify:
+        try:
+            return InotifyWatcher(root, recursive)
+        except (OSError, AttributeError) as err:
+            # AttributeError: a libc without inotify functions, e.g. macOS
+            print(f"inotify is not available ({err}), polling '{root}' every {poll_interval:g} s instead")
+    return PollingWatcher(root, recursive, poll_interval)
+
+
+class Debouncer:
+    """
+    Holds back a file until it has not been written to for `delay` seconds.
+
+    A file that is still being copied gets an event for every write; each one pushes its turn back. When
+    the turn comes the file's size and modification time are compared to those at its last event, so a
+    write the watcher did not report also pushes it back.
+
+    Args:
+        delay (float): Quiet seconds after the last write.
+    """
+
+    def __init__(self, delay: float = 2.0) -> None:
+        self.delay = delay
+        self._due: Dict[str, float] = {}
+        self._stats: Dict[str, tuple[int, int] | None] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    @staticmethod
+    def _stat(path: str) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def touch(self, path: str, delay: float | None = None) -> None:
+        self._due[path] = time.monotonic() + (self.delay if delay is None else delay)
+        self._stats[path] = self._stat(path)
+
+    def timeout(self, default: float) -> float:
+        # seconds until the next file is due, for the watcher to wait at most that long
+        if not self._due:
+            return default
+        return max(0.0, min(default, min(self._due.values()) - time.monotonic()))
+
+    def pop_ready(self) -> List[str]:
+        now = time.monotonic()
+        ready = []
+        for path, due in list(self._due.items()):
+            if due > now:
+                continue
+            stat = self._stat(path)
+            if stat is None:
+                del self._due[path], self._stats[path]  # removed again
+            elif stat != self._stats[path]:
+                self.touch(path)
+            else:
+                del self._due[path], self._stats[path]
+                ready.append(path)
+        return sorted(ready)
+
+
+class WatchState:
+    """
+    Content hashes of the documents the daemon has made cards from, kept across restarts.
+
+    A document is identified by the sha256 of its content: saving it again unchanged, touching it or
+    dropping in a copy under another name is not new material.
+
+    Args:
+        path (str): Path of the state `.json` file, created on the first save.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.hashes: Dict[str, str] = {}  # content hash -> path it was processed as
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.hashes = json.load(f).get("hashes", {})
+
+    def seen(self, digest: str) -> str | None:
+        return self.hashes.get(digest)
+
+    def record(self, digest: str, path: str) -> None:
+        self.hashes[digest] = path
+
+    def save(self) -> None:
+        deck_store.write_atomic(self.path, json.dumps({"hashes": self.hashes}, indent=2, ensure_ascii=False))
+
+
+def _stop(signum: int, frame: Any) -> None:
+    raise KeyboardInterrupt
+
+
+def new_documents(paths: List[str], state: WatchState) -> Dict[str, str]:
+    """
+    Keep the documents whose content has not been processed yet.
+
+    Args:
+        paths (list of str): Documents that were written to.
+        state (WatchState): Hashes of the processed documents.
+
+    Returns:
+        dict: Content hash of each new or changed document, by path.
+    """
+
+    new: Dict[str, str] = {}
+    for path in paths:
+        try:
+            digest = extraction_cache.file_sha256(path)
+        except OSError:
+            continue
+        seen = state.seen(digest) or next((other for other, known in new.items() if known == digest), None)
+        if seen is None:
+            new[path] = digest
+            metrics.inc("watch_files_total", result="new")
+        elif seen != path:
+            print(f"Skipping '{path}', same content as '{seen}'")
+            metrics.inc("watch_files_total", result="copy")
+        else:
+            metrics.inc("watch_files_total", result="unchanged")
+    return new
+
+
+def run_watch(args: Any, config: Dict[str, Any], os_name: str, prompts: Dict[str, str], anki_ready: bool) -> None:
+    """
+    Keep making cards from documents dropped into files_path, until stopped with Ctrl+C or SIGTERM.
+
+    A new or changed document is picked up once it has been quiet for debounce_seconds (see `Debouncer`)
+    and its content hash is new (see `WatchState`); documents added while the daemon was stopped are
+    picked up at startup. Everything that is ready at the same time is one round of a `batch.BatchRunner`,
+    which stays up between rounds: its extraction processes keep the tokenizer loaded, the HTTP session
+    and ollama clients keep their connections, and ollama's keep_alive keeps the model loaded. A
+    changed document only costs its new chunks, since the decks' job manifests are resumed.
+
+    Cards made while Anki is not reachable are added once it is.
+
+    Args:
+        args (argparse.Namespace): Command line arguments: watch, merge_deck, topic, card_amount and
+            extract_workers.
+        config (dict): The configuration, reads the `watch` section.
+        os_name (str): Key of the `filepaths` section to take files_path and decks_path from.
+        prompts (dict): Prompt templates.
+        anki_ready (bool): Whether Anki is reachable at startup.
+    """
+
+    from concurrent.futures.process import BrokenProcessPool
+
+    settings = config.get("watch") or {}
+    root = config["filepaths"][os_name]["files_path"]
+    recursive = bool(settings.get("recursive", True))
+    os.makedirs(root, exist_ok=True)
+    state = WatchState(settings.get("state_path", "./.cache/watch_state.json"))
+    runner = batch.BatchRunner(
+        config,
+        os_name,
+        prompts,
+        topic=args.topic,
+        card_amount=args.card_amount,
+        merge_deck=args.merge_deck,
+        resume=True,
+        extract_workers=args.extract_workers,
+        anki_ready=anki_ready,
+    )
+    file_handler.get_encoder()  # packing counts tokens in this process
+    pool = runner.start_pool()
+    watcher = make_watcher(
+        root, recursive, float(settings.get("poll_interval", 2.0)), bool(settings.get("use_inotify", True))
+    )
+    debouncer = Debouncer(float(settings.get("debounce_seconds", 2.0)))
+    for path in scan(root, recursive):
+        debouncer.touch(path, 0)
+    unsynced: Dict[str, str] = {}  # documents whose cards are not in anki yet
+    # while anki is down, unsynced documents alone make it be probed with exponential backoff
+    probe_delay, next_probe = _PROBE_DELAY, 0.0
+
+    signal.signal(signal.SIGTERM, _stop)  # a service manager stops the daemon like Ctrl+C does
+    print(f"Watching '{root}' for new documents ({watcher.name}), press Ctrl+C to stop")
+    try:
+        while True:
+            for path in watcher.changes(debouncer.timeout(5.0)):
+                if is_document(path):
+                    debouncer.touch(path)
+            documents = new_documents(debouncer.pop_ready(), state)
+            if not documents and not (unsynced and time.monotonic() >= next_probe):
+                continue
+            runner.anki_ready = anki_handler.probe()
+            if runner.anki_ready:
+                probe_delay = _PROBE_DELAY
+            else:
+                next_probe = time.monotonic() + probe_delay
+                probe_delay = min(probe_delay * 2, _MAX_PROBE_DELAY)
+            if runner.anki_ready and unsynced:
+                # the manifests know the chunks are done, the round only adds the cards to anki
+                documents = {**unsynced, **documents}
+                unsynced = {}
+            if not documents:
+                continue
+
+            try:
+                report = runner.run(list(documents), pool, batch.deck_names(list(documents), root))
+            except BrokenProcessPool as err:
+                # an extraction process crashed, e.g. out of memory on a huge document
+                print(f"Extraction pool broke, restarting it and retrying the round - {err}")
+                pool.shutdown(cancel_futures=True)
+                pool = runner.start_pool()
+                for path in documents:
+                    debouncer.touch(path)
+                continue
+            for entry in report["files"]:
+                if entry["status"] in ("done", "unreadable"):
+                    state.record(documents[entry["path"]], entry["path"])
+                    if not runner.anki_ready and entry["status"] == "done":
+                        unsynced[entry["path"]] = documents[entry["path"]]
+                elif entry["status"] == "incomplete":
+                    print(f"'{entry['path']}' has failed chunks, save it again to retry them")
+            state.save()
+            batch.print_summary(report)
+    except KeyboardInterrupt:
+        print("Stopping the watcher")
+    finally:
+        watcher.close()
+        pool.shutdown(cancel_futures=True)